@@ -0,0 +1,199 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Benchmark of buffering of image data streamed by `FileLikeProxy`.
+
+Image of `size` MB is read from in-memory source through:
+ - string - string buffer grown by concatenation and sliced by
+   `CHUNK_SIZE`, as `FileLikeProxy.speed_limited_read` did before
+   `StreamBuffer`;
+ - buffer - `StreamBuffer`, data is returned as string (what glance
+   client gets);
+ - view - `StreamBuffer`, memoryviews are returned as is.
+
+Every reader is measured with consumer reading 8 KB (httplib), 64 KB
+(glance client chunked upload), `CHUNK_SIZE` blocks and reading without
+size, which source answers with blocks of `source_block` MB (httplib
+response returns the whole image).
+
+Reported are MB/s, number and size of data buffers (strings) allocated
+per GB of image: by source reads, concatenation and slicing of strings and
+copying of memoryviews into strings. Memoryview objects don't hold data
+and are not counted.
+
+Usage: python -m benchmarks.image_streaming [-s SIZE] [-b SOURCE_BLOCK]
+           [-r REPEAT]
+"""
+
+import argparse
+import gc
+import time
+
+from cloudferrylib.utils import file_like_proxy
+
+MB = 1024 * 1024
+# None - read without size
+READ_SIZES = (8 * 1024, 64 * 1024, file_like_proxy.CHUNK_SIZE, None)
+
+
+class Allocations(object):
+    """Counter of data buffers allocated"""
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+
+    def add(self, size):
+        if size:
+            self.count += 1
+            self.bytes += size
+
+
+class Source(object):
+    """Stream of :size bytes returning up to :block bytes per read.
+
+    Every read returns new string, as socket reads do.
+    """
+
+    def __init__(self, size, block, allocations):
+        self.left = size
+        self.block = block
+        self.data = b'x' * block
+        self.allocations = allocations
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.block
+        size = min(size, self.block, self.left)
+        self.left -= size
+        self.allocations.add(size)
+        return self.data[:size]
+
+
+class StringReader(object):
+    """Buffering of `FileLikeProxy` before `StreamBuffer`"""
+
+    def __init__(self, source, allocations):
+        self.resp = source
+        self.buffer = ''
+        self.allocations = allocations
+
+    def read(self, *args):
+        if len(self.buffer) < file_like_proxy.CHUNK_SIZE:
+            data = self.resp.read(*args)
+            if self.buffer and data:
+                self.allocations.add(len(self.buffer) + len(data))
+            self.buffer += data
+        res = self.buffer[0:file_like_proxy.CHUNK_SIZE]
+        self.buffer = self.buffer[file_like_proxy.CHUNK_SIZE::]
+        # slices of whole string are the string itself
+        if len(res) + len(self.buffer) > file_like_proxy.CHUNK_SIZE:
+            self.allocations.add(len(res))
+            self.allocations.add(len(self.buffer))
+        return res
+
+
+class BufferReader(object):
+    """Buffering of `FileLikeProxy.speed_limited_read`"""
+
+    def __init__(self, source, allocations):
+        self.buffer = file_like_proxy.StreamBuffer(source)
+        self.allocations = allocations
+
+    def read(self, size=None):
+        if size is None:
+            size = file_like_proxy.CHUNK_SIZE
+        res = self.buffer.read(size)
+        if isinstance(res, memoryview):
+            res = res.tobytes()
+            self.allocations.add(len(res))
+        return res
+
+
+class ViewReader(BufferReader):
+    def read(self, size=None):
+        return self.buffer.read(size or file_like_proxy.CHUNK_SIZE)
+
+
+READERS = (('string', StringReader), ('buffer', BufferReader),
+           ('view', ViewReader))
+
+
+def stream(reader, read_size):
+    args = () if read_size is None else (read_size,)
+    total = 0
+    while True:
+        size = len(reader.read(*args))
+        if not size:
+            return total
+        total += size
+
+
+def measure(reader_class, size, source_block, read_size):
+    gc.collect()
+    allocations = Allocations()
+    reader = reader_class(Source(size, source_block, allocations),
+                          allocations)
+    start = time.time()
+    total = stream(reader, read_size)
+    elapsed = time.time() - start
+    if total != size:
+        raise RuntimeError("%s read %d bytes of %d" % (reader_class.__name__,
+                                                       total, size))
+    return elapsed, allocations
+
+
+def run(size=1024, source_block=8, repeat=3):
+    results = {}
+    for read_size in READ_SIZES:
+        for name, reader_class in READERS:
+            runs = [measure(reader_class, size * MB, source_block * MB,
+                            read_size) for _ in xrange(repeat)]
+            elapsed = min(r[0] for r in runs)
+            allocations = runs[0][1]
+            results[(read_size, name)] = {
+                'mb_per_s': size / max(elapsed, 1e-9),
+                'allocs_per_gb': allocations.count * 1024.0 / size,
+                'alloc_mb_per_gb': allocations.bytes * 1024.0 / size / MB,
+            }
+    return results
+
+
+def report(results):
+    print "%-8s %-10s %10s %12s %14s" % ('read, KB', 'reader', 'MB/s',
+                                         'allocs/GB', 'alloc MB/GB')
+    for read_size in READ_SIZES:
+        for name, _ in READERS:
+            res = results[(read_size, name)]
+            print "%-8s %-10s %10.1f %12.0f %14.1f" % (
+                read_size // 1024 if read_size else 'all', name,
+                res['mb_per_s'], res['allocs_per_gb'],
+                res['alloc_mb_per_gb'])
+
+
+def main(size=1024, source_block=8, repeat=3):
+    results = run(int(size), int(source_block), int(repeat))
+    report(results)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-s', '--size', type=int, default=1024,
+                        help='Size of streamed image in MB')
+    parser.add_argument('-b', '--source-block', type=int, default=8,
+                        help='Max size of block returned by source in MB')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args()
+    main(args.size, args.source_block, args.repeat)
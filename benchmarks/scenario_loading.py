@@ -0,0 +1,105 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Benchmark of scenario startup: resolving actions of tasks file.
+
+Every measurement runs in a fresh interpreter, so that modules imported by
+previous measurement do not affect results:
+ - cold - actions index does not exist, all modules of action packages are
+   imported to build it;
+ - warm - actions index is up to date, only modules of actions referenced
+   by tasks file are imported.
+
+Without arguments full `scenario/tasks.yaml` and a minimal tasks file
+(single action) are measured.
+
+Usage: python -m benchmarks.scenario_loading [tasks_file] [repeat]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import yaml
+
+MEASURE = """
+import json, sys, time
+import yaml
+start = time.time()
+from cloudferrylib.scheduler import scenario
+with open(sys.argv[1]) as tasks_file:
+    tasks = yaml.load(tasks_file)
+actions = scenario.Scenario(sys.argv[1], None,
+                            actions_index=sys.argv[2]).load_actions(tasks)
+print(json.dumps({'time': time.time() - start,
+                  'actions': len(actions),
+                  'modules': len(sys.modules)}))
+"""
+
+
+def measure(tasks_path, index_path):
+    out = subprocess.check_output(
+        [sys.executable, '-c', MEASURE, tasks_path, index_path],
+        stderr=open(os.devnull, 'w'))
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(tasks_path, repeat=3):
+    tmp_dir = tempfile.mkdtemp()
+    index_path = os.path.join(tmp_dir, 'actions_index.json')
+    results = {'cold': [], 'warm': []}
+    try:
+        for _ in xrange(repeat):
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            results['cold'].append(measure(tasks_path, index_path))
+            results['warm'].append(measure(tasks_path, index_path))
+    finally:
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        os.rmdir(tmp_dir)
+
+    print tasks_path
+    print "%-6s %10s %10s %10s" % ('mode', 'best, s', 'actions', 'modules')
+    for mode in ('cold', 'warm'):
+        best = min(results[mode], key=lambda r: r['time'])
+        print "%-6s %10.3f %10d %10d" % (mode, best['time'], best['actions'],
+                                         best['modules'])
+    return results
+
+
+def run_default(repeat=3):
+    full_path = 'scenario/tasks.yaml'
+    with open(full_path) as tasks_file:
+        paths = yaml.load(tasks_file)['paths']
+    fd, minimal_path = tempfile.mkstemp(suffix='.yaml')
+    with os.fdopen(fd, 'w') as tasks_file:
+        yaml.safe_dump({'paths': paths,
+                        'tasks': {'copy': ['CopyVar', 'src', 'dst']}},
+                       tasks_file)
+    try:
+        return {full_path: run(full_path, repeat),
+                'minimal': run(minimal_path, repeat)}
+    finally:
+        os.remove(minimal_path)
+
+
+if __name__ == '__main__':
+    repeat_count = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    if len(sys.argv) > 1:
+        run(sys.argv[1], repeat_count)
+    else:
+        run_default(repeat_count)
@@ -0,0 +1,214 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Benchmark of scheduler overhead on synthetic scenarios.
+
+Scenarios are built of dry run tasks (`dry_run.tasks.simple`), so no
+cloud is needed:
+ - chain - deep `>>` chain of `size` tasks;
+ - alternatives - chain where every 10th task has `|` alternative path;
+ - fanout - `size / 10` parallel `&` branches of 10 tasks each, run by the
+   thread executor and joined by `WaitThreadAllTask`.
+
+Measured:
+ - construct_net - building net from scenario description;
+ - checker - `ScenarioChecker` validation;
+ - cursor - `Cursor` traversal of the net;
+ - dispatch - running tasks by scheduler (sequential chain processing);
+ - dispatch_plan - running tasks through execution plan (`plan_workers`);
+ - fanout - forking, running and joining parallel branches.
+
+Every benchmark reports the best time of `repeat` runs and time per task
+in microseconds. Logging is disabled while measuring, so numbers show the
+scheduler itself. Results can be saved as JSON and compared with results
+saved on another commit.
+
+Usage: python -m benchmarks.scheduler_overhead [-s SIZE] [-r REPEAT]
+           [-o results.json] [-b baseline.json]
+"""
+
+import argparse
+import gc
+import json
+import logging
+import subprocess
+import time
+
+from cloudferrylib.scheduler import cursor
+from cloudferrylib.scheduler import executor
+from cloudferrylib.scheduler import namespace
+from cloudferrylib.scheduler import scenario
+from cloudferrylib.scheduler import scheduler
+from cloudferrylib.scheduler import task
+from cloudferrylib.scheduler import thread_tasks
+from dry_run.tasks import simple
+
+ALTERNATIVE_EVERY = 10
+BRANCH_SIZE = 10
+
+
+def make_tasks(size):
+    return {task_name(i): simple.AddNumbers(i, 1) for i in xrange(size)}
+
+
+def task_name(index):
+    return 'task_%05d' % index
+
+
+def chain_scenario(size, alternative_every=0):
+    """Returns scenario process in the format of scenario yaml file"""
+    process = []
+    for i in xrange(size):
+        if alternative_every and i % alternative_every == 0 and \
+                i + 2 < size:
+            process.append({task_name(i): [task_name(i + 2)]})
+        else:
+            process.append({task_name(i): True})
+    return process
+
+
+def fanout_net(size):
+    net = task.Task()
+    tasks = make_tasks(size)
+    for start in xrange(0, size, BRANCH_SIZE):
+        branch = tasks[task_name(start)]
+        for i in xrange(start + 1, min(start + BRANCH_SIZE, size)):
+            branch = branch >> tasks[task_name(i)]
+        net = net & thread_tasks.WrapThreadTask(branch)
+    return net >> thread_tasks.WaitThreadAllTask()
+
+
+def construct(process, size):
+    return scenario.Scenario(None, None).construct_net(process,
+                                                       make_tasks(size))
+
+
+def measure(func, repeat, setup=None):
+    """Returns best time of `func(setup())` calls"""
+    best = None
+    for _ in xrange(repeat):
+        arg = setup() if setup else None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.time()
+            func(arg)
+            duration = time.time() - start
+        finally:
+            gc.enable()
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def traverse(net):
+    return sum(1 for _ in cursor.Cursor(net))
+
+
+def dispatch(net, plan_workers=1, executor_name=None):
+    s = scheduler.Scheduler(
+        namespace=namespace.Namespace({}), migration=cursor.Cursor(net),
+        plan_workers=plan_workers,
+        executor=executor.get_executor(executor_name))
+    s.start()
+    if s.status_error != scheduler.NO_ERROR:
+        raise RuntimeError("Benchmark scenario failed: %r" % s.exception)
+
+
+def run(size=2000, repeat=5):
+    chain = chain_scenario(size)
+    alternatives = chain_scenario(size, ALTERNATIVE_EVERY)
+    results = {}
+
+    def add(name, items, func, setup=None):
+        best = measure(func, repeat, setup)
+        results[name] = {'time': best, 'items': items,
+                         'per_item_us': best / items * 1e6}
+
+    logging.disable(logging.CRITICAL)
+    try:
+        for name, process in (('chain', chain),
+                              ('alternatives', alternatives)):
+            add('construct_net.%s' % name, size,
+                lambda p: construct(p, size),
+                setup=lambda process=process: process)
+            add('checker.%s' % name, size,
+                lambda args: scenario.ScenarioChecker(*args).check(),
+                setup=lambda process=process: (
+                    make_tasks(size).keys(), 'migration', process))
+            add('cursor.%s' % name, size, traverse,
+                setup=lambda process=process: construct(process, size))
+        add('dispatch.chain', size, dispatch,
+            setup=lambda: construct(chain, size))
+        add('dispatch_plan.chain', size,
+            lambda net: dispatch(net, plan_workers=4),
+            setup=lambda: construct(chain, size))
+        add('fanout.thread', size,
+            lambda net: dispatch(net, executor_name=executor.THREAD),
+            setup=lambda: fanout_net(size))
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results, baseline=None):
+    header = "%-28s %8s %10s %12s" % ('benchmark', 'tasks', 'best, s',
+                                      'per task, us')
+    if baseline:
+        header += " %12s %8s" % ('baseline, us', 'ratio')
+    print header
+    for name in sorted(results):
+        res = results[name]
+        line = "%-28s %8d %10.4f %12.2f" % (name, res['items'], res['time'],
+                                            res['per_item_us'])
+        if baseline and name in baseline['results']:
+            base = baseline['results'][name]['per_item_us']
+            line += " %12.2f %8.2f" % (base, res['per_item_us'] / base)
+        print line
+
+
+def main(size=2000, repeat=5, output=None, baseline=None):
+    results = run(int(size), int(repeat))
+    base = None
+    if baseline:
+        with open(baseline) as baseline_file:
+            base = json.load(baseline_file)
+        print "Baseline: commit %s, size %s" % (base.get('commit'),
+                                                base.get('size'))
+    report(results, base)
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump({'commit': current_commit(), 'size': int(size),
+                       'repeat': int(repeat), 'results': results},
+                      output_file, indent=2, sort_keys=True)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-s', '--size', type=int, default=2000,
+                        help='Number of tasks in scenario')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-o', '--output', help='Save results to JSON file')
+    parser.add_argument('-b', '--baseline',
+                        help='Compare with results saved by --output')
+    args = parser.parse_args()
+    main(args.size, args.repeat, args.output, args.baseline)
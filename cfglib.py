@@ -107,12 +107,55 @@ migrate_opts = [
                 help='True - keep volume_storage, '
                      'False - not keep volume_storage'),
     cfg.StrOpt('speed_limit', default='off',
-               help='speed limit for glance to glance'),
+               help='bandwidth shared by transfers running at once: '
+                    'glance to glance, files between hosts, rsync of '
+                    'volumes'),
+    cfg.BoolOpt('speed_limit_per_host_pair', default=False,
+                help='True - speed_limit is bandwidth of every pair of '
+                     'hosts, False - of the link between clouds'),
+    cfg.StrOpt('speed_limit_min_share', default='off',
+               help='bandwidth guaranteed to every transfer, in the '
+                    'format of speed_limit'),
+    cfg.DictOpt('speed_limit_weights', default={},
+                help='weights of kinds of transfers (image, file, volume) '
+                     'in sharing of speed_limit, e.g. image:1,volume:2'),
     cfg.StrOpt('file_compression', default='dd',
                help='gzip - use GZIP when file transferring via ssh, '
-                    ' - no compression, directly via dd'),
+                    'dd - no compression, directly via dd, '
+                    'auto - no compression, fast or level_compression '
+                    'GZIP chosen for every file by its compressibility, '
+                    'compressor speed and network bandwidth'),
     cfg.IntOpt('level_compression', default='7',
                help='level compression for gzip'),
+    cfg.IntOpt('compression_sample_size', default=16,
+               help='Size in MB of beginning of file compressed to choose '
+                    'compression when file_compression is auto'),
+    cfg.IntOpt('rbd_parallelism', default=1,
+               help='Number of RBD images (Ceph volumes and ephemeral '
+                    'disks) copied at once by one transfer task. 1 - images '
+                    'are copied one by one.'),
+    cfg.IntOpt('rbd_pool_streams', default=2,
+               help='Max number of RBD images of the same Ceph pool copied '
+                    'at once, 0 - not limited.'),
+    cfg.IntOpt('rbd_host_streams', default=2,
+               help='Max number of RBD images copied at once through the '
+                    'same Ceph host, 0 - not limited.'),
+    cfg.BoolOpt('ceph_precopy', default=False,
+                help='Copy Ceph ephemeral disks of instances in rounds '
+                     'while instances are running, so that only data '
+                     'changed since the last round is copied after '
+                     'instance is stopped'),
+    cfg.IntOpt('ceph_precopy_max_rounds', default=5,
+               help='Max number of pre-copy rounds of Ceph disk'),
+    cfg.IntOpt('ceph_precopy_cutover_size', default=64,
+               help='Size in MB of data changed during pre-copy round of '
+                    'Ceph disk, which is small enough to stop instance and '
+                    'copy the rest'),
+    cfg.BoolOpt('ephemeral_stream_convert', default=False,
+                help='Convert ephemeral disks between Ceph and local '
+                     'storage while they are copied, without temporary '
+                     'copies on controllers. Requires qemu-nbd on source '
+                     'and qemu-img with rbd support on Ceph side'),
     cfg.StrOpt('ssh_transfer_port', default='9990',
                help='interval ports for ssh tunnel'),
     cfg.StrOpt('port', default='9990',
@@ -137,6 +180,32 @@ migrate_opts = [
                help='Time wait if except Performing error'),
     cfg.IntOpt('ssh_chunk_size', default=100,
                help='Size of one chunk to transfer via SSH'),
+    cfg.IntOpt('ssh_chunk_parallelism', default=3,
+               help='Number of chunks copied via SSH at once. Compression, '
+                    'network copy and decompression of different chunks '
+                    'overlap. 1 - chunks are copied one by one.'),
+    cfg.IntOpt('ssh_chunk_temp_space', default=1024,
+               help='Temp space in MB on source and destination hosts used '
+                    'by chunks copied via SSH at once, limits '
+                    'ssh_chunk_parallelism. 0 - not limited.'),
+    cfg.IntOpt('ssh_chunk_memory', default=1024,
+               help='Memory in MB on source host used by chunks copied via '
+                    'SSH at once, every chunk takes ssh_chunk_size MB, '
+                    'limits ssh_chunk_parallelism. 0 - not limited.'),
+    cfg.BoolOpt('ssh_delta_sync', default=False,
+                help='SSHFileToFile sends only blocks of file which differ '
+                     'from blocks of existing destination file. Interrupted '
+                     'copy is resumed when run again.'),
+    cfg.IntOpt('ssh_delta_block_size', default=4,
+               help='Size in MB of blocks compared by ssh_delta_sync'),
+    cfg.BoolOpt('ssh_sparse_transfer', default=False,
+                help='Only allocated extents of file are sent via SSH '
+                     '(SEEK_DATA/SEEK_HOLE, or non-zero blocks if file '
+                     'system does not support them), destination file is '
+                     'created sparse.'),
+    cfg.IntOpt('ssh_sparse_min_hole', default=16,
+               help='Holes in file shorter than this number of MB are sent '
+                    'along with data by ssh_sparse_transfer'),
     cfg.StrOpt('group_file_path', default="vm_groups.yaml",
                help='Path to file with the groups of VMs'),
     cfg.StrOpt('scenario', default='scenario/migrate.yaml',
@@ -172,6 +241,73 @@ migrate_opts = [
                 help="Don't show ssl warnings"),
     cfg.BoolOpt('keep_affinity_settings', default=False,
                 help="Keep affinity/anti-affinity settings"),
+    cfg.StrOpt('task_timeline', default=None,
+               help='Path to file where wall-clock time, CPU time, RSS and '
+                    'namespace growth of every executed task is stored as '
+                    'JSON lines. Summary sorted by cumulative time is '
+                    'stored next to it with ".summary" suffix. Timeline is '
+                    'not collected if not set.'),
+    cfg.IntOpt('ssh_pool_idle_timeout', default=300,
+               help='Seconds SSH connection opened for remote commands is '
+                    'kept open after last command. Commands to the same '
+                    'host, user and gateway reuse open connection instead '
+                    'of new SSH handshake. 0 - connection is not pooled.'),
+    cfg.IntOpt('ssh_tunnel_idle_timeout', default=300,
+               help='Seconds SSH tunnel to destination compute host is kept '
+                    'running after last transfer through it. Transfers to '
+                    'the same compute host reuse running tunnel. 0 - tunnel '
+                    'is stopped after every transfer.'),
+    cfg.StrOpt('progress_events', default=None,
+               help='Path to append-only file where live progress events '
+                    '(tasks started and finished, resources done, bytes '
+                    'transferred) are written as JSON lines, or '
+                    '"unix:<path>" to send them to UNIX datagram socket. '
+                    'Events are shown by "fab tail_progress". Disabled if '
+                    'not set.'),
+    cfg.StrOpt('checkpoint_file', default=None,
+               help='Path to local state file where namespace and position '
+                    'of scenario are stored after each completed task. '
+                    'Allows to resume failed migration with '
+                    '"fab migrate_resume" skipping completed tasks. '
+                    'Checkpoints are disabled if not set.'),
+    cfg.StrOpt('actions_index',
+               default='~/.cache/cloudferry/actions_index.json',
+               help='Path to file with index of actions available for '
+                    'scenarios. Index is updated automatically when action '
+                    'modules change, only modules of actions used by tasks '
+                    'are imported. Index is not kept if empty.'),
+    cfg.IntOpt('parallel_instances', default=1,
+               help='Number of instances migrated at once. Each instance is '
+                    'migrated in a separate process, failure of one '
+                    'instance does not stop migration of others, migration '
+                    'fails once all instances are processed. Scenarios '
+                    'migrate instances in parallel with '
+                    '`parallel_migrate_instances` task in front of instance '
+                    'loop.'),
+    cfg.IntOpt('parallel_instances_per_host', default=0,
+               help='Max number of instances migrated at once from one '
+                    'source compute host, 0 - unlimited.'),
+    cfg.IntOpt('parallel_instances_per_storage', default=0,
+               help='Max number of instances migrated at once per source '
+                    'storage backend (ephemeral or volume backend), '
+                    '0 - unlimited.'),
+    cfg.IntOpt('plan_workers', default=1,
+               help='Number of tasks run at once. Independent tasks (marked '
+                    'thread safe and not sharing namespace keys) are run '
+                    'concurrently in threads, 1 - tasks are run one by one. '
+                    'Ignored when checkpoint_file is set.'),
+    cfg.IntOpt('max_tasks_per_compute_host', default=0,
+               help='Max number of tasks which use one compute host (e.g. '
+                    'copy instance disks) at once, 0 - unlimited.'),
+    cfg.IntOpt('max_tasks_per_storage', default=0,
+               help='Max number of tasks which copy data of one storage '
+                    'backend (e.g. ceph) at once, 0 - unlimited.'),
+    cfg.IntOpt('max_glance_api_tasks', default=0,
+               help='Max number of tasks which use glance API of one cloud '
+                    'at once, 0 - unlimited.'),
+    cfg.IntOpt('max_nova_api_tasks', default=0,
+               help='Max number of tasks which use nova API of one cloud at '
+                    'once, 0 - unlimited.'),
 ]
 
 mail = cfg.OptGroup(name='mail',
@@ -570,6 +706,18 @@ initial_check_opts = [
                  help='The percentage of the allowable loss of network speed'),
     cfg.IntOpt('test_file_size', default=100,
                help='Size of testing file to send/receive via network (MB).'),
+    cfg.BoolOpt('bandwidth_probe', default=False,
+                help='Probe bandwidth and latency between pairs of source '
+                     'and destination compute hosts.'),
+    cfg.IntOpt('probe_pairs', default=0,
+               help='Number of sampled pairs of compute hosts probed, '
+                    '0 - all pairs.'),
+    cfg.IntOpt('probe_streams', default=2,
+               help='Number of parallel streams of every probe.'),
+    cfg.IntOpt('probe_concurrency', default=4,
+               help='Max number of pairs of compute hosts probed at once.'),
+    cfg.StrOpt('bandwidth_matrix_file', default='bandwidth_matrix.json',
+               help='File bandwidth of pairs of compute hosts is saved to.'),
 ]
 
 condense = cfg.OptGroup(name='condense',
@@ -35,5 +35,8 @@ class CloudFerry(object):
     def __init__(self, config):
         self.config = config
 
-    def migrate(self, scenario=None):
+    def migrate(self, scenario=None, resume=False):
+        pass
+
+    def plan(self, scenario=None):
         pass
@@ -13,14 +13,21 @@
 # limitations under the License.
 
 
+import functools
+
 import cloud
 import cloud_ferry
 from cloudferrylib.base.action import copy_var, rename_info, \
-    merge, is_end_iter, get_info_iter
+    merge, is_end_iter, get_info_iter, parallel_iter
 from cloudferrylib.os.actions import identity_transporter
+from cloudferrylib.scheduler import checkpoint
+from cloudferrylib.scheduler import plan
+from cloudferrylib.scheduler import resource_limits
+from cloudferrylib.scheduler import executor as branch_executor
 from cloudferrylib.scheduler import scheduler
 from cloudferrylib.scheduler import namespace
 from cloudferrylib.scheduler import cursor
+from cloudferrylib.scheduler import task_timeline
 from cloudferrylib.os.image import glance_image
 from cloudferrylib.os.network import neutron
 from cloudferrylib.os.identity import keystone
@@ -56,6 +63,10 @@ from cloudferrylib.os.actions import transport_ephemeral
 from cloudferrylib.os.actions import is_not_transport_image
 from cloudferrylib.os.actions import is_not_merge_diff
 from cloudferrylib.os.actions import stop_vm
+from cloudferrylib.utils import bandwidth
+from cloudferrylib.utils import progress_events
+from cloudferrylib.utils import ssh_pool
+from cloudferrylib.utils import ssh_tunnel
 from cloudferrylib.utils import utils as utl
 from cloudferrylib.os.actions import transport_compute_resources
 from cloudferrylib.os.actions import task_transfer
@@ -78,6 +89,8 @@ from cloudferrylib.os.actions import check_sql
 from cloudferrylib.os.actions import check_rabbitmq
 from cloudferrylib.os.actions import check_bandwidth
 
+LOG = utl.get_log(__name__)
+
 
 class OS2OSFerry(cloud_ferry.CloudFerry):
 
@@ -92,6 +105,7 @@ class OS2OSFerry(cloud_ferry.CloudFerry):
                      'objstorage': swift_storage.SwiftStorage}
         self.src_cloud = cloud.Cloud(resources, cloud.SRC, config)
         self.dst_cloud = cloud.Cloud(resources, cloud.DST, config)
+        self.limits = None
         self.init = {
             'src_cloud': self.src_cloud,
             'dst_cloud': self.dst_cloud,
@@ -104,13 +118,58 @@ class OS2OSFerry(cloud_ferry.CloudFerry):
                 ssh_chunks.CopyFilesBetweenComputeHosts,
         }
 
-    def migrate(self, scenario=None):
+    def migrate(self, scenario=None, resume=False):
         namespace_scheduler = namespace.Namespace({
             '__init_task__': self.init,
             'info_result': {
                 utl.INSTANCES_TYPE: {}
             }
         })
+        self.limits = self.make_resource_limits()
+        self.init['limits'] = self.limits
+        progress_events.configure(self.config.migrate.progress_events)
+        bandwidth.configure(self.config)
+        process_migration, executor = self.process_migration(scenario)
+        timeline = None
+        if self.config.migrate.task_timeline:
+            timeline = task_timeline.TaskTimeline(
+                self.config.migrate.task_timeline)
+        state = None
+        if self.config.migrate.checkpoint_file:
+            state = checkpoint.Checkpoint(self.config.migrate.checkpoint_file,
+                                          resume=resume)
+        elif resume:
+            raise checkpoint.CheckpointError(
+                "Unable to resume migration: [migrate] checkpoint_file is "
+                "not set")
+        plan_workers = self.config.migrate.plan_workers
+        scheduler_migr = scheduler.Scheduler(namespace=namespace_scheduler,
+                                             timeline=timeline,
+                                             checkpoint=state,
+                                             executor=executor,
+                                             plan_workers=plan_workers,
+                                             limits=self.limits,
+                                             **process_migration)
+        try:
+            scheduler_migr.start()
+        finally:
+            self.limits.cleanup()
+            progress_events.configure(None)
+            bandwidth.configure(None)
+            pool = ssh_pool.get_pool()
+            LOG.info("SSH connections: %(handshakes)d opened, "
+                     "%(reused)d handshakes saved by reuse",
+                     pool.metrics())
+            pool.close_all()
+            tunnels = ssh_tunnel.get_pool()
+            LOG.info("SSH tunnels: %(created)d started, %(reused)d reused, "
+                     "%(recreated)d restarted, %(evicted)d stopped as idle",
+                     tunnels.metrics())
+            tunnels.close_all()
+            tunnels.cleanup()
+        return scheduler_migr.status_error
+
+    def process_migration(self, scenario=None):
         # "process_migration" is dict with 3 keys:
         #    "preparation" - is cursor that points to tasks must be processed
         #                    before migration i.e - taking snapshots,
@@ -119,18 +178,38 @@ class OS2OSFerry(cloud_ferry.CloudFerry):
         #                  task in migration process
         #    "rollback" - is cursor that points to tasks must be processed
         #                 in case of "migration" failure
+        executor = None
         if not scenario:
             process_migration = {
                 "migration": cursor.Cursor(self.process_migrate())}
         else:
+            # tasks may build new nets of scenario chains, see
+            # ParallelMigrateInstances
+            self.init['scenario'] = scenario
             scenario.init_tasks(self.init)
             scenario.load_scenario()
             process_migration = {k: cursor.Cursor(v)
                                  for k, v in scenario.get_net().items()}
-        scheduler_migr = scheduler.Scheduler(namespace=namespace_scheduler,
-                                             **process_migration)
-        scheduler_migr.start()
-        return scheduler_migr.status_error
+            executor = branch_executor.get_executor(scenario.executor)
+        return process_migration, executor
+
+    def plan(self, scenario=None):
+        """Returns execution plans of scenario chains with critical paths.
+
+        Durations of tasks are taken from summary of previous task timeline
+        if it exists.
+        """
+        process_migration, _ = self.process_migration(scenario)
+        durations = None
+        if self.config.migrate.task_timeline:
+            durations = task_timeline.load_durations(
+                self.config.migrate.task_timeline)
+        result = []
+        for name in ('preparation', 'migration', 'rollback'):
+            if name in process_migration:
+                result.append("%s:\n%s" % (name.upper(), plan.dump(
+                    plan.build_plan(process_migration[name].net), durations)))
+        return "\n\n".join(result)
 
     def process_migrate(self):
         check_environment = self.check_environment()
@@ -192,6 +271,25 @@ class OS2OSFerry(cloud_ferry.CloudFerry):
                                                   name_data)
         is_instances = is_end_iter.IsEndIter(self.init)
 
+        if self.config.migrate.parallel_instances > 1:
+            migrate_all_instances = parallel_iter.ParallelIter(
+                self.init,
+                self.migrate_process_instance,
+                workers=self.config.migrate.parallel_instances,
+                limits=self.limits,
+                resources=functools.partial(
+                    resource_limits.migrated_instance, self.config),
+                iter_info_name=name_iter,
+                info_name=name_data,
+                result_name=name_result)
+            return act_get_filter >> \
+                act_get_info_inst >> \
+                init_iteration_instance >> \
+                act_check_needed_compute_resources >> \
+                migrate_all_instances >> \
+                rename_info_iter >> \
+                act_cleanup_images
+
         transport_instances_and_dependency_resources = \
             act_get_filter >> \
             act_get_info_inst >> \
@@ -206,6 +304,19 @@ class OS2OSFerry(cloud_ferry.CloudFerry):
             act_cleanup_images
         return transport_instances_and_dependency_resources
 
+    def make_resource_limits(self):
+        migrate = self.config.migrate
+        return resource_limits.ResourceLimits({
+            resource_limits.COMPUTE_HOST: migrate.max_tasks_per_compute_host,
+            resource_limits.STORAGE: migrate.max_tasks_per_storage,
+            resource_limits.GLANCE_API: migrate.max_glance_api_tasks,
+            resource_limits.NOVA_API: migrate.max_nova_api_tasks,
+            resource_limits.INSTANCE_HOST: (
+                migrate.parallel_instances_per_host),
+            resource_limits.INSTANCE_STORAGE: (
+                migrate.parallel_instances_per_storage),
+        })
+
     def init_iteration_instance(self, data, name_backup, name_iter):
         init_iteration_instance = \
             copy_var.CopyVar(self.init, data, name_backup, True) >>\
@@ -21,12 +21,17 @@ import fabfile
 
 
 def migrate_run(args):
-    fabfile.migrate(args.config, args.debug)
+    fabfile.migrate(args.config, args.debug, args.resume, args.plan)
 
 
 def migrate_args(parser):
     parser.add_argument('config')
     parser.add_argument('-d', '--debug', action='store_true')
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help='Continue failed migration from checkpoint')
+    parser.add_argument('-p', '--plan', action='store_true',
+                        help='Show execution plan of scenario and its '
+                             'critical path instead of migration')
 
 
 def evacuate_run(args):
@@ -0,0 +1,184 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+
+import copy
+import cPickle
+import multiprocessing
+import Queue
+
+from cloudferrylib.base.action import action
+from cloudferrylib.scheduler import cursor
+from cloudferrylib.scheduler import namespace
+from cloudferrylib.scheduler import scheduler
+from cloudferrylib.utils import progress_events
+from cloudferrylib.utils import utils as utl
+
+LOG = utl.get_log(__name__)
+
+POLL_INTERVAL = 1
+
+
+class ParallelIterError(RuntimeError):
+    pass
+
+
+class ParallelIter(action.Action):
+    """Runs sub-chain for every resource of iteration info in parallel.
+
+    Replacement for `GetInfoIter` -> sub-chain -> `Merge` -> `IsEndIter`
+    loop. Every resource is processed in a separate process (same as `&`
+    branches of scheduler, fabric environment is not thread-safe) with its
+    own namespace slice, where `info_name` holds only that resource.
+
+    Number of resources processed at once is limited by `workers` and by
+    `limits` (`resource_limits.ResourceLimits`): `resources` function returns
+    list of `(resource type, key)` tuples (e.g. source compute host) which
+    are occupied while resource is processed. Resource is started only when
+    all of them have free slots. The same limits are applied to tasks of
+    sub-chain.
+
+    Failed resources are collected in `failed_name` variable and do not
+    stop processing of other resources. Once all resources are processed,
+    results are stored in namespace and `ParallelIterError` is raised if
+    any resource failed, so migration fails and is rolled back.
+    """
+
+    def __init__(self, init, net_factory, workers=1, limits=None,
+                 resources=None, iter_info_name='info_iter',
+                 info_name='info', result_name='info_result',
+                 failed_name='failed_info',
+                 resource_name=utl.INSTANCES_TYPE):
+        super(ParallelIter, self).__init__(init)
+        self.net_factory = net_factory
+        self.workers = max(workers, 1)
+        self.limits = limits
+        self.resources = resources
+        self.iter_info_name = iter_info_name
+        self.info_name = info_name
+        self.result_name = result_name
+        self.failed_name = failed_name
+        self.resource_name = resource_name
+        self.holds = {}
+
+    def try_acquire(self, obj_id, obj):
+        """Takes slots of resources occupied by obj if all are free"""
+        if self.limits is None or self.resources is None:
+            return True
+        hold = self.limits.try_acquire(self.resources(obj))
+        if hold is None:
+            return False
+        self.holds[obj_id] = hold
+        return True
+
+    def release(self, obj_id):
+        hold = self.holds.pop(obj_id, None)
+        if hold is not None:
+            hold.release()
+
+    def process(self, obj_id, obj, variables, queue):
+        variables = dict(variables)
+        variables[namespace.CHILDREN] = dict()
+        variables[self.info_name] = {self.resource_name: {obj_id: obj}}
+        ns = namespace.Namespace(variables)
+        sched = scheduler.SchedulerThread(namespace=ns, limits=self.limits)
+        try:
+            sched.process_chain(cursor.Cursor(self.net_factory()),
+                                scheduler.STEP_MIGRATION)
+            if sched.status_error == scheduler.NO_ERROR:
+                result = (obj_id,
+                          ns.vars[self.info_name][self.resource_name],
+                          None)
+            else:
+                result = (obj_id, None, repr(sched.exception))
+            payload = cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+        except Exception as e:  # pylint: disable=broad-except
+            payload = cPickle.dumps((obj_id, None, repr(e)),
+                                    cPickle.HIGHEST_PROTOCOL)
+        queue.put(payload)
+
+    def start_ready(self, pending, objs, running, variables, queue):
+        for obj_id in list(pending):
+            if len(running) >= self.workers:
+                return
+            if not self.try_acquire(obj_id, objs[obj_id]):
+                continue
+            pending.remove(obj_id)
+            p = multiprocessing.Process(
+                target=self.process,
+                args=(obj_id, objs[obj_id], variables, queue))
+            running[obj_id] = p
+            LOG.info("Start processing %s %s (%d in progress, %d pending)",
+                     self.resource_name, obj_id, len(running), len(pending))
+            p.start()
+
+    @staticmethod
+    def wait_result(running, queue):
+        while True:
+            try:
+                return cPickle.loads(queue.get(timeout=POLL_INTERVAL))
+            except Queue.Empty:
+                for obj_id, p in running.items():
+                    if not p.is_alive() and queue.empty():
+                        return (obj_id, None,
+                                "Process exited with code %s" % p.exitcode)
+
+    def __call__(self, namespace=None):
+        super(ParallelIter, self).__call__(namespace)
+        failed = namespace.vars[self.failed_name][self.resource_name]
+        if failed:
+            raise ParallelIterError(
+                "Failed to process %d %s: %s" % (
+                    len(failed), self.resource_name,
+                    ", ".join("%s (%s)" % item for item in failed.items())))
+
+    def run(self, **kwargs):
+        info = kwargs[self.iter_info_name]
+        objs = info[self.resource_name]
+        result = copy.deepcopy(kwargs[self.result_name])
+        failed = {}
+        pending = objs.keys()
+        running = {}
+        queue = multiprocessing.Queue()
+        variables = {k: v for k, v in kwargs.iteritems()
+                     if k != namespace.CHILDREN}
+
+        done = 0
+        progress_events.progress(self.resource_name, done, len(objs))
+        while pending or running:
+            self.start_ready(pending, objs, running, variables, queue)
+            obj_id, obj_result, error = self.wait_result(running, queue)
+            running.pop(obj_id).join()
+            self.release(obj_id)
+            done += 1
+            if error is None:
+                LOG.info("Finished processing %s %s (%d of %d)",
+                         self.resource_name, obj_id, done, len(objs))
+                result[self.resource_name].update(obj_result)
+            else:
+                LOG.error("Failed processing %s %s: %s", self.resource_name,
+                          obj_id, error)
+                failed[obj_id] = error
+            progress_events.progress(self.resource_name, done, len(objs),
+                                     failed=len(failed))
+
+        if failed:
+            LOG.error("Failed to process %d of %d %s: %s", len(failed),
+                      len(objs), self.resource_name, ", ".join(failed))
+        objs.clear()
+        return {
+            self.iter_info_name: info,
+            self.result_name: result,
+            self.failed_name: {self.resource_name: failed}
+        }
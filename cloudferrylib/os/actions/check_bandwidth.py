@@ -20,7 +20,9 @@ import uuid
 from fabric.api import env
 
 from cloudferrylib.base.action import action
+from cloudferrylib.utils import bandwidth_matrix
 from cloudferrylib.utils import cmd_cfg
+from cloudferrylib.utils import compression
 from cloudferrylib.utils import files
 from cloudferrylib.utils import remote_runner
 from cloudferrylib.utils import utils
@@ -48,6 +50,14 @@ class CheckBandwidth(action.Action):
         bandwidth, e.g. `factor = 0.5` means expected bandwidth should not get
         below `0.5 * claimed_bandwidth`;
      - `[src|dst] host` - host the file will be copied to.
+
+    With `[initial_check] bandwidth_probe` check of destination cloud also
+    probes bandwidth and latency between pairs of source and destination
+    compute hosts and saves them to `[initial_check] bandwidth_matrix_file`,
+    see `cloudferrylib.utils.bandwidth_matrix`:
+     - `[initial_check] probe_pairs` - number of sampled pairs, 0 - all;
+     - `[initial_check] probe_streams` - parallel streams of every probe;
+     - `[initial_check] probe_concurrency` - pairs probed at once.
     """
 
     def run(self, **kwargs):
@@ -123,6 +133,10 @@ class CheckBandwidth(action.Action):
                                 upload_speed,
                                 download_speed))
 
+        # used for choice of compression of transferred files
+        compression.set_bandwidth(self.cloud.position,
+                                  min(upload_speed, download_speed))
+
         LOG.info("Bandwith is OK. "
                  "Required speed: %.2f Mb/s. "
                  "Upload speed: %.2f Mb/s. "
@@ -130,3 +144,21 @@ class CheckBandwidth(action.Action):
                  req_bandwidth,
                  upload_speed,
                  download_speed)
+
+        if (self.cfg.initial_check.bandwidth_probe and
+                self.cloud.position == 'dst'):
+            self.probe_compute_hosts()
+
+    def probe_compute_hosts(self):
+        src_compute = self.src_cloud.resources[utils.COMPUTE_RESOURCE]
+        dst_compute = self.dst_cloud.resources[utils.COMPUTE_RESOURCE]
+        pairs = bandwidth_matrix.sample_pairs(
+            src_compute.get_compute_hosts(), dst_compute.get_compute_hosts(),
+            self.cfg.initial_check.probe_pairs)
+        matrix = bandwidth_matrix.get_matrix(self.cfg)
+        prober = bandwidth_matrix.Prober(self.src_cloud, self.dst_cloud,
+                                         self.cfg)
+        failed = prober.run(pairs, matrix)
+        matrix.save()
+        LOG.info("Bandwidth of %d pairs of compute hosts is saved to %s, "
+                 "%d pairs failed", len(pairs) - failed, matrix.path, failed)
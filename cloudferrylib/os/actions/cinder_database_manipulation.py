@@ -17,6 +17,7 @@
 import abc
 from cloudferrylib.base.action import action
 from cloudferrylib.base.exception import AbortMigrationError
+from cloudferrylib.utils import bandwidth
 from cloudferrylib.utils import remote_runner
 from cloudferrylib.utils import utils
 from fabric.context_managers import settings
@@ -216,6 +217,17 @@ class WriteVolumesDb(CinderDatabaseInteraction):
             res = output.split('\r\n')
             return res if len(res) > 1 else res[0]
 
+    def _run_batch(self, cloud, cmds):
+        """Runs commands in single remote invocation.
+
+        Returns results of all commands, failed ones are not raised.
+        """
+        runner = _remote_runner(cloud)
+        runner.ignore_errors = True
+        with settings(gateway=cloud[CLOUD].getIpSsh(),
+                      connection_attempts=self.ssh_attempts):
+            return runner.run_batch(cmds)
+
     def run_repeat_on_errors(self, cloud, cmd):
         """Run remote command cmd."""
         runner = _remote_runner(cloud)
@@ -233,19 +245,27 @@ class WriteVolumesDb(CinderDatabaseInteraction):
         if not paths:
             return None
         volume_filename = self.storage[position].volume_name_template + v['id']
-        for p in paths:
-            cmd = 'ls -1 %s' % p
-            lst = self._run_cmd(self.cloud[position], cmd)
-            if lst and not isinstance(lst, list):
-                lst = [lst]
-            if volume_filename in lst:
+        paths = list(paths)
+        results = self._run_batch(self.cloud[position],
+                                  ['ls -1 %s' % p for p in paths])
+        for p, lst in zip(paths, results):
+            if lst.failed:
+                raise remote_runner.RemoteExecutionError(
+                    "Unable to list '%s': %s" % (p, lst.stderr))
+            if volume_filename in lst.splitlines():
                 return '%s/%s' % (p, volume_filename)
 
-    def _run_rsync(self, src, dst):
-        cmd = RSYNC_CMD
-        cmd += ' %s %s@%s:%s' % (src, self.cloud[DST][CFG].ssh_user,
-                                 self.cloud[DST][CFG].get(HOST), dst)
-        self.run_repeat_on_errors(self.cloud[SRC], cmd)
+    def _run_rsync(self, src, dst, size=0):
+        """Copies file of :size bytes limited to its share of bandwidth"""
+        src_host = self.cloud[SRC][CFG].get(HOST)
+        dst_host = self.cloud[DST][CFG].get(HOST)
+        with bandwidth.transfer(src, src_host, dst_host, bandwidth.VOLUME,
+                                config=self.cfg) as share:
+            cmd = RSYNC_CMD + bandwidth.rsync_bwlimit(share.rate)
+            cmd += ' %s %s@%s:%s' % (src, self.cloud[DST][CFG].ssh_user,
+                                     dst_host, dst)
+            self.run_repeat_on_errors(self.cloud[SRC], cmd)
+            share.add(size)
 
     def volume_size(self, cloud, vol_file):
         """
@@ -288,7 +308,7 @@ class WriteVolumesDb(CinderDatabaseInteraction):
         dst_free_space = self.free_space(self.cloud[DST], dst)
         if dst_free_space > src_size:
             LOG.debug("Enough space found on %s", dst)
-            self._run_rsync(src, dst)
+            self._run_rsync(src, dst, src_size)
             return True
         LOG.debug("No enough space on %s", dst)
 
@@ -15,6 +15,7 @@
 
 from cloudferrylib.base.action import transporter
 from cloudferrylib.os.actions import get_info_images
+from cloudferrylib.scheduler import resource_limits
 from cloudferrylib.utils import utils as utl
 
 LOG = utl.get_log(__name__)
@@ -24,6 +25,12 @@ class CopyFromGlanceToGlance(transporter.Transporter):
     def __init__(self, init):
         super(CopyFromGlanceToGlance, self).__init__(init)
 
+    def occupied_resources(self, **kwargs):
+        return (resource_limits.api(resource_limits.GLANCE_API,
+                                    self.src_cloud) +
+                resource_limits.api(resource_limits.GLANCE_API,
+                                    self.dst_cloud))
+
     def run(self, images_info=None, **kwargs):
         dst_image = self.dst_cloud.resources[utl.IMAGE_RESOURCE]
 
@@ -14,15 +14,20 @@
 
 
 from cloudferrylib.base.action import action
+from cloudferrylib.scheduler import resource_limits
 from cloudferrylib.utils import utils as utl
 
 
 class GetInfoImages(action.Action):
+    thread_safe = True
 
     def __init__(self, init, cloud=None, search_opts=dict()):
         super(GetInfoImages, self).__init__(init, cloud)
         self.search_opts = search_opts
 
+    def occupied_resources(self, **kwargs):
+        return resource_limits.api(resource_limits.GLANCE_API, self.cloud)
+
     def run(self, **kwargs):
         """Get info about images or specified image.
 
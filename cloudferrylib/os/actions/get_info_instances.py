@@ -14,6 +14,7 @@
 
 
 from cloudferrylib.base.action import action
+from cloudferrylib.scheduler import resource_limits
 from cloudferrylib.utils import utils as utl
 
 
@@ -21,6 +22,9 @@ class GetInfoInstances(action.Action):
     def __init__(self, init, cloud=None):
         super(GetInfoInstances, self).__init__(init, cloud)
 
+    def occupied_resources(self, **kwargs):
+        return resource_limits.api(resource_limits.NOVA_API, self.cloud)
+
     def run(self, **kwargs):
         search_opts = {'search_opts': kwargs.get('search_opts', {})}
         search_opts.update(kwargs.get('search_opts_tenant', {}))
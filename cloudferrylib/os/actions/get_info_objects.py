@@ -18,6 +18,8 @@ from cloudferrylib.utils import utils as utl
 
 
 class GetInfoObjects(action.Action):
+    thread_safe = True
+
     def __init__(self, init, cloud=None):
         super(GetInfoObjects, self).__init__(init, cloud)
 
@@ -18,7 +18,6 @@ from cloudferrylib.utils import utils as utl
 
 
 class GetInfoVolumes(action.Action):
-
     def __init__(self, init, cloud=None, search_opts=dict()):
         super(GetInfoVolumes, self).__init__(init, cloud)
         self.search_opts = search_opts
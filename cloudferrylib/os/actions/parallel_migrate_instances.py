@@ -0,0 +1,66 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+
+import functools
+
+from cloudferrylib.base.action import parallel_iter
+from cloudferrylib.scheduler import resource_limits
+from cloudferrylib.utils import utils as utl
+
+LOG = utl.get_log(__name__)
+
+# alternatives of task: instances are migrated one by one by the loop which
+# follows, or the loop is skipped
+LOOP = 0
+END_OF_LOOP = 1
+
+
+class ParallelMigrateInstances(parallel_iter.ParallelIter):
+    """Migrates instances of scenario in parallel with `ParallelIter`.
+
+    Task is put in front of instance loop of scenario and is linked to the
+    end of the loop::
+
+        - check_instances: ['rename_info_iter']
+        - parallel_migrate_instances: ['rename_info_iter']
+        - get_next_instance: True
+        - trans_one_inst: ...
+
+    With `[migrate] parallel_instances` > 1 every instance is migrated by
+    new net of :chain of scenario in a separate process and the loop is
+    skipped. Otherwise task does nothing and instances are migrated one by
+    one by the loop.
+    """
+
+    def __init__(self, init, chain='trans_one_inst'):
+        super(ParallelMigrateInstances, self).__init__(
+            init, self.chain_net,
+            workers=init['cfg'].migrate.parallel_instances,
+            resources=functools.partial(resource_limits.migrated_instance,
+                                        init['cfg']))
+        self.chain = chain
+
+    def chain_net(self):
+        return self.init['scenario'].chain_net(self.chain)
+
+    def __call__(self, namespace=None):
+        if self.cfg.migrate.parallel_instances <= 1:
+            self.set_next_path(LOOP)
+            return
+        LOG.info("Migrating instances in parallel, up to %d at once",
+                 self.workers)
+        self.limits = self.init.get('limits')
+        self.set_next_path(END_OF_LOOP)
+        super(ParallelMigrateInstances, self).__call__(namespace)
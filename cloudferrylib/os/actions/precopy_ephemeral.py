@@ -0,0 +1,107 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+
+import copy
+
+from cloudferrylib.base.action import action
+from cloudferrylib.scheduler import resource_limits
+from cloudferrylib.utils import utils as utl
+from cloudferrylib.utils.drivers import ssh_ceph_to_ceph
+
+
+LOG = utl.get_log(__name__)
+
+CEPH = 'ceph'
+EPHEMERAL = 'ephemeral'
+# namespace key with disks pre-copied by `PreCopyEphemeral`, which are
+# cleaned up by `RollbackPreCopyEphemeral` if migration fails
+PRECOPIED = 'precopied_ephemeral'
+
+
+class PreCopyEphemeral(action.Action):
+    """Pre-copies Ceph ephemeral disks of instances before they are stopped.
+
+    Disks are copied into staging images of destination Ceph, which replace
+    disks of instances created on destination when `TransportEphemeral`
+    copies the rest. Does nothing unless `[migrate] ceph_precopy` is set and
+    both clouds keep ephemeral disks in Ceph.
+    """
+
+    def occupied_resources(self, info=None, **kwargs):
+        return resource_limits.instance_hosts(info)
+
+    def enabled(self):
+        src_compute = self.src_cloud.resources[utl.COMPUTE_RESOURCE]
+        dst_compute = self.dst_cloud.resources[utl.COMPUTE_RESOURCE]
+        return (self.cfg.migrate.ceph_precopy and
+                not self.cfg.migrate.direct_compute_transfer and
+                src_compute.config.compute.backend == CEPH and
+                dst_compute.config.compute.backend == CEPH)
+
+    def run(self, info=None, **kwargs):
+        if not self.enabled():
+            return {}
+        info = copy.deepcopy(info)
+        precopied = list(kwargs.get(PRECOPIED) or [])
+        dst_compute = self.dst_cloud.resources[utl.COMPUTE_RESOURCE]
+        host_dst = dst_compute.config.compute.host_eph_drv
+        driver = ssh_ceph_to_ceph.SSHCephToCeph(self.src_cloud,
+                                                self.dst_cloud,
+                                                self.cfg)
+
+        for instance in info[utl.INSTANCES_TYPE].itervalues():
+            ephemeral = instance[EPHEMERAL]
+            if not (instance[utl.INSTANCE_BODY]['is_ephemeral'] and
+                    ephemeral[utl.PATH_SRC]):
+                continue
+            data = {utl.PATH_SRC: ephemeral[utl.PATH_SRC],
+                    utl.HOST_DST: host_dst}
+            staging_path = (ephemeral[utl.PATH_SRC] +
+                            ssh_ceph_to_ceph.STAGING_SUFFIX)
+            LOG.info("Pre-copying ephemeral disk of instance %s",
+                     instance[utl.INSTANCE_BODY]['id'])
+            ephemeral[ssh_ceph_to_ceph.PRECOPY] = driver.precopy(data,
+                                                                 staging_path)
+            data[ssh_ceph_to_ceph.PRECOPY] = ephemeral[
+                ssh_ceph_to_ceph.PRECOPY]
+            precopied.append(data)
+
+        return {
+            'info': info,
+            PRECOPIED: precopied
+        }
+
+
+class RollbackPreCopyEphemeral(action.Action):
+    """Removes snapshots of source disks and staging images left by
+    `PreCopyEphemeral`.
+
+    They are removed by `TransportEphemeral` when copy is finished, so they
+    are left if migration fails in between, and Nova can't delete RBD image
+    which has snapshots. Removal is no-op for disks which copy was finished.
+    """
+
+    def run(self, **kwargs):
+        precopied = kwargs.get(PRECOPIED)
+        if not precopied:
+            return {}
+        driver = ssh_ceph_to_ceph.SSHCephToCeph(self.src_cloud,
+                                                self.dst_cloud,
+                                                self.cfg)
+        for data in precopied:
+            driver.cleanup(data, data[ssh_ceph_to_ceph.PRECOPY])
+        return {
+            PRECOPIED: []
+        }
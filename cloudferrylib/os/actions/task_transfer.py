@@ -14,6 +14,8 @@
 
 
 from cloudferrylib.base.action import action
+from cloudferrylib.scheduler import resource_limits
+from cloudferrylib.utils import rbd_transfer
 from cloudferrylib.utils import utils as utl
 
 
@@ -30,12 +32,32 @@ class TaskTransfer(action.Action):
         self.resource_root_name = resource_root_name
         self.input_info = input_info
 
+    def occupied_resources(self, **kwargs):
+        info = kwargs.get(self.input_info) or {}
+        items = info.get(self.resource_name, {})
+        resources = resource_limits.transfer_hosts(items,
+                                                   self.resource_root_name)
+        if self.resource_name == utl.VOLUMES_TYPE and items:
+            resources.append((resource_limits.STORAGE,
+                              self.cfg.src_storage.backend))
+        return resources
+
     def run(self, **kwargs):
         info = kwargs[self.input_info]
         data_for_trans = info[self.resource_name]
+        items = [item[self.resource_root_name]
+                 for item in data_for_trans.itervalues()]
 
-        for item in data_for_trans.itervalues():
-            data = item[self.resource_root_name]
-            self.driver.transfer(data)
+        if self.rbd_parallel(items):
+            rbd_transfer.RbdTransferEngine(self.driver, self.cfg).run(items)
+        else:
+            for data in items:
+                self.driver.transfer(data)
 
         return {}
+
+    def rbd_parallel(self, items):
+        """RBD images are copied concurrently by `RbdTransferEngine`"""
+        return (len(items) > 1 and
+                self.cfg.migrate.rbd_parallelism > 1 and
+                hasattr(self.driver, 'rbd_endpoints'))
@@ -14,6 +14,8 @@
 
 
 import copy
+import math
+import time
 
 from fabric.api import env
 from fabric.api import run
@@ -21,9 +23,18 @@ from fabric.api import settings
 
 from cloudferrylib.base.action import action
 from cloudferrylib.os.actions import task_transfer
+from cloudferrylib.os.actions import utils as action_utils
+from cloudferrylib.scheduler import resource_limits
+from cloudferrylib.utils import qemu_img
+from cloudferrylib.utils import rbd_util
+from cloudferrylib.utils import sizeof_format
+from cloudferrylib.utils import sparse_file
+from cloudferrylib.utils import ssh_tunnel
 from cloudferrylib.utils.utils import forward_agent
 from cloudferrylib.utils import utils as utl
 
+LOG = utl.get_log(__name__)
+
 
 CLOUD = 'cloud'
 BACKEND = 'backend'
@@ -58,6 +69,9 @@ TRANSPORTER_MAP = {CEPH: {CEPH: 'SSHCephToCeph',
 class TransportEphemeral(action.Action):
     # TODO constants
 
+    def occupied_resources(self, info=None, **kwargs):
+        return resource_limits.instance_hosts(info)
+
     def run(self, info=None, **kwargs):
         info = copy.deepcopy(info)
         # Init before run
@@ -75,9 +89,14 @@ class TransportEphemeral(action.Action):
                 }
             }
             if is_ephemeral:
-                self.copy_ephemeral(self.src_cloud,
-                                    self.dst_cloud,
-                                    one_instance)
+                start = time.time()
+                temp_size = self.copy_ephemeral(self.src_cloud,
+                                                self.dst_cloud,
+                                                one_instance)
+                LOG.info("Ephemeral disk of instance %s copied in %.1fs, "
+                         "temp space used: %s", instance_id,
+                         time.time() - start,
+                         sizeof_format.sizeof_fmt(temp_size))
             new_info[utl.INSTANCES_TYPE].update(
                 one_instance[utl.INSTANCES_TYPE])
 
@@ -111,14 +130,23 @@ class TransportEphemeral(action.Action):
         transporter.run(info=info)
 
     def copy_ephemeral(self, src_cloud, dst_cloud, info):
+        """Copies ephemeral disks, returns bytes of temp space used"""
         dst_storage = dst_cloud.resources[utl.COMPUTE_RESOURCE]
         src_compute = src_cloud.resources[utl.COMPUTE_RESOURCE]
         src_backend = src_compute.config.compute.backend
         dst_backend = dst_storage.config.compute.backend
+        stream = self.cfg.migrate.ephemeral_stream_convert
         if (src_backend == CEPH) and (dst_backend == ISCSI):
-            self.copy_ephemeral_ceph_to_iscsi(src_cloud, dst_cloud, info)
+            if stream:
+                return self.stream_ephemeral_ceph_to_iscsi(src_cloud,
+                                                           dst_cloud, info)
+            return self.copy_ephemeral_ceph_to_iscsi(src_cloud, dst_cloud,
+                                                     info)
         elif (src_backend == ISCSI) and (dst_backend == CEPH):
-            self.copy_ephemeral_iscsi_to_ceph(src_cloud, info)
+            if stream:
+                return self.stream_ephemeral_iscsi_to_ceph(src_cloud,
+                                                           dst_cloud, info)
+            return self.copy_ephemeral_iscsi_to_ceph(src_cloud, info)
         else:
             self.copy_data_via_ssh(src_cloud,
                                    dst_cloud,
@@ -126,6 +154,12 @@ class TransportEphemeral(action.Action):
                                    utl.EPHEMERAL_BODY,
                                    utl.COMPUTE_RESOURCE,
                                    utl.INSTANCES_TYPE)
+            return 0
+
+    @staticmethod
+    def temp_disk_usage(cloud, path, host=None):
+        return sparse_file.parse_disk_usage(cloud.ssh_util.execute(
+            sparse_file.disk_usage_cmd(path), host))
 
     def copy_ephemeral_ceph_to_iscsi(self, src_cloud, dst_cloud, info):
         transporter = task_transfer.TaskTransfer(
@@ -141,6 +175,7 @@ class TransportEphemeral(action.Action):
         qemu_img_src = src_cloud.qemu_img
 
         temp_path_src = temp_src + "/%s" + utl.DISK_EPHEM
+        temp_size = 0
         for inst_id, inst in instances.iteritems():
 
             path_src_id_temp = temp_path_src % inst_id
@@ -155,6 +190,7 @@ class TransportEphemeral(action.Action):
                 utl.QCOW2,
                 'rbd:%s' % inst[EPHEMERAL][PATH_SRC], path_src_id_temp)
             inst[EPHEMERAL][PATH_SRC] = path_src_id_temp
+            temp_size += self.temp_disk_usage(src_cloud, path_src_id_temp)
 
         transporter.run(info=info)
 
@@ -163,6 +199,78 @@ class TransportEphemeral(action.Action):
             qemu_img_dst.diff_rebase(inst[EPHEMERAL][BACKING_FILE_DST],
                                      inst[EPHEMERAL][PATH_DST],
                                      host_compute_dst)
+        return temp_size
+
+    def stream_ephemeral_ceph_to_iscsi(self, src_cloud, dst_cloud, info):
+        """Converts RBD image to qcow2 disk on destination compute host.
+
+        qemu-nbd on source controller serves RBD image, which is read by
+        `qemu-img convert` on destination compute host through SSH tunnel,
+        so image is read once and written once, no temp file is used.
+        """
+        instances = info[utl.INSTANCES_TYPE]
+        host_src = src_cloud.getIpSsh()
+        host_dst = dst_cloud.getIpSsh()
+        qemu_img_dst = dst_cloud.qemu_img
+        tunnels = ssh_tunnel.get_pool()
+
+        for inst_id, inst in instances.iteritems():
+            host_compute_dst = inst[EPHEMERAL][HOST_DST]
+            path_dst = inst[EPHEMERAL][PATH_DST]
+            backing_file = qemu_img_dst.detect_backing_file(path_dst,
+                                                            host_compute_dst)
+            self.delete_remote_file_on_compute(path_dst, host_dst,
+                                               host_compute_dst)
+            with forward_agent(env.key_filename), \
+                    tunnels.tunnel(host_compute_dst, host_dst,
+                                   host_src) as port, \
+                    tunnels.reserved_port(inst_id) as nbd_port:
+                serve = qemu_img.nbd_serve_cmd(
+                    'rbd:%s' % inst[EPHEMERAL][PATH_SRC], nbd_port,
+                    fmt=utl.RAW)
+                convert = qemu_img.ssh_forward_cmd(
+                    'localhost',
+                    qemu_img.nbd_convert_cmd(utl.QCOW2, path_dst, nbd_port),
+                    nbd_port, options='-p %s' % port)
+                src_cloud.ssh_util.execute(
+                    qemu_img.nbd_stream_cmd(serve, convert, nbd_port))
+            qemu_img_dst.diff_rebase(backing_file, path_dst, host_compute_dst)
+        return 0
+
+    def stream_ephemeral_iscsi_to_ceph(self, src_cloud, dst_cloud, info):
+        """Converts disk of source compute host into RBD image.
+
+        qemu-nbd on source compute host serves disk as raw image, which is
+        written into RBD image by `qemu-img convert` on destination
+        controller, so disk is read once and written once, no temp file is
+        used.
+        """
+        instances = info[utl.INSTANCES_TYPE]
+        host_dst = dst_cloud.getIpSsh()
+        qemu_img_src = src_cloud.qemu_img
+
+        for inst_id, inst in instances.iteritems():
+            path_src = inst[EPHEMERAL][PATH_SRC]
+            path_dst = inst[EPHEMERAL][PATH_DST]
+            host_compute_src = inst[EPHEMERAL][HOST_SRC]
+            size = qemu_img_src.virtual_size(path_src, host_compute_src)
+            action_utils.delete_file_from_rbd(host_dst, path_dst)
+            dst_cloud.ssh_util.execute(rbd_util.RbdUtil.rbd_create_cmd(
+                int(math.ceil(size / (1024.0 * 1024.0))), path_dst))
+            with forward_agent(env.key_filename), \
+                    ssh_tunnel.get_pool().reserved_port(inst_id) as nbd_port:
+                serve = qemu_img.ssh_forward_cmd(
+                    host_compute_src,
+                    qemu_img.nbd_serve_cmd(path_src, nbd_port),
+                    nbd_port, remote=False)
+                convert = qemu_img.ssh_forward_cmd(
+                    host_dst,
+                    qemu_img.nbd_convert_cmd(utl.RAW, 'rbd:%s' % path_dst,
+                                             nbd_port, create=False),
+                    nbd_port)
+                src_cloud.ssh_util.execute(qemu_img.nbd_stream_cmd(
+                    serve, convert, nbd_port, host=host_compute_src))
+        return 0
 
     def copy_ephemeral_iscsi_to_ceph(self, src_cloud, info):
         instances = info[utl.INSTANCES_TYPE]
@@ -173,6 +281,7 @@ class TransportEphemeral(action.Action):
             resource_name=utl.INSTANCES_TYPE,
             resource_root_name=utl.EPHEMERAL_BODY)
 
+        temp_size = 0
         for inst_id, inst in instances.iteritems():
             path_src = inst[EPHEMERAL][PATH_SRC]
             path_src_temp_raw = path_src + "." + utl.RAW
@@ -183,5 +292,8 @@ class TransportEphemeral(action.Action):
                                  path_src_temp_raw,
                                  host_src)
             inst[EPHEMERAL][PATH_SRC] = path_src_temp_raw
+            temp_size += self.temp_disk_usage(src_cloud, path_src_temp_raw,
+                                              host_src)
 
         transporter.run(info=info)
+        return temp_size
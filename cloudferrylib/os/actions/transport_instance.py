@@ -17,6 +17,7 @@ import copy
 
 from cloudferrylib.base.action import action
 from cloudferrylib.os.identity import keystone
+from cloudferrylib.scheduler import resource_limits
 from cloudferrylib.utils import utils as utl
 
 
@@ -37,6 +38,7 @@ PATH_DST = 'path_dst'
 HOST_DST = 'host_dst'
 PATH_SRC = 'path_src'
 HOST_SRC = 'host_src'
+PRECOPY = 'precopy'
 
 TEMP = 'temp'
 FLAVORS = 'flavors'
@@ -51,6 +53,9 @@ TRANSPORTER_MAP = {CEPH: {CEPH: 'ssh_ceph_to_ceph',
 class TransportInstance(action.Action):
     # TODO constants
 
+    def occupied_resources(self, **kwargs):
+        return resource_limits.api(resource_limits.NOVA_API, self.dst_cloud)
+
     def run(self, info=None, **kwargs):
         info = copy.deepcopy(info)
         new_info = {
@@ -118,6 +123,9 @@ class TransportInstance(action.Action):
             instance_new[EPHEMERAL][PATH_SRC] = ephemeral_path_src
             ephemeral_host_src = instance_old[EPHEMERAL][HOST_SRC]
             instance_new[EPHEMERAL][HOST_SRC] = ephemeral_host_src
+            if PRECOPY in instance_old[EPHEMERAL]:
+                instance_new[EPHEMERAL][PRECOPY] = \
+                    instance_old[EPHEMERAL][PRECOPY]
 
             diff_path_src = instance_old[DIFF][PATH_SRC]
             instance_new[DIFF][PATH_SRC] = diff_path_src
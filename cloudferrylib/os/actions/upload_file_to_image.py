@@ -2,6 +2,7 @@
 
 from cloudferrylib.base import image
 from cloudferrylib.base.action import action
+from cloudferrylib.scheduler import resource_limits
 from fabric.api import run, settings
 from cloudferrylib.utils import utils as utl
 
@@ -29,6 +30,9 @@ FLAVORS = 'flavors'
 
 class UploadFileToImage(action.Action):
 
+    def occupied_resources(self, **kwargs):
+        return resource_limits.api(resource_limits.GLANCE_API, self.cloud)
+
     def run(self, info=None, **kwargs):
         cfg = self.cloud.cloud_config.cloud
         ssh_attempts = self.cloud.cloud_config.migrate.ssh_connection_attempts
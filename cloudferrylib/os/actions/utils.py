@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and#
 # limitations under the License.
 
+from cloudferrylib.utils import ssh_tunnel
 from cloudferrylib.utils import utils
 from fabric.api import run, settings, env
 import copy
@@ -34,7 +35,8 @@ def transfer_file_to_file(src_cloud,
     with settings(host_string=ssh_ip_src,
                   connection_attempts=env.connection_attempts):
         with utils.forward_agent(cfg_migrate.key_filename):
-            with utils.up_ssh_tunnel(host_dst, ssh_ip_dst, ssh_ip_src) as port:
+            with ssh_tunnel.get_pool().tunnel(host_dst, ssh_ip_dst,
+                                              ssh_ip_src) as port:
                 if cfg_migrate.file_compression == "dd":
                     run(("ssh -oStrictHostKeyChecking=no %s 'dd bs=1M " +
                          "if=%s' | ssh -oStrictHostKeyChecking=no " +
@@ -11,11 +11,11 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import json
 import os
 
 from xml.etree import ElementTree
 
+from cloudferrylib.utils import qemu_img
 from cloudferrylib.utils import utils
 
 LOG = utils.get_log(__name__)
@@ -43,11 +43,13 @@ class QemuBackingFileMover(object):
 
     def __enter__(self):
         cmd = _qemu_img_rebase(self.src, self.dst)
+        qemu_img.get_cache().invalidate(self.runner.host, self.dst)
         self.runner.run(cmd)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         cmd = _qemu_img_rebase(self.dst, self.src)
+        qemu_img.get_cache().invalidate(self.runner.host, self.dst)
         self.runner.run_ignoring_errors(cmd)
         return self
 
@@ -91,17 +93,18 @@ class Libvirt(object):
         self.runner = remote_runner
 
     def get_backing_file(self, instance_id):
-        cmd = ("qemu-img info {image_path} --output json".format(
-            image_path=instance_image_path(instance_id)))
-
-        try:
-            image_info = json.loads(self.runner.run(cmd))
-            return image_info['backing-filename']
-        except (ValueError, TypeError) as e:
-            LOG.error("Invalid value received from qemu: %s!", e)
-        except KeyError:
+        image_path = instance_image_path(instance_id)
+        image_info = qemu_img.get_cache().lookup(
+            self.runner.run, self.runner.host, [image_path])[image_path]
+
+        if image_info is None:
+            LOG.error("Invalid value received from qemu for instance '%s'!",
+                      instance_id)
+        elif image_info.backing_file is None:
             LOG.warning("Instance '%s' does not have backing file associated!",
                         instance_id)
+        else:
+            return image_info.backing_file
 
     def get_xml(self, libvirt_instance_name):
         cmd = ("virsh dumpxml {inst_name}".format(
@@ -120,6 +123,8 @@ class Libvirt(object):
     def move_backing_file(self, source_file, instance_id):
         cmd = _qemu_img_rebase(src=source_file,
                                dst=instance_image_path(instance_id))
+        qemu_img.get_cache().invalidate(self.runner.host,
+                                        instance_image_path(instance_id))
         self.runner.run(cmd)
 
     def live_migrate(self, libvirt_instance_name, dest_host, migration_xml):
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 
+import collections
 import copy
 import random
 import pprint
@@ -123,6 +124,11 @@ class NovaCompute(compute.Compute):
         self.mysql_connector = cloud.mysql_connector('nova')
         # List of instance IDs which failed to create
         self._failed_instances = []
+        # block devices of instances by compute host, prefetched by
+        # read_info
+        self.libvirt_info = {}
+        # IP addresses by compute host, cached while read_info runs
+        self.compute_ips = None
 
     @property
     def nova_client(self):
@@ -258,21 +264,72 @@ class NovaCompute(compute.Compute):
 
         info = {'instances': {}}
 
-        for instance in self.get_instances_list(search_opts=search_opts):
-            if instance.status in ALLOWED_VM_STATUSES:
-                if (self.cloud.position == 'dst' or
-                        (self.cloud.position == 'src' and
-                            self.filter_tenant_id is not None and
-                            self.filter_tenant_id == instance.tenant_id) or
-                        (self.cloud.position == 'src' and
-                            self.filter_tenant_id is None)):
-                    converted = self.convert(instance, self.config, self.cloud)
-                    if converted is None:
-                        continue
-                    info['instances'][instance.id] = converted
+        instances_list = [
+            instance
+            for instance in self.get_instances_list(search_opts=search_opts)
+            if instance.status in ALLOWED_VM_STATUSES and
+            (self.cloud.position == 'dst' or
+             (self.cloud.position == 'src' and
+              self.filter_tenant_id is not None and
+              self.filter_tenant_id == instance.tenant_id) or
+             (self.cloud.position == 'src' and
+              self.filter_tenant_id is None))]
+
+        self.prefetch_libvirt_info(instances_list)
+        self.compute_ips = {}
+        try:
+            for instance in instances_list:
+                converted = self.convert(instance, self.config, self.cloud)
+                if converted is None:
+                    continue
+                info['instances'][instance.id] = converted
+        finally:
+            self.libvirt_info = {}
+            self.compute_ips = None
 
         return info
 
+    def prefetch_libvirt_info(self, instances_list):
+        """Gets block devices of instances with one remote call per host"""
+        names_by_host = collections.defaultdict(list)
+        for instance in instances_list:
+            names_by_host[instance_host(instance)].append(
+                instance_libvirt_name(instance))
+        for host, names in names_by_host.iteritems():
+            self.libvirt_info[host] = utl.get_libvirt_instances_info(
+                names, self.cloud.getIpSsh(), host,
+                self.config.cloud.ssh_user,
+                self.config.cloud.ssh_sudo_password)
+
+    def get_ext_ip(self, ext_cidr, host):
+        """Returns IP address of compute host in :ext_cidr"""
+        init_host = self.cloud.getIpSsh()
+        ssh_user = self.config.cloud.ssh_user
+        if self.compute_ips is None:
+            return utl.get_ext_ip(ext_cidr, init_host, host, ssh_user)
+        if host not in self.compute_ips:
+            self.compute_ips[host] = utl.get_ips(init_host, host, ssh_user)
+        return utl.get_ext_ip(ext_cidr, init_host, host, ssh_user,
+                              list_ips=self.compute_ips[host])
+
+    def get_libvirt_block_info(self, libvirt_name, host):
+        """Returns block devices of instance or None if it's not on host"""
+        if host in self.libvirt_info:
+            return self.libvirt_info[host].get(libvirt_name)
+        ssh_user = self.config.cloud.ssh_user
+        ssh_sudo_password = self.config.cloud.ssh_sudo_password
+        if not utl.libvirt_instance_exists(libvirt_name,
+                                           self.cloud.getIpSsh(),
+                                           host,
+                                           ssh_user,
+                                           ssh_sudo_password):
+            return None
+        return utl.get_libvirt_block_info(libvirt_name,
+                                          self.cloud.getIpSsh(),
+                                          host,
+                                          ssh_user,
+                                          ssh_sudo_password)
+
     @staticmethod
     def convert_instance(instance, cfg, cloud):
         identity_res = cloud.resources[utl.IDENTITY_RESOURCE]
@@ -302,35 +359,21 @@ class NovaCompute(compute.Compute):
         is_ceph = cfg.compute.backend.lower() == utl.CEPH
         direct_transfer = cfg.migrate.direct_compute_transfer
 
-        ssh_user = cfg.cloud.ssh_user
-
         if direct_transfer:
             ext_cidr = cfg.cloud.ext_cidr
-            host = utl.get_ext_ip(ext_cidr,
-                                  cloud.getIpSsh(),
-                                  instance_node,
-                                  ssh_user)
+            host = compute_res.get_ext_ip(ext_cidr, instance_node)
         elif is_ceph:
             host = cfg.compute.host_eph_drv
         else:
             host = instance_node
 
-        if not utl.libvirt_instance_exists(instance_name,
-                                           cloud.getIpSsh(),
-                                           instance_node,
-                                           ssh_user,
-                                           cfg.cloud.ssh_sudo_password):
+        instance_block_info = compute_res.get_libvirt_block_info(
+            instance_name, instance_node)
+        if instance_block_info is None:
             LOG.warning('Instance %s (%s) not found on %s, skipping migration',
                         instance_name, instance.id, instance_node)
             return None
 
-        instance_block_info = utl.get_libvirt_block_info(
-            instance_name,
-            cloud.getIpSsh(),
-            instance_node,
-            ssh_user,
-            cfg.cloud.ssh_sudo_password)
-
         ephemeral_path = {
             'path_src': None,
             'path_dst': None,
@@ -33,7 +33,9 @@ from cloudferrylib.base import image
 from cloudferrylib.utils import filters
 from cloudferrylib.utils import sizeof_format
 from cloudferrylib.os.image import filters as glance_filters
+from cloudferrylib.utils import bandwidth
 from cloudferrylib.utils import file_like_proxy
+from cloudferrylib.utils import progress_events
 from cloudferrylib.utils import utils as utl
 from cloudferrylib.utils import remote_runner
 
@@ -112,6 +114,10 @@ class GlanceImageProgessMigrationView(object):
                   'num_total_images': self.num_private + self.num_public,
                   'size_percentage': size_percentage,
                   'size_total': sizeof_format.sizeof_fmt(self.total_size)})
+        progress_events.progress(utl.IMAGES_TYPE, self.cnt,
+                                 self.num_private + self.num_public,
+                                 bytes_done=self.progress,
+                                 bytes_total=self.total_size)
 
 
 class GlanceImage(image.Image):
@@ -469,19 +475,25 @@ class GlanceImage(image.Image):
                 # and then - delete from database
 
                 try:
-                    data_proxy = file_like_proxy.FileLikeProxy(
-                        img, self.config['migrate']['speed_limit'])
-
-                    created_image = self.create_image(
-                        name=img['name'],
-                        container_format=(img['container_format'] or "bare"),
-                        disk_format=(img['disk_format'] or "qcow2"),
-                        is_public=img['is_public'],
-                        protected=img['protected'],
-                        owner=img['owner'],
-                        size=img['size'],
-                        properties=img['properties'],
-                        data=data_proxy)
+                    with bandwidth.transfer(
+                            img['name'],
+                            img['resource'].config.cloud.host,
+                            self.config.cloud.host,
+                            bandwidth.IMAGE,
+                            config=self.config) as share:
+                        data_proxy = file_like_proxy.FileLikeProxy(img, share)
+
+                        created_image = self.create_image(
+                            name=img['name'],
+                            container_format=(img['container_format'] or
+                                              "bare"),
+                            disk_format=(img['disk_format'] or "qcow2"),
+                            is_public=img['is_public'],
+                            protected=img['protected'],
+                            owner=img['owner'],
+                            size=img['size'],
+                            properties=img['properties'],
+                            data=data_proxy)
 
                     image_members = img['members'].get(img['id'], {})
                     LOG.debug("new image ID %s", created_image.id)
@@ -0,0 +1,114 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Registry of actions available for scenarios.
+
+Keeps persistent index `action class name -> module` for every package
+listed in `paths` of tasks file. Module is imported only when it is
+not in the index yet or its file was modified since it was indexed,
+otherwise modules are imported lazily - only when action defined in
+it is actually referenced by a task.
+"""
+
+import importlib
+import inspect
+import json
+import os
+
+from cloudferrylib.base.action import action
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+# index is kept between runs, so it is not put into temp directory
+ACTIONS_INDEX = '~/.cache/cloudferry/actions_index.json'
+INDEX_VERSION = 1
+
+
+class ActionNotFound(KeyError):
+    pass
+
+
+def list_modules(package_path):
+    return sorted(f[:-len('.py')] for f in os.listdir(package_path)
+                  if f.endswith('.py'))
+
+
+def find_actions(module):
+    return sorted(name for name, value in module.__dict__.items()
+                  if inspect.isclass(value) and
+                  issubclass(value, action.Action))
+
+
+class ActionRegistry(object):
+    def __init__(self, index_path=ACTIONS_INDEX):
+        self.index_path = index_path and os.path.expanduser(index_path)
+        self.index = self.load()
+        self.actions = {}
+        self.changed = False
+
+    def load(self):
+        if self.index_path and os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path) as index_file:
+                    index = json.load(index_file)
+                if index.get('version') == INDEX_VERSION:
+                    return index
+            except ValueError:
+                LOG.warning("Actions index '%s' is broken, rebuilding it",
+                            self.index_path)
+        return {'version': INDEX_VERSION, 'packages': {}}
+
+    def save(self):
+        if not self.changed or not self.index_path:
+            return
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir and not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as index_file:
+            json.dump(self.index, index_file, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.index_path)
+        self.changed = False
+
+    def add_package(self, package):
+        """Indexes actions of package, e.g. 'cloudferrylib.os.actions'"""
+        path = importlib.import_module(package).__path__[0]
+        cached = self.index['packages'].get(package, {})
+        modules = {}
+        for name in list_modules(path):
+            file_path = os.path.join(path, name + '.py')
+            mtime = os.path.getmtime(file_path)
+            entry = cached.get(name)
+            if entry is None or entry['mtime'] != mtime:
+                module_name = '%s.%s' % (package, name)
+                LOG.debug("Indexing actions of %s", module_name)
+                entry = {
+                    'mtime': mtime,
+                    'actions': find_actions(
+                        importlib.import_module(module_name))
+                }
+                self.changed = True
+            modules[name] = entry
+            for action_name in entry['actions']:
+                self.actions[action_name] = '%s.%s' % (package, name)
+        if modules != cached:
+            self.index['packages'][package] = modules
+            self.changed = True
+
+    def get(self, action_name):
+        if action_name not in self.actions:
+            raise ActionNotFound(action_name)
+        module = importlib.import_module(self.actions[action_name])
+        return getattr(module, action_name)
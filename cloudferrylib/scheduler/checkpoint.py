@@ -0,0 +1,133 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Checkpoints of scenario execution.
+
+After every completed task scheduler stores the namespace and the list of
+steps the cursor went through into a local state file. Resumed scenario
+rebuilds the same net, walks the cursor over already completed steps
+without running them (following the same branches as the original run)
+and continues from the first task which was not completed.
+
+Parallel branch (`WrapThreadTask`) is done only when it's joined, so state
+is not saved while any branch is spawned but not joined: migration
+interrupted meanwhile is resumed from the state saved before the branch
+was spawned, and the branch is run again.
+"""
+
+import cPickle
+import os
+
+from cloudferrylib.scheduler.cursor import DEFAULT
+from cloudferrylib.scheduler.namespace import CHILDREN
+from cloudferrylib.scheduler import thread_tasks
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+# namespace keys which are re-created on every run and never persisted
+SKIP_KEYS = ('__init_task__', CHILDREN)
+
+
+class CheckpointError(RuntimeError):
+    pass
+
+
+class Checkpoint(object):
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.chains = {}
+        self.namespace = {}
+        # ids of branches which are spawned, but not joined yet
+        self.open_branches = set()
+        if resume:
+            self.load()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            raise CheckpointError("Checkpoint file '%s' does not exist, "
+                                  "nothing to resume" % self.path)
+        with open(self.path, 'rb') as state_file:
+            state = cPickle.load(state_file)
+        self.chains = state['chains']
+        self.namespace = {k: cPickle.loads(v)
+                          for k, v in state['namespace'].iteritems()}
+        LOG.info("Resuming from checkpoint '%s': %s", self.path,
+                 ", ".join("%s - %d steps" % (name, len(steps))
+                           for name, steps in self.chains.items()))
+
+    def restore_namespace(self, namespace):
+        namespace.vars.update(self.namespace)
+
+    def completed_steps(self, chain_name):
+        return list(self.chains.get(chain_name, []))
+
+    @staticmethod
+    def skip(task, step):
+        """Moves over completed task without running it.
+
+        Branch chosen by the task in the original run is restored, so that
+        cursor follows the same path.
+        """
+        if repr(task) != step['task']:
+            raise CheckpointError("Checkpoint does not match scenario: "
+                                  "expected %s, got %s" %
+                                  (step['task'], repr(task)))
+        task.num_element = step['num_element']
+        LOG.info("Skipping task completed before: %s", task)
+
+    def task_completed(self, chain_name, task, namespace):
+        self.chains.setdefault(chain_name, []).append({
+            'task': repr(task),
+            'num_element': getattr(task, 'num_element', DEFAULT)
+        })
+        if isinstance(task, thread_tasks.WrapThreadTask):
+            self.open_branches.add(id(task))
+        elif isinstance(task, thread_tasks.WaitThreadTask):
+            self.open_branches.discard(id(task.tt))
+        elif isinstance(task, thread_tasks.WaitThreadAllTask):
+            self.open_branches.clear()
+        if not self.open_branches:
+            self.save(namespace)
+
+    def dump_namespace(self, namespace):
+        dump = {}
+        for key, value in namespace.vars.iteritems():
+            if key in SKIP_KEYS:
+                continue
+            try:
+                dump[key] = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning("Namespace key '%s' is not stored in "
+                            "checkpoint: %s", key, e)
+        return dump
+
+    def save(self, namespace):
+        # values are pickled one by one, so a single unpicklable value
+        # does not break the whole checkpoint
+        state = {
+            'chains': self.chains,
+            'namespace': self.dump_namespace(namespace)
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as state_file:
+            cPickle.dump(state, state_file, cPickle.HIGHEST_PROTOCOL)
+        # rename is atomic, so state file is never left half-written
+        os.rename(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
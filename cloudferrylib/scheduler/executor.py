@@ -0,0 +1,265 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Executors of parallel (`&`) scenario branches.
+
+Executor runs branch function - which returns namespace changes made by
+the branch as `(updated, deleted)` tuple - and gives back handle, which
+joining task (`WaitThreadTask`, `WaitThreadAllTask`) uses to wait for the
+branch, get its namespace changes and re-raise its exception.
+
+ - `process` - every branch runs in a separate process, safe for code
+   relying on global state (e.g. fabric `env`);
+ - `thread` - branches run in a bounded pool of threads, avoids fork cost,
+   suitable for I/O-bound branches.
+
+`run_limited` runs items (images, probes of host pairs) with executor
+within `resource_limits`, finishing them in order they complete.
+"""
+
+import cPickle
+import multiprocessing
+import sys
+import threading
+import time
+
+from cloudferrylib.scheduler import resource_limits
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+PROCESS = 'process'
+THREAD = 'thread'
+# seconds between checks of handles in `wait_any`
+WAIT_INTERVAL = 0.1
+
+
+class BranchError(RuntimeError):
+    """Branch failed with exception which can't be passed back as is"""
+
+
+class BranchHandle(object):
+    def __init__(self):
+        self.result = None
+        self.exc_info = None
+        self.joined = False
+
+    def wait(self):
+        pass
+
+    def done(self):
+        """Returns `True` if branch is finished and `join` won't block"""
+        return True
+
+    def join(self):
+        """Waits for branch and returns its namespace changes.
+
+        Exception raised by branch is re-raised in joining task.
+        """
+        if not self.joined:
+            self.wait()
+            self.joined = True
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
+class ThreadHandle(BranchHandle):
+    def __init__(self, func, semaphore):
+        super(ThreadHandle, self).__init__()
+        self.func = func
+        self.semaphore = semaphore
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def run(self):
+        with self.semaphore:
+            try:
+                self.result = self.func()
+            except Exception:  # pylint: disable=broad-except
+                self.exc_info = sys.exc_info()
+
+    def start(self):
+        self.thread.start()
+
+    def done(self):
+        return not self.thread.is_alive()
+
+    def wait(self):
+        self.thread.join()
+
+
+class ProcessHandle(BranchHandle):
+    def __init__(self, func):
+        super(ProcessHandle, self).__init__()
+        self.func = func
+        self.receiver, self.sender = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=self.run)
+
+    def run(self):
+        try:
+            payload = (self.func(), None)
+        except Exception as e:  # pylint: disable=broad-except
+            payload = (None, e)
+        try:
+            data = cPickle.dumps(payload, cPickle.HIGHEST_PROTOCOL)
+        except Exception:  # pylint: disable=broad-except
+            data = cPickle.dumps(
+                (None, BranchError("Branch result can't be passed to parent "
+                                   "process: %r" % (payload,))),
+                cPickle.HIGHEST_PROTOCOL)
+        self.sender.send_bytes(data)
+        self.sender.close()
+
+    def start(self):
+        self.process.start()
+        self.sender.close()
+
+    def done(self):
+        # result is sent or pipe is closed by exited process
+        return self.joined or self.receiver.poll()
+
+    def wait(self):
+        try:
+            result, error = cPickle.loads(self.receiver.recv_bytes())
+        except EOFError:
+            result, error = None, BranchError(
+                "Branch process exited without result")
+        self.process.join()
+        self.result = result
+        if error is not None:
+            self.exc_info = (type(error), error, None)
+
+
+def wait_any(handles, interval=WAIT_INTERVAL):
+    """Waits until any of :handles is finished, returns its index"""
+    while True:
+        for i, handle in enumerate(handles):
+            if handle.done():
+                return i
+        time.sleep(interval)
+
+
+def run_limited(items, submit, finish, resources, limits, workers=1,
+                stop_on_failure=False):
+    """Runs :items, up to :workers at once, returns number of failed items.
+
+    Item is started by `submit(item)`, which returns handle, as soon as
+    slots of `resources(item)` are taken in :limits, so items waiting for
+    busy resources don't block other items. `finish(item, handle)` joins
+    finished item and returns `True` if it failed, slots are released
+    afterwards. No new items are started after first failure if
+    :stop_on_failure is set.
+    """
+    pending = list(items)
+    running = []
+    failed = 0
+    try:
+        while running or (pending and not (stop_on_failure and failed)):
+            started = None
+            if (len(running) < workers and
+                    not (stop_on_failure and failed)):
+                started = _start_ready(pending, submit, resources, limits)
+            if started is not None:
+                running.append(started)
+            elif running:
+                handle, hold, item = running.pop(
+                    wait_any([r[0] for r in running]))
+                try:
+                    failed += 1 if finish(item, handle) else 0
+                finally:
+                    hold.release()
+            else:
+                # slots are taken by other tasks sharing limits
+                time.sleep(resource_limits.POLL_INTERVAL)
+    finally:
+        for handle, hold, _ in running:
+            try:
+                handle.join()
+            except Exception:  # pylint: disable=broad-except
+                pass
+            hold.release()
+    return failed
+
+
+def _start_ready(pending, submit, resources, limits):
+    """Starts first pending item which resources are free, returns
+    `(handle, hold, item)` or `None`.
+    """
+    for item in pending:
+        hold = limits.try_acquire(resources(item))
+        if hold is not None:
+            pending.remove(item)
+            try:
+                return submit(item), hold, item
+            except Exception:
+                hold.release()
+                raise
+    return None
+
+
+class ProcessExecutor(object):
+    name = PROCESS
+
+    def submit(self, func):
+        handle = ProcessHandle(func)
+        handle.start()
+        return handle
+
+
+class ThreadExecutor(object):
+    name = THREAD
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.semaphore = (threading.BoundedSemaphore(workers)
+                          if workers else DummySemaphore())
+
+    def submit(self, func):
+        handle = ThreadHandle(func, self.semaphore)
+        handle.start()
+        return handle
+
+
+class DummySemaphore(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+EXECUTORS = {
+    PROCESS: ProcessExecutor,
+    THREAD: ThreadExecutor,
+}
+
+
+def get_executor(config=None):
+    """Creates executor from scenario `executor` value.
+
+    Value is either executor name (`process`, `thread`) or dict with
+    `type` key and executor arguments, e.g. `{type: thread, workers: 4}`.
+    """
+    if not config:
+        return ProcessExecutor()
+    if not isinstance(config, dict):
+        config = {'type': config}
+    config = dict(config)
+    name = config.pop('type', PROCESS)
+    if name not in EXECUTORS:
+        raise ValueError("Unknown executor '%s', possible values: %s" %
+                         (name, ", ".join(sorted(EXECUTORS))))
+    LOG.debug("Parallel branches executor: %s %s", name, config)
+    return EXECUTORS[name](**config)
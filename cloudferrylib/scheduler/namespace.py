@@ -11,19 +11,162 @@
 # implied.
 # See the License for the specific language governing permissions and#
 # limitations under the License.
+import collections
 import copy
+import threading
+import weakref
 __author__ = 'mirrorcoder'
 
 CHILDREN = '__children__'
+_MISSING = object()
+
+
+class CowVars(collections.MutableMapping):
+    """Copy-on-write namespace variables.
+
+    Forked variables do not copy anything: they read values through the
+    parent and store only keys assigned (or deleted) in the fork. Values
+    are shared, so they must be treated as immutable - replace the key
+    instead of modifying value in place. When parent reassigns a key after
+    fork, previous value is preserved in every live fork which did not
+    override this key, so forks always see parent state as of fork time.
+
+    Cost of fork is constant, cost of assignment is proportional to the
+    number of live forks, not to the size of stored data.
+
+    Deep fork is a deep copy of variables taken at fork time instead, so
+    values may be modified in place both in parent and in fork.
+
+    Whole tree of forks shares one lock, so parent and forks may be used
+    from different threads (e.g. `thread` executor of parallel branches).
+    """
+
+    def __init__(self, data=None, parent=None):
+        self.data = data if data is not None else {}
+        self.parent = parent
+        # keys assigned or deleted in this fork, merged back to parent
+        self.changed = set()
+        # keys which do not exist as of fork time or were deleted
+        self.hidden = set()
+        self.forks = []
+        self.lock = parent.lock if parent is not None else threading.RLock()
+
+    def fork(self, deep_copy=False):
+        with self.lock:
+            if deep_copy:
+                # branches started in fork are joined in fork, so children
+                # of parent are not copied
+                return CowVars(copy.deepcopy(
+                    {k: self._lookup(k) for k in self.keys()
+                     if k != CHILDREN}))
+            forked = CowVars(parent=self)
+            self.forks.append(weakref.ref(forked))
+        return forked
+
+    def live_forks(self):
+        self.forks = [ref for ref in self.forks if ref() is not None]
+        return [ref() for ref in self.forks]
+
+    def _lookup(self, key):
+        if key in self.data:
+            return self.data[key]
+        if key in self.hidden or self.parent is None:
+            return _MISSING
+        return self.parent._lookup(key)
+
+    def _preserve(self, key):
+        """Keeps current value of key in forks before it is changed"""
+        value = _MISSING
+        for forked in self.live_forks():
+            if key in forked.data or key in forked.hidden:
+                continue
+            if value is _MISSING:
+                value = self._lookup(key)
+            if value is _MISSING:
+                forked.hidden.add(key)
+            else:
+                forked.data[key] = value
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self._preserve(key)
+            self.data[key] = value
+            self.hidden.discard(key)
+            self.changed.add(key)
+
+    def __delitem__(self, key):
+        with self.lock:
+            if self._lookup(key) is _MISSING:
+                raise KeyError(key)
+            self._preserve(key)
+            self.data.pop(key, None)
+            self.hidden.add(key)
+            self.changed.add(key)
+
+    def __contains__(self, key):
+        with self.lock:
+            return self._lookup(key) is not _MISSING
+
+    def keys(self):
+        with self.lock:
+            keys = set(self.data)
+            if self.parent is not None:
+                keys.update(k for k in self.parent.keys()
+                            if k not in self.hidden)
+        return list(keys)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def changes(self):
+        """Returns keys assigned and keys deleted in this fork"""
+        with self.lock:
+            updated = {k: self.data[k] for k in self.changed
+                       if k in self.data}
+            deleted = self.changed.difference(updated)
+        return updated, deleted
 
 
 class Namespace:
 
-    def __init__(self, vars={}):
+    def __init__(self, vars=None):
+        if not isinstance(vars, CowVars):
+            vars = CowVars(vars)
         if CHILDREN not in vars:
             vars[CHILDREN] = dict()
         self.vars = vars
 
     def fork(self, is_deep_copy=False):
-        return Namespace(copy.copy(self.vars)) if not is_deep_copy \
-            else Namespace(copy.deepcopy(self.vars))
+        forked = Namespace(self.vars.fork(deep_copy=is_deep_copy))
+        # branches started in fork are joined in fork
+        forked.vars[CHILDREN] = dict()
+        return forked
+
+    def changes(self, exclude=(CHILDREN,)):
+        """Returns `(updated, deleted)` variables changed after fork"""
+        updated, deleted = self.vars.changes()
+        return ({k: v for k, v in updated.iteritems() if k not in exclude},
+                deleted.difference(exclude))
+
+    def merge(self, forked, exclude=(CHILDREN,)):
+        """Applies variables changed in forked namespace to this one"""
+        self.apply(*forked.changes(exclude), exclude=exclude)
+
+    def apply(self, updated, deleted, exclude=(CHILDREN,)):
+        """Applies changes returned by `changes` of forked namespace"""
+        for key, value in updated.iteritems():
+            if key not in exclude:
+                self.vars[key] = value
+        for key in deleted:
+            if key not in exclude and key in self.vars:
+                del self.vars[key]
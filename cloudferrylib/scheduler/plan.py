@@ -0,0 +1,338 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Execution plan of task net.
+
+Net is compiled into segments - flat lists of tasks in the order `Cursor`
+would return them, up to the next conditional element (`|`). Segment is
+a DAG: every node knows namespace keys its task reads and writes (taken
+from source of task `run` method) and nodes it depends on. Tasks which
+are not marked `thread_safe`, conditional elements, parallel branches and
+tasks with unknown namespace access are barriers: they depend on all
+previous nodes and all following nodes depend on them.
+
+`PlanRunner` runs independent thread safe tasks of segment concurrently.
+Next segment is compiled after previous one is finished, when condition
+of its last element is known.
+"""
+
+import ast
+import inspect
+import Queue
+import textwrap
+import threading
+
+from cloudferrylib.scheduler import task as scheduler_task
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+# namespace keys accessed by task can't be determined
+ANY = None
+KWARGS_READERS = ('get', 'pop', 'setdefault')
+
+_access_cache = {}
+
+
+def literal_key(node):
+    if isinstance(node, ast.Index):
+        node = node.value
+    if isinstance(node, ast.Str):
+        return node.s
+    return ANY
+
+
+def analyze_run(func):
+    """Returns (reads, writes) namespace keys of task `run` method"""
+    source = textwrap.dedent(inspect.getsource(func))
+    func_def = ast.parse(source).body[0]
+    reads = set(arg.id for arg in func_def.args.args[1:])
+    kwargs_name = func_def.args.kwarg
+    kwargs_uses = 0
+    known_uses = 0
+    writes = set()
+    for node in ast.walk(func_def):
+        if isinstance(node, ast.Name) and node.id == kwargs_name:
+            kwargs_uses += 1
+        elif (isinstance(node, ast.Call) and
+                isinstance(node.func, ast.Attribute) and
+                isinstance(node.func.value, ast.Name) and
+                node.func.value.id == kwargs_name and
+                node.func.attr in KWARGS_READERS and node.args):
+            key = literal_key(node.args[0])
+            if key is ANY:
+                reads = ANY
+            elif reads is not ANY:
+                reads.add(key)
+            known_uses += 1
+        elif (isinstance(node, ast.Subscript) and
+                isinstance(node.value, ast.Name) and
+                node.value.id == kwargs_name):
+            key = literal_key(node.slice)
+            if key is ANY:
+                reads = ANY
+            elif reads is not ANY:
+                reads.add(key)
+            known_uses += 1
+        elif isinstance(node, ast.Return) and writes is not ANY:
+            if node.value is None or (isinstance(node.value, ast.Name) and
+                                      node.value.id == 'None'):
+                continue
+            if not isinstance(node.value, ast.Dict):
+                writes = ANY
+                continue
+            keys = [literal_key(k) for k in node.value.keys]
+            if ANY in keys:
+                writes = ANY
+            else:
+                writes.update(keys)
+    if kwargs_uses > known_uses:
+        # kwargs is passed somewhere as a whole
+        reads = ANY
+    return reads, writes
+
+
+def get_access(task):
+    """Returns (reads, writes) namespace keys of task, ANY if unknown"""
+    if not isinstance(task, scheduler_task.BaseTask):
+        return ANY, ANY
+    cls = task.__class__
+    if cls not in _access_cache:
+        if (cls.__call__.im_func is not
+                scheduler_task.BaseTask.__call__.im_func):
+            access = ANY, ANY
+        else:
+            try:
+                access = analyze_run(cls.run.im_func)
+            except (IOError, TypeError, SyntaxError, IndexError):
+                access = ANY, ANY
+        _access_cache[cls] = access
+    return _access_cache[cls]
+
+
+def next_of(element):
+    """Returns element which follows `element`, same as `Cursor` does"""
+    if element.num_element < len(element.next_element):
+        return element.next_element[element.num_element]
+    return element.next_element[0]
+
+
+def walk_segment(start):
+    """Returns elements from `start` up to the next conditional element"""
+    elements = []
+    visited = set()
+    element = start
+    while element is not None and id(element) not in visited:
+        visited.add(id(element))
+        elements.append(element)
+        if len(element.next_element) > 1:
+            break
+        element = element.next_element[0]
+    return elements
+
+
+class PlanNode(object):
+    def __init__(self, index, task, switch=False):
+        self.index = index
+        self.task = task
+        self.reads, self.writes = get_access(task)
+        self.switch = switch
+        self.barrier = (switch or
+                        not getattr(task, 'thread_safe', False) or
+                        self.reads is ANY or self.writes is ANY)
+        self.deps = set()
+
+    def conflicts(self, other):
+        return bool(self.writes & (other.reads | other.writes) or
+                    self.reads & other.writes)
+
+    def __repr__(self):
+        return repr(self.task)
+
+
+class Plan(object):
+    def __init__(self, elements):
+        self.elements = elements
+        self.nodes = []
+        for element in elements:
+            self.add_node(element, len(element.next_element) > 1)
+            # parallel branches are started after element, see Cursor
+            for thread in reversed(element.parall_elem):
+                self.add_node(thread, False)
+
+    def add_node(self, task, switch):
+        node = PlanNode(len(self.nodes), task, switch)
+        for prev in reversed(self.nodes):
+            if node.barrier or prev.barrier or node.conflicts(prev):
+                node.deps.add(prev.index)
+            if prev.barrier:
+                # all previous nodes are dependencies of barrier
+                break
+        self.nodes.append(node)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def critical_path(self, durations=None):
+        """Returns (duration, nodes) of the longest path through plan.
+
+        `durations` maps task class name to its duration, task without
+        duration takes 1.
+        """
+        durations = durations or {}
+        finish = {}
+        prev = {}
+        for node in self.nodes:
+            start = 0
+            for dep in node.deps:
+                if finish[dep] > start:
+                    start = finish[dep]
+                    prev[node.index] = dep
+            finish[node.index] = start + durations.get(
+                node.task.__class__.__name__, 1)
+        if not finish:
+            return 0, []
+        index = max(finish, key=finish.get)
+        total = finish[index]
+        path = []
+        while index is not None:
+            path.append(self.nodes[index])
+            index = prev.get(index)
+        return total, path[::-1]
+
+
+def segments(net):
+    """Yields plans of net segments.
+
+    Next segment is compiled when previous one is processed, so conditional
+    elements have already chosen the path.
+    """
+    element = scheduler_task.Element.go_start(net)
+    while element is not None:
+        plan = Plan(walk_segment(element))
+        yield plan
+        element = next_of(plan.elements[-1])
+
+
+def build_plan(net):
+    """Compiles net following current paths of conditional elements.
+
+    Elements which were already visited (loops) are not compiled again.
+    """
+    visited = set()
+    elements = []
+    element = scheduler_task.Element.go_start(net)
+    while element is not None and id(element) not in visited:
+        segment = [e for e in walk_segment(element)
+                   if id(e) not in visited]
+        visited.update(id(e) for e in segment)
+        elements.extend(segment)
+        element = next_of(segment[-1]) if segment else None
+    return Plan(elements)
+
+
+def format_keys(keys):
+    if keys is ANY:
+        return '*'
+    return ','.join(sorted(keys)) or '-'
+
+
+def dump(plan, durations=None):
+    """Returns text representation of plan and its critical path"""
+    lines = ["%4s  %-45s %-12s %-20s %-20s %s" %
+             ('#', 'Task', 'Depends on', 'Reads', 'Writes', 'Flags')]
+    for node in plan:
+        flags = []
+        if node.barrier:
+            flags.append('barrier')
+        if node.switch:
+            flags.append('switch')
+        lines.append("%4d  %-45s %-12s %-20s %-20s %s" % (
+            node.index, node, ','.join(str(d) for d in sorted(node.deps)),
+            format_keys(node.reads), format_keys(node.writes),
+            ','.join(flags)))
+    total, path = plan.critical_path(durations)
+    lines.append("")
+    length = "%.2f seconds" % total if durations else "%d steps" % total
+    lines.append("Critical path (%d of %d tasks, %s):" % (
+        len(path), len(plan), length))
+    for node in path:
+        lines.append("%4d  %s" % (node.index, node))
+    return "\n".join(lines)
+
+
+class PlanRunner(object):
+    """Runs tasks of plan respecting dependencies between them.
+
+    Barrier tasks are run in calling thread, other tasks - in up to
+    `workers` threads at once.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = max(workers, 1)
+
+    @staticmethod
+    def run_node(node, func, results):
+        try:
+            func(node.task)
+            results.put((node, None))
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.exception("%s TASK FAILED", node)
+            results.put((node, e))
+
+    def run(self, plan, func):
+        """Calls `func(task)` for every task of plan.
+
+        Returns `(task, exception)` of first failed task or `None`. No
+        new tasks are started after failure.
+        """
+        waiting = {node.index: set(node.deps) for node in plan}
+        dependants = {node.index: [] for node in plan}
+        for node in plan:
+            for dep in node.deps:
+                dependants[dep].append(node)
+        ready = [node for node in plan if not node.deps]
+        results = Queue.Queue()
+        running = 0
+        failure = None
+        while (ready and failure is None) or running:
+            while ready and failure is None and running < self.workers:
+                node = ready.pop(0)
+                if node.barrier:
+                    if running:
+                        # barrier is never ready while other tasks run,
+                        # but keep it safe
+                        ready.insert(0, node)
+                        break
+                    self.run_node(node, func, results)
+                else:
+                    thread = threading.Thread(
+                        target=self.run_node, args=(node, func, results))
+                    thread.daemon = True
+                    thread.start()
+                running += 1
+            node, error = results.get()
+            running -= 1
+            if error is not None:
+                if failure is None:
+                    failure = (node.task, error)
+                continue
+            for dependant in dependants[node.index]:
+                waiting[dependant.index].discard(node.index)
+                if not waiting[dependant.index]:
+                    ready.append(dependant)
+        return failure
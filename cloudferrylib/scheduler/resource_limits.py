@@ -0,0 +1,173 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Limits of resources used concurrently by tasks ("resource semaphores").
+
+Task declares resources it occupies with `occupied_resources` - list of
+`(resource type, key)` tuples, e.g. `(COMPUTE_HOST, 'compute-1')`. Every
+resource type has a cap - max number of tasks which occupy the same key
+at once (0 - unlimited). Scheduler holds slots of all task resources while
+task is running, task which would exceed a cap waits for a free slot.
+
+Slots are `flock`-ed files in a lock directory, so limits are shared by
+threads and by processes forked by the scheduler (parallel branches,
+`ParallelIter`).
+"""
+
+import contextlib
+import fcntl
+import os
+import shutil
+import time
+
+from cloudferrylib.utils import local_state
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+COMPUTE_HOST = 'compute_host'
+STORAGE = 'storage'
+GLANCE_API = 'glance_api'
+NOVA_API = 'nova_api'
+# whole instances processed at once by ParallelIter
+INSTANCE_HOST = 'instance_host'
+INSTANCE_STORAGE = 'instance_storage'
+
+POLL_INTERVAL = 0.5
+
+
+def api(resource_type, cloud):
+    """Returns API resource of cloud, keyed by cloud position"""
+    if cloud is None:
+        return []
+    return [(resource_type, cloud.position)]
+
+
+def instance_hosts(info):
+    """Returns source compute hosts of instances in info"""
+    if not info:
+        return []
+    return sorted(set(
+        (COMPUTE_HOST, inst['instance']['host'])
+        for inst in info.get(utils.INSTANCES_TYPE, {}).itervalues()
+        if inst.get('instance', {}).get('host')))
+
+
+def transfer_hosts(items, root_name):
+    """Returns compute hosts of data transferred by `TaskTransfer`"""
+    hosts = set()
+    for item in items.itervalues():
+        data = item.get(root_name) or {}
+        for key in (utils.HOST_SRC, utils.HOST_DST):
+            if data.get(key):
+                hosts.add((COMPUTE_HOST, data[key]))
+    return sorted(hosts)
+
+
+def migrated_instance(config, info):
+    """Returns resources occupied by instance of :info while it is migrated
+    as a whole by `ParallelIter`
+    """
+    instance = info['instance']
+    resources = [(INSTANCE_HOST, instance['host'])]
+    if instance['is_ephemeral'] or \
+            instance['boot_mode'] == utils.BOOT_FROM_IMAGE:
+        resources.append((INSTANCE_STORAGE,
+                          'compute:%s' % config.src_compute.backend))
+    if instance['volumes']:
+        resources.append((INSTANCE_STORAGE,
+                          'storage:%s' % config.src_storage.backend))
+    return resources
+
+
+def lock_name(resource_type, key, slot):
+    return '%s.%s.%d.lock' % (resource_type, local_state.file_name(key),
+                              slot)
+
+
+class Hold(object):
+    def __init__(self, files):
+        self.files = files
+
+    def release(self):
+        for lock_file in self.files:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+        self.files = []
+
+
+class ResourceLimits(object):
+    def __init__(self, caps, lock_dir=None):
+        self.caps = {k: v for k, v in caps.iteritems() if v > 0}
+        self.own_lock_dir = lock_dir is None
+        self.lock_dir = local_state.state_dir(lock_dir,
+                                              prefix='cloudferry-locks-')
+
+    def limited(self, resources):
+        """Returns limited resources without duplicates"""
+        return sorted(set(r for r in resources if r[0] in self.caps))
+
+    def try_lock(self, resource_type, key):
+        for slot in xrange(self.caps[resource_type]):
+            path = os.path.join(self.lock_dir,
+                                lock_name(resource_type, key, slot))
+            lock_file = open(path, 'a')
+            try:
+                if local_state.try_lock(lock_file):
+                    return lock_file
+            except IOError:
+                lock_file.close()
+                raise
+            lock_file.close()
+        return None
+
+    def try_acquire(self, resources):
+        """Takes slots of all resources or none of them.
+
+        Returns `Hold` or `None` if some resource has no free slots.
+        """
+        files = []
+        for resource_type, key in self.limited(resources):
+            lock_file = self.try_lock(resource_type, key)
+            if lock_file is None:
+                Hold(files).release()
+                return None
+            files.append(lock_file)
+        return Hold(files)
+
+    def acquire(self, resources, name=None):
+        """Waits until slots of all resources are taken, returns `Hold`"""
+        hold = self.try_acquire(resources)
+        if hold is None:
+            LOG.info("%s waits for resources: %s", name or "Task",
+                     ", ".join("%s %s" % r for r in self.limited(resources)))
+            start = time.time()
+            while hold is None:
+                time.sleep(POLL_INTERVAL)
+                hold = self.try_acquire(resources)
+            LOG.info("%s got resources after %.1f seconds", name or "Task",
+                     time.time() - start)
+        return hold
+
+    @contextlib.contextmanager
+    def hold(self, resources, name=None):
+        hold = self.acquire(resources, name)
+        try:
+            yield
+        finally:
+            hold.release()
+
+    def cleanup(self):
+        if self.own_lock_dir:
+            shutil.rmtree(self.lock_dir, ignore_errors=True)
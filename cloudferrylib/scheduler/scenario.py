@@ -13,32 +13,38 @@
 # limitations under the License.
 
 
-import imp
-import inspect
-import os
-import re
 import yaml
 
-import addons
-import cloudferrylib
-
-from cloudferrylib.base.action import action
+from cloudferrylib.scheduler import action_registry
 from cloudferrylib.utils import utils
 
 LOG = utils.get_log(__name__)
 
 
 class Scenario(object):
-    def __init__(self, path_tasks, path_scenario):
+    def __init__(self, path_tasks, path_scenario,
+                 actions_index=action_registry.ACTIONS_INDEX):
         self.path_tasks = path_tasks
         self.path_scenario = path_scenario
+        self.actions_index = actions_index
+
+    def load_actions(self, tasks_file):
+        """Returns classes of actions referenced by tasks file"""
+        registry = action_registry.ActionRegistry(self.actions_index)
+        for mod in tasks_file['paths']:
+            registry.add_package(mod)
+        registry.save()
+        return {name: registry.get(name)
+                for name in set(t[0] for t in tasks_file['tasks'].values())}
 
     def init_tasks(self, init={}):
+        self.init = init
+        self.tasks = self.make_tasks(init)
+
+    def make_tasks(self, init):
         with open(self.path_tasks) as tasks_file:
             tasks_file = yaml.load(tasks_file)
-            actions = {}
-            for mod in tasks_file['paths']:
-                actions.update(self.get_actions(mod))
+            actions = self.load_actions(tasks_file)
             tasks = {}
             for task in tasks_file['tasks']:
                 args = tasks_file['tasks'][task][1:]
@@ -50,7 +56,7 @@ class Scenario(object):
                 tasks[task] = actions[tasks_file['tasks'][task][0]](init,
                                                                     *args,
                                                                     **args_map)
-            self.tasks = tasks
+            return tasks
 
     def load_scenario(self, path_scenario=None):
         if path_scenario is None:
@@ -66,6 +72,9 @@ class Scenario(object):
             # "rollback" yaml chain can be added to rollback to previous state
             #                                    in case of main chain failure
             self.rollback = migrate.get("rollback")
+            # "executor" selects how parallel (&) branches are run: either
+            # "process" (default) or "thread", e.g. {type: thread, workers: 4}
+            self.executor = migrate.get("executor")
 
     def get_net(self):
         result = {}
@@ -94,34 +103,18 @@ class Scenario(object):
                 net = net >> elem
         return net
 
-    def get_actions(self, mod):
-        path_split = mod.split(".")
-        module = None
-        if path_split[0] == 'cloudferrylib':
-            module = cloudferrylib
-        elif path_split[0] == 'addons':
-            module = addons
-        for p in path_split[1:]:
-            module = module.__dict__[p]
-        path = module.__path__[0]
-        files = os.listdir(path)
-
-        # Match only *.py files
-        modules_matches = filter(lambda file_name: file_name is not None,
-                                 [re.match(".*\.py$", f) for f in files])
-        # cut off extension part (.py)
-        list_name_modules = map(lambda x: x.string.replace(".py", ""),
-                                modules_matches)
-
-        modules = [imp.load_source(name, path + '/%s.py' % name)
-                   for name in list_name_modules]
-        actions = {}
-        for module in modules:
-            for item in module.__dict__:
-                if inspect.isclass(module.__dict__[item]) and \
-                        issubclass(module.__dict__[item], action.Action):
-                    actions[item] = module.__dict__[item]
-        return actions
+    def chain_net(self, name):
+        """Returns new net of chain :name of "process" chain.
+
+        Net is built of new tasks, so it is not linked to net returned by
+        `get_net` and may be run on its own, e.g. for every instance by
+        `ParallelIter`.
+        """
+        chain = find_chain(self.migration, name)
+        if chain is None:
+            raise ValueError("Chain '%s' is not found in scenario %s" %
+                             (name, self.path_scenario))
+        return self.construct_net(chain, self.make_tasks(self.init))
 
     def init_process_migrate(self, path):
         migrate = yaml.load(open(path, 'r'))
@@ -130,6 +123,19 @@ class Scenario(object):
         return process, namespace
 
 
+def find_chain(process, name):
+    """Returns list of items of chain :name nested in :process"""
+    for item in process or []:
+        key, value = item.items()[0]
+        if isinstance(value, list) and value and isinstance(value[0], dict):
+            if key == name:
+                return value
+            chain = find_chain(value, name)
+            if chain is not None:
+                return chain
+    return None
+
+
 class ScenarioChecker():
     def __init__(self, tasks, key, scenario):
         self.tasks = tasks
@@ -13,9 +13,10 @@
 # limitations under the License.
 
 
-import multiprocessing
-
+from cloudferrylib.scheduler import executor as branch_executor
+from cloudferrylib.scheduler import plan
 from cloudferrylib.scheduler.namespace import Namespace, CHILDREN
+from cloudferrylib.utils import progress_events
 from cloudferrylib.utils import utils
 from cloudferrylib.utils.errorcodes import NO_ERROR, \
     ERROR_INVALID_CONFIGURATION, ERROR_DURING_ROLLBACK, \
@@ -34,8 +35,13 @@ STEP_ROLLBACK = "ROLLBACK"
 
 class BaseScheduler(object):
     def __init__(self, namespace=None, migration=None, preparation=None,
-                 rollback=None):
+                 rollback=None, timeline=None, checkpoint=None,
+                 plan_workers=1, limits=None):
         self.namespace = namespace if namespace else Namespace()
+        self.timeline = timeline
+        self.checkpoint = checkpoint
+        self.plan_workers = plan_workers
+        self.limits = limits
         self.status_error = NO_ERROR
         self.migration = migration
         self.preparation = preparation
@@ -47,13 +53,16 @@ class BaseScheduler(object):
 
     def event_start_task(self, task):
         LOG.info('%s Start task: %s', '-' * 8, task)
+        progress_events.task_started(task)
         return True
 
     def event_end_task(self, task):
         LOG.info('%s End task: %s', '-' * 8, task)
+        progress_events.task_finished(task)
         return True
 
     def event_error_task(self, task, e):
+        progress_events.task_failed(task, e)
         return True
 
     def error_task(self, task, e):
@@ -67,27 +76,65 @@ class BaseScheduler(object):
 
     def process_chain(self, chain, chain_name):
         if chain:
+            if (self.plan_workers > 1 and isinstance(chain, Cursor) and
+                    not self.checkpoint):
+                return self.process_plan(chain, chain_name)
             LOG.info("Processing CHAIN %s", chain_name)
+            completed = self.completed_steps(chain_name)
             for task in chain:
+                if completed:
+                    self.checkpoint.skip(task, completed.pop(0))
+                    continue
                 try:
                     self.run_task(task)
+                    self.task_completed(task, chain_name)
                 except Exception as e:
-                    if chain_name == STEP_PREPARATION:
-                        self.status_error = ERROR_INITIAL_CHECK
-                    if chain_name == STEP_MIGRATION:
-                        self.status_error = ERROR_MIGRATION_FAILED
-                    if chain_name == STEP_ROLLBACK:
-                        self.status_error = ERROR_DURING_ROLLBACK
-                    if isinstance(e, oslo.config.cfg.Error):
-                        self.status_error = ERROR_INVALID_CONFIGURATION
-                    self.exception = e
+                    self.chain_failed(chain_name, e)
                     self.error_task(task, e)
                     LOG.info("Failed processing CHAIN %s", chain_name)
                     break
             else:
                 LOG.info("Succesfully finished CHAIN %s", chain_name)
 
+    def process_plan(self, chain, chain_name):
+        """Runs independent tasks of chain concurrently, see `plan`"""
+        LOG.info("Processing CHAIN %s, up to %d tasks at once", chain_name,
+                 self.plan_workers)
+        runner = plan.PlanRunner(self.plan_workers)
+        for segment in plan.segments(chain.net):
+            failure = runner.run(segment, self.run_task)
+            if failure:
+                task, e = failure
+                self.chain_failed(chain_name, e)
+                # exception is already logged by runner
+                self.event_error_task(task, e)
+                LOG.info("Failed processing CHAIN %s", chain_name)
+                return
+        LOG.info("Succesfully finished CHAIN %s", chain_name)
+
+    def chain_failed(self, chain_name, e):
+        if chain_name == STEP_PREPARATION:
+            self.status_error = ERROR_INITIAL_CHECK
+        if chain_name == STEP_MIGRATION:
+            self.status_error = ERROR_MIGRATION_FAILED
+        if chain_name == STEP_ROLLBACK:
+            self.status_error = ERROR_DURING_ROLLBACK
+        if isinstance(e, oslo.config.cfg.Error):
+            self.status_error = ERROR_INVALID_CONFIGURATION
+        self.exception = e
+
+    def completed_steps(self, chain_name):
+        if self.checkpoint and chain_name != STEP_ROLLBACK:
+            return self.checkpoint.completed_steps(chain_name)
+        return []
+
+    def task_completed(self, task, chain_name):
+        if self.checkpoint and chain_name != STEP_ROLLBACK:
+            self.checkpoint.task_completed(chain_name, task, self.namespace)
+
     def start(self):
+        if self.checkpoint:
+            self.checkpoint.restore_namespace(self.namespace)
         # try to prepare for migration
         self.process_chain(self.preparation, STEP_PREPARATION)
         # if we didn't get error during preparation task - process migration
@@ -98,9 +145,26 @@ class BaseScheduler(object):
                 # if we had an error during process migration - rollback
                 if self.status_error != NO_ERROR:
                     self.process_chain(self.rollback, STEP_ROLLBACK)
+        # there is nothing to resume once migration is either finished or
+        # rolled back
+        if self.checkpoint and (self.status_error == NO_ERROR or
+                                self.rollback):
+            self.checkpoint.clear()
 
     def task_run(self, task):
-        task(namespace=self.namespace)
+        hold = None
+        if self.limits:
+            hold = self.limits.acquire(
+                task.occupied_resources(**self.namespace.vars), repr(task))
+        try:
+            if self.timeline:
+                with self.timeline.measure(task, self.namespace):
+                    task(namespace=self.namespace)
+            else:
+                task(namespace=self.namespace)
+        finally:
+            if hold:
+                hold.release()
 
     def addCursor(self, cursor):
         self.cursor = cursor
@@ -108,21 +172,28 @@ class BaseScheduler(object):
 
 class SchedulerThread(BaseScheduler):
     def __init__(self, namespace=None, thread_task=None, migration=None,
-                 preparation=None, rollback=None, scheduler_parent=None):
+                 preparation=None, rollback=None, scheduler_parent=None,
+                 timeline=None, checkpoint=None, executor=None,
+                 plan_workers=1, limits=None):
         super(SchedulerThread, self).__init__(namespace, migration=migration,
                                               preparation=preparation,
-                                              rollback=rollback)
+                                              rollback=rollback,
+                                              timeline=timeline,
+                                              checkpoint=checkpoint,
+                                              plan_workers=plan_workers,
+                                              limits=limits)
         self.map_func_task[WrapThreadTask()] = self.task_run_thread
         self.child_threads = dict()
         self.thread_task = thread_task
         self.scheduler_parent = scheduler_parent
+        self.executor = executor or branch_executor.ProcessExecutor()
 
     def event_start_children(self, thread_task):
-        self.child_threads[thread_task] = True
+        self.child_threads[id(thread_task)] = True
         return True
 
     def event_stop_children(self, thread_task):
-        del self.child_threads[thread_task]
+        self.child_threads.pop(id(thread_task), None)
         return True
 
     def trigger_start_scheduler(self):
@@ -136,13 +207,32 @@ class SchedulerThread(BaseScheduler):
     def start(self):
         if not self.thread_task:
             self.start_current_thread()
+            if self.timeline:
+                self.timeline.report()
         else:
             self.start_separate_thread()
 
     def start_separate_thread(self):
-        p = multiprocessing.Process(target=self.start_current_thread)
-        self.namespace.vars[CHILDREN][self.thread_task]['process'] = p
-        p.start()
+        handle = self.executor.submit(self.run_branch)
+        children = self.scheduler_parent.namespace.vars[CHILDREN]
+        children[id(self.thread_task)]['process'] = handle
+
+    def run_branch(self):
+        """Runs net of parallel branch.
+
+        Returns namespace changes made by branch, which are applied to
+        parent namespace by joining task. Branch doesn't run preparation
+        and rollback chains: failure is re-raised in joining task, so
+        rollback is done by parent scheduler.
+        """
+        self.trigger_start_scheduler()
+        try:
+            self.process_chain(self.migration, STEP_MIGRATION)
+        finally:
+            self.trigger_stop_scheduler()
+        if self.status_error != NO_ERROR:
+            raise self.exception
+        return self.namespace.changes()
 
     def start_current_thread(self):
         self.trigger_start_scheduler()
@@ -156,8 +246,14 @@ class SchedulerThread(BaseScheduler):
                                    preparation=self.preparation,
                                    migration=Cursor(thread_task.getNet()),
                                    rollback=self.rollback,
-                                   scheduler_parent=self)
-        self.namespace.vars[CHILDREN][thread_task] = {
+                                   scheduler_parent=self,
+                                   timeline=self.timeline,
+                                   executor=self.executor,
+                                   plan_workers=self.plan_workers,
+                                   limits=self.limits)
+        # WrapThreadTask instances are equal to each other, so branches are
+        # distinguished by identity
+        self.namespace.vars[CHILDREN][id(thread_task)] = {
             'namespace': namespace,
             'scheduler': scheduler,
             'process': None
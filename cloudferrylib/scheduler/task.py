@@ -85,6 +85,10 @@ class AltSyntax(ClassicSyntax):
 
 
 class BaseTask(AltSyntax, EquInstance):
+    # task may be run in a thread concurrently with other tasks which don't
+    # share namespace keys with it, see scheduler.plan. Tasks running remote
+    # commands by fabric (global `env`) are never thread safe
+    thread_safe = False
 
     def __init__(self):
         self.class_name = BaseTask.__name__
@@ -93,6 +97,13 @@ class BaseTask(AltSyntax, EquInstance):
     def run(self, **kwargs):
         pass
 
+    def occupied_resources(self, **kwargs):
+        """Returns `(resource type, key)` tuples task occupies while run
+
+        Gets the same arguments as `run`, see scheduler.resource_limits.
+        """
+        return []
+
     def __call__(self, namespace=None):
         result = self.run(**namespace.vars)
         if type(result) == dict:
@@ -0,0 +1,165 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Per-task timing and resource instrumentation for the scheduler.
+
+Every task executed by the scheduler is recorded as a single JSON line in
+the timeline file. Records are appended by each process independently, so
+tasks executed in `SchedulerThread` subprocesses end up in the same file
+as the tasks executed by the main scheduler.
+"""
+
+import contextlib
+import json
+import os
+import resource
+import time
+
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+SUMMARY_SUFFIX = '.summary'
+
+
+def get_rss():
+    """Returns current resident set size of the process in bytes"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        # no procfs, fall back to peak RSS (reported in KB on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def task_name(task):
+    return task.__class__.__name__
+
+
+def load_durations(path):
+    """Returns mean duration of task classes from summary of timeline
+
+    `None` is returned if there is no summary of timeline `path`.
+    """
+    summary_path = path + SUMMARY_SUFFIX
+    if not os.path.isfile(summary_path):
+        return None
+    with open(summary_path) as summary_file:
+        return {stat['task']: stat['cumulative'] / stat['calls']
+                for stat in json.load(summary_file) if stat['calls']}
+
+
+class TaskTimeline(object):
+    """Writes JSON lines timeline of executed tasks and builds summary.
+
+    Each record holds following keys:
+     - `task` - task class name;
+     - `repr` - task representation;
+     - `pid` - process which executed the task;
+     - `start`, `end` - wall-clock timestamps;
+     - `duration` - wall-clock time spent in task;
+     - `cpu_time` - user + system CPU time spent in task;
+     - `rss_delta` - change of resident set size in bytes;
+     - `namespace_delta` - change of number of keys in namespace;
+     - `exception` - exception representation or `None`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.summary_path = path + SUMMARY_SUFFIX
+        # new scenario run always starts with an empty timeline
+        open(self.path, 'w').close()
+
+    def write(self, record):
+        line = json.dumps(record) + '\n'
+        # single write in append mode keeps lines from different processes
+        # intact
+        with open(self.path, 'a') as timeline:
+            timeline.write(line)
+
+    @contextlib.contextmanager
+    def measure(self, task, namespace):
+        record = {
+            'task': task_name(task),
+            'repr': repr(task),
+            'pid': os.getpid(),
+            'exception': None
+        }
+        namespace_size = len(namespace.vars)
+        rss = get_rss()
+        cpu_time = get_cpu_time()
+        record['start'] = time.time()
+        try:
+            yield
+        except Exception as e:
+            record['exception'] = repr(e)
+            raise
+        finally:
+            record['end'] = time.time()
+            record['duration'] = record['end'] - record['start']
+            record['cpu_time'] = get_cpu_time() - cpu_time
+            record['rss_delta'] = get_rss() - rss
+            record['namespace_delta'] = len(namespace.vars) - namespace_size
+            self.write(record)
+
+    def read(self):
+        records = []
+        with open(self.path) as timeline:
+            for line in timeline:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+        return records
+
+    def summary(self):
+        """Aggregates timeline by task class, sorted by cumulative time"""
+        tasks = {}
+        for record in self.read():
+            stat = tasks.setdefault(record['task'], {
+                'task': record['task'],
+                'calls': 0,
+                'errors': 0,
+                'cumulative': 0.0,
+                'max': 0.0,
+                'cpu_time': 0.0,
+                'rss_delta': 0
+            })
+            stat['calls'] += 1
+            stat['cumulative'] += record['duration']
+            stat['max'] = max(stat['max'], record['duration'])
+            stat['cpu_time'] += record['cpu_time']
+            stat['rss_delta'] += record['rss_delta']
+            if record['exception'] is not None:
+                stat['errors'] += 1
+        return sorted(tasks.values(), key=lambda s: s['cumulative'],
+                      reverse=True)
+
+    def report(self):
+        summary = self.summary()
+        with open(self.summary_path, 'w') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+        LOG.info("Task timeline is stored in '%s', summary in '%s'",
+                 self.path, self.summary_path)
+        LOG.info("%-40s %6s %6s %12s %12s %12s", 'Task', 'Calls', 'Errors',
+                 'Cumulative', 'Max', 'CPU time')
+        for stat in summary:
+            LOG.info("%-40s %6d %6d %12.3f %12.3f %12.3f", stat['task'],
+                     stat['calls'], stat['errors'], stat['cumulative'],
+                     stat['max'], stat['cpu_time'])
+        return summary
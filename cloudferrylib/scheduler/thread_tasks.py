@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and#
 # limitations under the License.
 
+from cloudferrylib.scheduler.namespace import CHILDREN
 from task import Task
 from utils.equ_instance import EquInstance
 __author__ = 'mirrorcoder'
@@ -31,18 +32,29 @@ class WrapThreadTask(EquInstance):
         return self.net
 
 
+def join_thread(namespace, key):
+    """Waits for branch and applies its namespace changes.
+
+    Exception raised in branch is re-raised here.
+    """
+    child = namespace.vars[CHILDREN].pop(key, None)
+    if not child or child['process'] is None:
+        return
+    changes = child['process'].join()
+    if changes:
+        namespace.apply(*changes)
+
+
 class WaitThreadTask(Task):
     def __init__(self, tt):
         self.tt = tt
         super(WaitThreadTask, self).__init__()
 
-    def run(self, __children__={}, **kwargs):
-        if __children__:
-            __children__[self.tt]['process'].join()
+    def __call__(self, namespace=None):
+        join_thread(namespace, id(self.tt))
 
 
 class WaitThreadAllTask(Task):
-    def run(self, __children__={}, **kwargs):
-        if __children__:
-            for p in __children__:
-                __children__[p]['process'].join()
+    def __call__(self, namespace=None):
+        for key in namespace.vars[CHILDREN].keys():
+            join_thread(namespace, key)
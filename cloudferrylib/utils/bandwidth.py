@@ -0,0 +1,411 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Bandwidth budget shared by concurrent transfers.
+
+`[migrate] speed_limit` is the budget of a link: of the link between clouds,
+or of every pair of hosts with `speed_limit_per_host_pair`. Every transfer
+registers on its link, budget is split between transfers registered at the
+moment: each gets `speed_limit_min_share`, the rest is shared in proportion
+to weights of kinds of transfers (`speed_limit_weights`). So one huge
+transfer doesn't starve small ones, and transfers running at once don't
+exceed the budget.
+
+Share of transfer is enforced in two ways:
+ - data read by CloudFerry itself (glance images, `FileLikeProxy`) passes
+   `Share.consume`, a token bucket refilled at the current share;
+ - commands streaming data between hosts (ssh drivers, rsync) are limited
+   to the share at the moment they start (`throttle` filter,
+   `rsync --bwlimit`, `scp -l`) and account data with `Share.add`.
+
+Registrations are kept in `flock`-ed files of state directory, so threads
+and processes forked by scheduler (parallel branches, `ParallelIter`,
+chunk pipelines) share the same budget. Utilisation of link (data sent
+divided by budget over the time link had transfers) is logged when
+transfer finishes and reported when scheduler is stopped.
+"""
+
+import contextlib
+import itertools
+import json
+import os
+import re
+import shutil
+import time
+
+from cloudferrylib.utils.console_cmd import BC
+from cloudferrylib.utils import local_state
+from cloudferrylib.utils import sizeof_format
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+# kinds of transfers weighted by `speed_limit_weights`
+IMAGE = 'image'
+FILE = 'file'
+VOLUME = 'volume'
+
+DEFAULT_WEIGHT = 1.0
+# link of all transfers unless budget is per pair of hosts
+CLOUDS_LINK = 'src->dst'
+# token bucket holds up to this many seconds of rate
+BURST = 1.0
+# how often transfer re-reads its share, in seconds
+REFRESH_INTERVAL = 1.0
+
+UNITS = {
+    'b': 1,
+    'kb': 1024,
+    'mb': 1024 * 1024,
+    'gb': 1024 * 1024 * 1024
+}
+
+THROTTLE_SCRIPT = """import os, sys, time
+rate = float(sys.argv[1])
+start, sent = time.time(), 0
+while True:
+    data = os.read(0, 65536)
+    if not data:
+        break
+    sent += len(data)
+    while data:
+        data = data[os.write(1, data):]
+    delay = sent / rate - (time.time() - start)
+    if delay > 0:
+        time.sleep(delay)
+"""
+
+throttle_cmd = BC('python -c "%s" %s')
+
+_keys = itertools.count()
+_scheduler = None
+
+
+def parse_rate(value, option='speed_limit'):
+    """Returns rate in bytes/s of `off` or `N[b|kb|mb|gb]`, 0 is no limit"""
+    if not value or value == 'off':
+        return 0
+    array = filter(None, re.split(r'(\d+)', value))
+    try:
+        mult = UNITS[array[1].lower()]
+    except (IndexError, KeyError):
+        LOG.warning("Bad value for '%s' option of 'migrate' config "
+                    "section: '%s'. Disabling speed limit...", option, value)
+        return 0
+    return int(array[0]) * mult
+
+
+def fair_shares(rate, transfers):
+    """Splits :rate between :transfers.
+
+    :transfers: dict of transfer key to dict with `weight` and `minimum`
+
+    Every transfer gets its minimum (minimums are scaled down if they don't
+    fit into rate), the rest is shared in proportion to weights.
+
+    Returns dict of transfer key to its rate.
+    """
+    if not transfers:
+        return {}
+    minimums = sum(t['minimum'] for t in transfers.itervalues())
+    if minimums >= rate:
+        if not minimums:
+            return {key: 0 for key in transfers}
+        return {key: float(rate) * t['minimum'] / minimums
+                for key, t in transfers.iteritems()}
+    weights = sum(t['weight'] for t in transfers.itervalues())
+    rest = rate - minimums
+    shares = {}
+    for key, t in transfers.iteritems():
+        if weights > 0:
+            extra = rest * t['weight'] / weights
+        else:
+            extra = float(rest) / len(transfers)
+        shares[key] = t['minimum'] + extra
+    return shares
+
+
+def throttle(rate):
+    """Filter passing stdin to stdout at :rate bytes/s.
+
+    Like `stream_checksum.hash_tee`, it can be run inside
+    `ssh host '<command>'`.
+    """
+    return throttle_cmd(THROTTLE_SCRIPT, max(1, int(rate)))
+
+
+def rsync_bwlimit(rate):
+    """`rsync` option limiting it to :rate bytes/s, empty if unlimited"""
+    if not rate:
+        return ''
+    return ' --bwlimit={0}'.format(max(1, int(rate) // 1024))
+
+
+def scp_limit(rate):
+    """`scp -l` value (Kbit/s) of :rate bytes/s, `None` if unlimited"""
+    if not rate:
+        return None
+    return max(1, int(rate) * 8 // 1024)
+
+
+class TokenBucket(object):
+    """Lets data through at :rate bytes/s on average.
+
+    Bucket holds up to :burst seconds of rate, data taken over available
+    tokens is paid by sleeping.
+    """
+
+    def __init__(self, rate, burst=BURST, clock=time.time, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = 0.0
+        self.updated = clock()
+
+    def consume(self, nbytes):
+        """Takes :nbytes tokens, returns time slept waiting for them"""
+        now = self.clock()
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate,
+                          self.rate * self.burst)
+        self.updated = now
+        self.tokens -= nbytes
+        if self.tokens >= 0 or self.rate <= 0:
+            return 0
+        delay = -self.tokens / float(self.rate)
+        self.sleep(delay)
+        return delay
+
+
+def link_file_name(name):
+    return local_state.file_name(name) + '.json'
+
+
+class Link(object):
+    """Transfers sharing budget of :rate bytes/s, kept in file of
+    :state_dir.
+    """
+
+    def __init__(self, state_dir, name, rate):
+        self.name = name
+        self.rate = rate
+        self.path = os.path.join(state_dir, link_file_name(name))
+
+    @contextlib.contextmanager
+    def state(self):
+        """Locks and yields state of link, saves it when done"""
+        with local_state.locked_json(self.path, lambda: {
+                'name': self.name, 'rate': self.rate, 'transfers': {},
+                'bytes': 0, 'busy': 0.0, 'busy_since': None}) as state:
+            # transfers of processes killed before they finished
+            for key, transfer in state['transfers'].items():
+                if not local_state.pid_alive(transfer['pid']):
+                    del state['transfers'][key]
+            self._update_busy(state, time.time())
+            yield state
+            self._update_busy(state, time.time())
+
+    @staticmethod
+    def _update_busy(state, now):
+        if state['transfers'] and state['busy_since'] is None:
+            state['busy_since'] = now
+        elif not state['transfers'] and state['busy_since'] is not None:
+            state['busy'] += now - state['busy_since']
+            state['busy_since'] = None
+
+    def register(self, key, weight, minimum):
+        with self.state() as state:
+            state['transfers'][key] = {'weight': weight, 'minimum': minimum,
+                                       'pid': os.getpid()}
+            return fair_shares(self.rate, state['transfers'])[key]
+
+    def unregister(self, key, nbytes):
+        """Removes transfer which sent :nbytes, returns link stats"""
+        with self.state() as state:
+            state['transfers'].pop(key, None)
+            state['bytes'] += nbytes
+        return stats(state)
+
+    def shares(self):
+        with self.state() as state:
+            return fair_shares(self.rate, state['transfers'])
+
+
+def stats(state, now=None):
+    """Returns stats of link from its state"""
+    busy = state['busy']
+    if state['busy_since'] is not None:
+        busy += (now or time.time()) - state['busy_since']
+    utilisation = 0.0
+    if busy > 0 and state['rate'] > 0:
+        utilisation = state['bytes'] / (state['rate'] * busy)
+    return {'link': state['name'], 'rate': state['rate'],
+            'bytes': state['bytes'], 'busy': busy,
+            'transfers': len(state['transfers']),
+            'utilisation': utilisation}
+
+
+class Share(object):
+    """Share of link bandwidth of one transfer.
+
+    Transfer without :link is limited to fixed :rate bytes/s, unlimited if
+    :rate is 0.
+    """
+
+    def __init__(self, name, link=None, key=None, rate=0):
+        self.name = name
+        self.link = link
+        self.key = key
+        self.bytes = 0
+        self.started = time.time()
+        self.bucket = TokenBucket(rate)
+        self._rate = rate
+        self._refreshed = None
+
+    @property
+    def limited(self):
+        return self.link is not None or self._rate > 0
+
+    @property
+    def rate(self):
+        """Current share in bytes/s, 0 if unlimited"""
+        if self.link is None:
+            return self._rate
+        now = time.time()
+        if self._refreshed is None or \
+                now - self._refreshed >= REFRESH_INTERVAL:
+            self._rate = self.link.shares().get(self.key, self._rate)
+            self._refreshed = now
+        return self._rate
+
+    def consume(self, nbytes):
+        """Waits until :nbytes may be sent within share"""
+        self.bytes += nbytes
+        if self.limited:
+            self.bucket.rate = self.rate
+            self.bucket.consume(nbytes)
+
+    def add(self, nbytes):
+        """Accounts :nbytes sent by command limited to `rate`"""
+        self.bytes += nbytes
+
+
+class BandwidthScheduler(object):
+    """Splits :rate bytes/s between transfers of every link.
+
+    :per_host_pair: every pair of hosts is a link, otherwise all transfers
+                    share one link between clouds
+    :minimum: rate guaranteed to every transfer
+    :weights: dict of kind of transfer to its weight
+    """
+
+    def __init__(self, rate, per_host_pair=False, minimum=0, weights=None,
+                 state_dir=None):
+        self.rate = rate
+        self.per_host_pair = per_host_pair
+        self.minimum = minimum
+        self.weights = dict((kind, float(weight))
+                            for kind, weight in (weights or {}).iteritems())
+        self.own_state_dir = state_dir is None
+        self.state_dir = local_state.state_dir(
+            state_dir, prefix='cloudferry-bandwidth-')
+
+    def link(self, src_host, dst_host):
+        if self.per_host_pair:
+            name = '{src}->{dst}'.format(src=src_host, dst=dst_host)
+        else:
+            name = CLOUDS_LINK
+        return Link(self.state_dir, name, self.rate)
+
+    def open(self, name, src_host, dst_host, kind=None):
+        """Registers transfer on link, returns its `Share`"""
+        link = self.link(src_host, dst_host)
+        key = '{pid}.{n}'.format(pid=os.getpid(), n=next(_keys))
+        rate = link.register(key, self.weights.get(kind, DEFAULT_WEIGHT),
+                             self.minimum)
+        LOG.debug("Transfer '%s' started on link %s, share %s/s", name,
+                  link.name, sizeof_format.sizeof_fmt(rate))
+        return Share(name, link, key)
+
+    def close(self, share):
+        elapsed = time.time() - share.started
+        link_stats = share.link.unregister(share.key, share.bytes)
+        LOG.info("Transfer '%s' finished: %s in %.1f s (%s/s), link %s "
+                 "utilisation %.0f%%", share.name,
+                 sizeof_format.sizeof_fmt(share.bytes), elapsed,
+                 sizeof_format.sizeof_fmt(share.bytes / max(elapsed, 1e-6)),
+                 link_stats['link'], link_stats['utilisation'] * 100)
+
+    def report(self):
+        """Returns stats of all links, see `stats`"""
+        result = []
+        for file_name in sorted(os.listdir(self.state_dir)):
+            with open(os.path.join(self.state_dir, file_name)) as f:
+                content = f.read()
+            if content:
+                result.append(stats(json.loads(content)))
+        return result
+
+    def cleanup(self):
+        if self.own_state_dir:
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+
+
+def configure(config):
+    """Starts sharing `speed_limit` between transfers of migration.
+
+    Stops and logs utilisation of links if :config is `None`.
+    """
+    global _scheduler
+    if _scheduler is not None:
+        for link in _scheduler.report():
+            LOG.info("Link %s: %s sent, %s/s budget, utilisation %.0f%% "
+                     "over %.1f s", link['link'],
+                     sizeof_format.sizeof_fmt(link['bytes']),
+                     sizeof_format.sizeof_fmt(link['rate']),
+                     link['utilisation'] * 100, link['busy'])
+        _scheduler.cleanup()
+        _scheduler = None
+    if config is None:
+        return
+    migrate = config.migrate
+    rate = parse_rate(migrate.speed_limit)
+    if rate:
+        _scheduler = BandwidthScheduler(
+            rate,
+            per_host_pair=migrate.speed_limit_per_host_pair,
+            minimum=parse_rate(migrate.speed_limit_min_share,
+                               'speed_limit_min_share'),
+            weights=migrate.speed_limit_weights)
+
+
+@contextlib.contextmanager
+def transfer(name, src_host, dst_host, kind=None, config=None):
+    """Yields `Share` of transfer from :src_host to :dst_host.
+
+    If budget is not shared by `configure` (e.g. action is run outside of
+    migration), transfer on its own is limited to `speed_limit` of
+    :config. Share is unlimited if speed limit is off.
+    """
+    if _scheduler is None:
+        rate = 0
+        if config is not None:
+            rate = parse_rate(config.migrate.speed_limit)
+        yield Share(name, rate=rate)
+        return
+    share = _scheduler.open(name, src_host, dst_host, kind)
+    try:
+        yield share
+    finally:
+        _scheduler.close(share)
@@ -0,0 +1,232 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Bandwidth and latency between source and destination compute hosts.
+
+`CheckBandwidth` with `[initial_check] bandwidth_probe` measures pairs of
+source and destination compute hosts along the path disk files take
+(directly between computes with `direct_compute_transfer`, SSH tunnel
+through controllers otherwise):
+
+ - all pairs, or `probe_pairs` sampled pairs covering every host;
+ - `probe_streams` parallel `dd` streams send `test_file_size` MB in total,
+   latency is the time of empty SSH round trip to destination host, which
+   is also subtracted from time of streams;
+ - up to `probe_concurrency` pairs are probed at once, every host is
+   probed by one pair at a time, so probes don't skew each other.
+
+Results are merged into JSON file `bandwidth_matrix_file`, `get_matrix`
+reads it, so transfer drivers and planners can estimate durations of
+transfers and choose the fastest hosts.
+"""
+
+import itertools
+import json
+import os
+import random
+import time
+
+from cloudferrylib.scheduler import executor as scheduler_executor
+from cloudferrylib.scheduler import resource_limits
+from cloudferrylib.utils import cmd_cfg
+from cloudferrylib.utils import ssh_tunnel
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+MB = 1024 * 1024
+
+PROBE_SEND = "dd if=/dev/zero bs=1M count={count} 2>/dev/null"
+PROBE_RECEIVE = "cat > /dev/null"
+PROBE_STREAM = "( {send} | {receive} ) & "
+# prints time of SSH round trip and of streams in nanoseconds
+PROBE_SCRIPT = ("S=$(date +%s%N); {ping}; M=$(date +%s%N); "
+                "{streams}wait; E=$(date +%s%N); "
+                "echo $((M-S)) $((E-M))")
+
+SRC_HOST = 'src_host'
+DST_HOST = 'dst_host'
+
+
+def probe_script(on_src, on_dst, size, streams):
+    """Script run by :on_src and :on_dst wrappers sending :size MB in
+    :streams parallel streams
+    """
+    streams = max(streams, 1)
+    count = max(size / streams, 1)
+    stream = PROBE_STREAM.format(
+        send=on_src(PROBE_SEND.format(count=count)),
+        receive=on_dst(PROBE_RECEIVE))
+    return PROBE_SCRIPT.format(ping=on_dst('true'), streams=stream * streams)
+
+
+def parse_probe(output, size, streams):
+    """Returns `{'bandwidth': Mb/s, 'latency': ms}` from probe output"""
+    ping, elapsed = [int(v) for v in output.strip().split()[-2:]]
+    streams = max(streams, 1)
+    sent = max(size / streams, 1) * streams
+    # streams open SSH sessions as ping does
+    elapsed = max(elapsed - ping, 1) / 1e9
+    return {'bandwidth': sent * 8 / elapsed,
+            'latency': ping / 1e6}
+
+
+def sample_pairs(src_hosts, dst_hosts, count=0):
+    """Returns :count pairs of hosts, every host is in a pair if :count
+    allows, all pairs if :count is 0
+    """
+    pairs = list(itertools.product(src_hosts, dst_hosts))
+    if not count or count >= len(pairs):
+        return pairs
+    covering = []
+    for i in xrange(max(len(src_hosts), len(dst_hosts))):
+        pair = (src_hosts[i % len(src_hosts)], dst_hosts[i % len(dst_hosts)])
+        covering.append(pair)
+        pairs.remove(pair)
+    random.shuffle(pairs)
+    return (covering + pairs)[:count]
+
+
+class BandwidthMatrix(object):
+    """Measurements of pairs of hosts, `{src: {dst: measurement}}`"""
+
+    def __init__(self, path, pairs=None):
+        self.path = path
+        self.pairs = pairs or {}
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                return cls(path, json.load(f))
+        except IOError:
+            return cls(path)
+        except ValueError as e:
+            LOG.warning("Bandwidth matrix file %s is broken, ignoring it: %s",
+                        path, e)
+            return cls(path)
+
+    def save(self):
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'w') as f:
+            json.dump(self.pairs, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def add(self, src, dst, measurement):
+        self.pairs.setdefault(src, {})[dst] = measurement
+
+    def get(self, src, dst):
+        return self.pairs.get(src, {}).get(dst)
+
+    def bandwidth(self, src, dst, default=None):
+        """Bandwidth between :src and :dst in Mb/s"""
+        measurement = self.get(src, dst)
+        return measurement['bandwidth'] if measurement else default
+
+    def estimate_duration(self, src, dst, size, default_bandwidth):
+        """Seconds of transfer of :size bytes from :src to :dst,
+        :default_bandwidth (Mb/s) is used for pairs which weren't measured
+        """
+        measurement = self.get(src, dst) or {'bandwidth': default_bandwidth,
+                                             'latency': 0}
+        return (float(size) * 8 / MB / measurement['bandwidth'] +
+                measurement['latency'] / 1000.0)
+
+    def fastest(self, src, candidates):
+        """Returns host of :candidates with the highest bandwidth from
+        :src, hosts which weren't measured go last
+        """
+        return max(candidates, key=lambda dst: self.bandwidth(src, dst, 0))
+
+
+def get_matrix(config):
+    return BandwidthMatrix.load(config.initial_check.bandwidth_matrix_file)
+
+
+class Prober(object):
+    """Probes pairs of compute hosts of :src_cloud and :dst_cloud"""
+
+    def __init__(self, src_cloud, dst_cloud, config, executor=None):
+        self.src_cloud = src_cloud
+        self.dst_cloud = dst_cloud
+        self.config = config
+        self.size = config.initial_check.test_file_size
+        self.streams = config.initial_check.probe_streams
+        self.concurrency = max(config.initial_check.probe_concurrency, 1)
+        self.executor = executor or scheduler_executor.ProcessExecutor()
+
+    def probe(self, src, dst):
+        """Measures pair, runs in separate process"""
+        if self.config.migrate.direct_compute_transfer:
+            script = probe_script(
+                lambda cmd: cmd,
+                lambda cmd: cmd_cfg.ssh_cmd(dst, cmd),
+                self.size, self.streams)
+            with utils.forward_agent(self.config.migrate.key_filename):
+                output = self.src_cloud.ssh_util.execute(script,
+                                                         host_exec=src)
+        else:
+            with utils.forward_agent(self.config.migrate.key_filename), \
+                    ssh_tunnel.get_pool().tunnel(
+                        dst, self.dst_cloud.getIpSsh(),
+                        self.src_cloud.getIpSsh()) as port:
+                script = probe_script(
+                    lambda cmd: cmd_cfg.ssh_cmd(src, cmd),
+                    lambda cmd: cmd_cfg.ssh_cmd_port(port, 'localhost', cmd),
+                    self.size, self.streams)
+                output = self.src_cloud.ssh_util.execute(script)
+        measurement = parse_probe(output, self.size, self.streams)
+        measurement.update(streams=self.streams, size=self.size,
+                           measured_at=time.time())
+        return measurement
+
+    def run(self, pairs, matrix):
+        """Probes :pairs, adds measurements to :matrix, returns number of
+        pairs which failed
+        """
+        limits = resource_limits.ResourceLimits({SRC_HOST: 1, DST_HOST: 1})
+        try:
+            return scheduler_executor.run_limited(
+                pairs, self.submit,
+                lambda pair, handle: self.finish(pair, handle, matrix),
+                self.resources, limits, workers=self.concurrency)
+        finally:
+            limits.cleanup()
+
+    @staticmethod
+    def resources(pair):
+        src, dst = pair
+        return [(SRC_HOST, src), (DST_HOST, dst)]
+
+    def submit(self, pair):
+        src, dst = pair
+        LOG.info("Probing bandwidth from %s to %s", src, dst)
+        return self.executor.submit(lambda: self.probe(src, dst))
+
+    @staticmethod
+    def finish(pair, handle, matrix):
+        """Adds measurement of finished probe to :matrix, returns `True`
+        if probe failed
+        """
+        src, dst = pair
+        try:
+            measurement = handle.join()
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.warning("Unable to probe bandwidth from %s to %s: %s",
+                        src, dst, e)
+            return True
+        LOG.info("Bandwidth from %s to %s: %.2f Mb/s, latency %.1f ms",
+                 src, dst, measurement['bandwidth'], measurement['latency'])
+        matrix.add(src, dst, measurement)
+        return False
@@ -27,8 +27,15 @@ ssh_cmd = base_ssh_cmd("-oStrictHostKeyChecking=no %s '%s'")
 ssh_cmd_port = base_ssh_cmd("-oStrictHostKeyChecking=no -p %s %s '%s'")
 dd_cmd_of = BC("dd bs=%s of=%s")
 dd_cmd_if = BC("dd bs=%s if=%s")
+dd_chunk_if = BC("dd bs=%s if=%s skip=%s count=%s")
+dd_chunk_of = BC("dd bs=%s of=%s seek=%s conv=notrunc")
+dd_sparse_of = BC("dd bs=%s of=%s seek=%s conv=notrunc,sparse")
+dd_skip_cmd = BC("dd bs=%s skip=%s count=%s iflag=fullblock")
 dd_full = BC('dd if=%s of=%s bs=%s count=%s seek=%sM')
 gunzip_cmd = BC("gunzip")
 gzip_cmd = BC("gzip -%s -c %s")
+gzip_stream_cmd = BC("gzip -%s -c")
 scp_cmd = BC('scp -o StrictHostKeyChecking=no %s %s@%s:%s %s')
 rm_cmd = BC('rm -f %s')
+file_size_cmd = BC('stat -L --printf=%%s %s')
+truncate_cmd = BC('truncate -s %s %s')
@@ -0,0 +1,144 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Adaptive choice of compression of files transferred between hosts.
+
+With `[migrate] file_compression = auto` first `compression_sample_size`
+MB of file are compressed on source host with fast (1) and high
+(`level_compression`) gzip levels. Throughput of each option is estimated
+as the lowest of compressor speed and link bandwidth divided by
+compression ratio, option with the best throughput is used. Compression
+is chosen only if it is noticeably faster than sending file as is, as it
+takes CPU on both hosts.
+
+Link bandwidth is the one measured by `CheckBandwidth` (the slowest of
+clouds), or `[initial_check] claimed_bandwidth` if it was not measured.
+"""
+
+from cloudferrylib.utils.console_cmd import BC
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+AUTO = 'auto'
+FAST_LEVEL = 1
+# compression must be this much faster than sending data as is
+MIN_GAIN = 1.1
+
+SAMPLE_SCRIPT = """import os, sys, time, zlib
+fd = os.open(sys.argv[1], os.O_RDONLY)
+left = int(sys.argv[2])
+parts = []
+while left > 0:
+    data = os.read(fd, min(left, 1048576))
+    if not data:
+        break
+    parts.append(data)
+    left -= len(data)
+data = bytes(bytearray(0)).join(parts)
+for level in sys.argv[3:]:
+    start = time.time()
+    size = len(zlib.compress(data, int(level)))
+    elapsed = time.time() - start
+    sys.stdout.write(chr(32).join([level, str(len(data)), str(size),
+                                   repr(elapsed)]) + chr(10))
+"""
+
+sample_script_cmd = BC('python -c "%s" %s %s %s')
+
+# measured bandwidth of clouds in MB/s
+_bandwidth = {}
+
+
+class Sample(object):
+    """Result of compression of sample of file with gzip :level"""
+
+    def __init__(self, level, size, compressed_size, elapsed):
+        self.level = level
+        self.size = size
+        self.compressed_size = compressed_size
+        self.elapsed = elapsed
+
+    @property
+    def ratio(self):
+        return float(self.size) / max(self.compressed_size, 1)
+
+    @property
+    def speed(self):
+        """Compressor throughput in MB/s"""
+        return self.size / (1024.0 * 1024.0) / max(self.elapsed, 1e-6)
+
+    def throughput(self, bandwidth):
+        """Rate of original data sent over link of :bandwidth MB/s"""
+        return min(self.speed, bandwidth * self.ratio)
+
+
+def set_bandwidth(position, mbits):
+    """Saves bandwidth of cloud in :position measured in Mb/s"""
+    _bandwidth[position] = mbits / 8.0
+
+
+def link_bandwidth(config):
+    """Returns bandwidth in MB/s used for choice of compression"""
+    if _bandwidth:
+        return min(_bandwidth.values())
+    return config.initial_check.claimed_bandwidth / 8.0
+
+
+def sample_cmd(path, sample_size, levels):
+    return sample_script_cmd(SAMPLE_SCRIPT, path, sample_size,
+                             ' '.join(str(level) for level in levels))
+
+
+def parse_samples(output):
+    samples = []
+    for line in str(output).splitlines():
+        fields = line.split()
+        if len(fields) == 4:
+            samples.append(Sample(int(fields[0]), int(fields[1]),
+                                  int(fields[2]), float(fields[3])))
+    return samples
+
+
+def choose(samples, bandwidth):
+    """Returns gzip level (`None` for no compression) and reason of choice
+    """
+    if not samples or not samples[0].size:
+        return None, "no data to sample"
+    best = max(samples, key=lambda s: s.throughput(bandwidth))
+    options = ', '.join(
+        "gzip -{level}: ratio {ratio:.2f}, {speed:.1f} MB/s -> "
+        "{throughput:.1f} MB/s".format(level=s.level, ratio=s.ratio,
+                                       speed=s.speed,
+                                       throughput=s.throughput(bandwidth))
+        for s in samples)
+    reason = "link {bandwidth:.1f} MB/s, {options}".format(
+        bandwidth=bandwidth, options=options)
+    if best.throughput(bandwidth) < bandwidth * MIN_GAIN:
+        return None, reason
+    return best.level, reason
+
+
+def select_level(execute, path, config):
+    """Chooses gzip level for file :path, `None` means no compression.
+
+    :execute: runs command on host where file is and returns its output
+    """
+    levels = sorted({FAST_LEVEL, config.migrate.level_compression})
+    sample_size = config.migrate.compression_sample_size * 1024 * 1024
+    samples = parse_samples(execute(sample_cmd(path, sample_size, levels)))
+    level, reason = choose(samples, link_bandwidth(config))
+    LOG.info("Compression of '%s': %s (%s)", path,
+             'gzip -%d' % level if level is not None else 'none', reason)
+    return level
@@ -13,27 +13,78 @@
 # limitations under the License.
 
 
+"""Copies RBD images between Ceph clusters with `rbd export-diff` piped into
+`rbd import-diff` on destination.
+
+Image which is in use (ephemeral disk of running VM) can be pre-copied:
+`precopy` ships base snapshot of image and then diffs between successive
+snapshots while image keeps changing, until diff is small enough
+(`ceph_precopy_cutover_size`), stops shrinking or `ceph_precopy_max_rounds`
+rounds are done. After VM is stopped `transfer` ships only what was written
+since the last snapshot, so downtime depends on write rate of VM rather than
+on size of disk.
+"""
+
+import json
+import time
+
 from fabric.api import env
 from fabric.api import settings
 
 from cloudferrylib.utils import cmd_cfg
 from cloudferrylib.utils import driver_transporter
 from cloudferrylib.utils import rbd_util
+from cloudferrylib.utils import sizeof_format
 from cloudferrylib.utils import utils
 
 
 LOG = utils.get_log(__name__)
 
+PRECOPY = 'precopy'
+SNAPSHOT_PREFIX = 'cloudferry-precopy-'
+STAGING_SUFFIX = '.precopy'
+# size of created staging image, `rbd import-diff` resizes it to size of
+# source image
+STAGING_SIZE_MB = 1
+MB = 1024 * 1024
+
+
+def diff_size(output):
+    """Returns number of bytes of data in `rbd diff --format json` output"""
+    return sum(extent['length'] for extent in json.loads(output or '[]')
+               if extent.get('exists', 'true') == 'true')
+
 
 class SSHCephToCeph(driver_transporter.DriverTransporter):
-    def transfer(self, data, snapshot=None, snapshot_type=1):
+    def hosts(self, data):
         host_src = (data.get('host_src') if data.get('host_src')
                     else self.src_cloud.getIpSsh())
         host_dst = (data.get('host_dst') if data.get('host_dst')
                     else self.dst_cloud.getIpSsh())
-        with (settings(host_string=host_src,
-                       connection_attempts=env.connection_attempts),
-              utils.forward_agent(env.key_filename)):
+        return host_src, host_dst
+
+    @staticmethod
+    def retriable(data):
+        """Cutover of pre-copied image is not repeated: it removes the last
+        snapshot and destination image before staging image takes its place.
+        """
+        return not data.get(PRECOPY)
+
+    def rbd_endpoints(self, data):
+        host_src, host_dst = self.hosts(data)
+        return [(host_src, data['path_src']), (host_dst, data['path_dst'])]
+
+    def transfer(self, data, snapshot=None, snapshot_type=1):
+        """Copies image, returns number of bytes of image data copied if
+        it's known.
+        """
+        if data.get(PRECOPY) and not snapshot:
+            return self.cutover(data, data[PRECOPY])
+        host_src, host_dst = self.hosts(data)
+        size = None
+        with settings(host_string=host_src,
+                      connection_attempts=env.connection_attempts), \
+                utils.forward_agent(env.key_filename):
 
             rbd_import_diff = rbd_util.RbdUtil.rbd_import_diff_cmd
             ssh_cmd = cmd_cfg.ssh_cmd
@@ -56,8 +107,162 @@ class SSHCephToCeph(driver_transporter.DriverTransporter):
             else:
                 rbd_export_diff = rbd_util.RbdUtil.rbd_export_diff_cmd
                 process_params = [data['path_src'], '-', '-', data['path_dst']]
+                size = self.diff_size(data['path_src'])
 
             process = rbd_export_diff >> ssh_rbd_import_diff
             process = process(*process_params)
 
             self.src_cloud.ssh_util.execute(process)
+        return size
+
+    def execute_src(self, cmd, ignore_errors=False):
+        return self.src_cloud.ssh_util.execute(cmd,
+                                               ignore_errors=ignore_errors)
+
+    def execute_dst(self, host_dst, cmd, ignore_errors=False):
+        return self.src_cloud.ssh_util.execute(cmd_cfg.ssh_cmd(host_dst, cmd),
+                                               ignore_errors=ignore_errors)
+
+    def diff_size(self, path, snapshot=None, from_snapshot=None):
+        """Returns size of data changed in :path between :from_snapshot (or
+        image creation) and :snapshot (or image head).
+        """
+        if snapshot:
+            path = '%s@%s' % (path, snapshot)
+        if from_snapshot:
+            cmd = rbd_util.RbdUtil.rbd_diff_from_snap_cmd(from_snapshot, path)
+        else:
+            cmd = rbd_util.RbdUtil.rbd_diff_cmd(path)
+        return diff_size(self.execute_src(cmd))
+
+    def ship(self, path_src, host_dst, path_dst, snapshot=None,
+             from_snapshot=None):
+        """Ships changes of :path_src between :from_snapshot and :snapshot
+        (image head if not set) into :path_dst on :host_dst.
+
+        `rbd import-diff` creates :snapshot on destination image.
+        """
+        rbd = rbd_util.RbdUtil
+        if from_snapshot and snapshot:
+            export_diff = rbd.rbd_export_diff_from_snap_cmd(
+                from_snapshot, snapshot, path_src, '-')
+        elif from_snapshot:
+            export_diff = rbd.rbd_export_diff_from_cmd(from_snapshot, path_src,
+                                                       '-')
+        elif snapshot:
+            export_diff = rbd.rbd_export_diff_snap_cmd(snapshot, path_src, '-')
+        else:
+            export_diff = rbd.rbd_export_diff_cmd(path_src, '-')
+        import_diff = cmd_cfg.ssh_cmd(host_dst,
+                                      rbd.rbd_import_diff_cmd('-', path_dst))
+        self.execute_src(export_diff >> import_diff)
+
+    def remove_snapshot(self, path_src, host_dst, path_dst, snapshot):
+        self.execute_src(rbd_util.RbdUtil.rbd_snap_rm(path_src, snapshot),
+                         ignore_errors=True)
+        self.execute_dst(host_dst,
+                         rbd_util.RbdUtil.rbd_snap_rm(path_dst, snapshot),
+                         ignore_errors=True)
+
+    def remove_image(self, host_dst, path):
+        self.execute_dst(host_dst, rbd_util.RbdUtil.rbd_snap_purge(path),
+                         ignore_errors=True)
+        self.execute_dst(host_dst, rbd_util.RbdUtil.rbd_remove_cmd(path),
+                         ignore_errors=True)
+
+    def precopy(self, data, staging_path=None):
+        """Copies `path_src` image, which may be in use, to `host_dst`.
+
+        Image is copied into :staging_path if it's set (staging image is
+        created), otherwise into existing `path_dst` image. Returns state of
+        pre-copy, which is to be put into :data under `PRECOPY` key for
+        `transfer` to finish copy.
+        """
+        cfg = self.cfg.migrate
+        path_src = data['path_src']
+        _, host_dst = self.hosts(data)
+        path_dst = staging_path or data['path_dst']
+        cutover_size = cfg.ceph_precopy_cutover_size * MB
+
+        with utils.forward_agent(env.key_filename):
+            if staging_path:
+                self.remove_image(host_dst, staging_path)
+                self.execute_dst(host_dst, rbd_util.RbdUtil.rbd_create_cmd(
+                    STAGING_SIZE_MB, staging_path))
+            rounds = []
+            snapshot = None
+            try:
+                for round_num in xrange(max(cfg.ceph_precopy_max_rounds, 1)):
+                    prev_snapshot = snapshot
+                    snapshot = SNAPSHOT_PREFIX + str(round_num)
+                    self.execute_src(rbd_util.RbdUtil.rbd_snap_create(
+                        path_src, snapshot))
+                    size = self.diff_size(path_src, snapshot, prev_snapshot)
+                    start = time.time()
+                    self.ship(path_src, host_dst, path_dst, snapshot,
+                              prev_snapshot)
+                    if prev_snapshot:
+                        self.remove_snapshot(path_src, host_dst, path_dst,
+                                             prev_snapshot)
+                    rounds.append(size)
+                    LOG.info("Pre-copy of %s, round %d: %s in %.1fs",
+                             path_src, round_num + 1,
+                             sizeof_format.sizeof_fmt(size),
+                             time.time() - start)
+                    if size <= cutover_size:
+                        break
+                    if len(rounds) > 2 and size >= rounds[-2]:
+                        LOG.info("Pre-copy of %s doesn't converge, image is "
+                                 "changed faster than it's copied", path_src)
+                        break
+            except Exception:
+                if snapshot:
+                    self.remove_snapshot(path_src, host_dst, path_dst,
+                                         snapshot)
+                if staging_path:
+                    self.remove_image(host_dst, staging_path)
+                raise
+        return {'snapshot': snapshot,
+                'path': path_dst,
+                'rounds': rounds}
+
+    def cleanup(self, data, precopy):
+        """Removes snapshot of `path_src` and staging image left by
+        :precopy, which was not finished by `transfer` (migration failed in
+        between). Does nothing if they are already removed.
+        """
+        _, host_dst = self.hosts(data)
+        staging_path = precopy['path']
+        with utils.forward_agent(env.key_filename):
+            LOG.info("Removing pre-copy snapshot of %s and staging image %s",
+                     data['path_src'], staging_path)
+            self.remove_snapshot(data['path_src'], host_dst, staging_path,
+                                 precopy['snapshot'])
+            if staging_path.endswith(STAGING_SUFFIX):
+                self.remove_image(host_dst, staging_path)
+
+    def cutover(self, data, precopy):
+        """Ships changes of `path_src` since the last round of :precopy and
+        replaces `path_dst` by staging image.
+        """
+        path_src = data['path_src']
+        _, host_dst = self.hosts(data)
+        path_dst = data['path_dst']
+        staging_path = precopy['path']
+        snapshot = precopy['snapshot']
+        with utils.forward_agent(env.key_filename):
+            size = self.diff_size(path_src, from_snapshot=snapshot)
+            start = time.time()
+            self.ship(path_src, host_dst, staging_path,
+                      from_snapshot=snapshot)
+            self.remove_snapshot(path_src, host_dst, staging_path, snapshot)
+            if staging_path != path_dst:
+                self.execute_dst(host_dst,
+                                 rbd_util.RbdUtil.rbd_remove_cmd(path_dst))
+                self.execute_dst(host_dst, rbd_util.RbdUtil.rbd_rename_cmd(
+                    staging_path, path_dst))
+        LOG.info("Final copy of %s after %d pre-copy rounds: %s in %.1fs",
+                 path_src, len(precopy['rounds']),
+                 sizeof_format.sizeof_fmt(size),
+                 time.time() - start)
+        return size
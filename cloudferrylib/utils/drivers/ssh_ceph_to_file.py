@@ -15,9 +15,12 @@
 
 from fabric.api import env
 
+from cloudferrylib.utils import bandwidth
 from cloudferrylib.utils import cmd_cfg
 from cloudferrylib.utils import driver_transporter
 from cloudferrylib.utils import rbd_util
+from cloudferrylib.utils import ssh_tunnel
+from cloudferrylib.utils import stream_checksum
 from cloudferrylib.utils import utils
 
 
@@ -25,19 +28,61 @@ LOG = utils.get_log(__name__)
 
 
 class SSHCephToFile(driver_transporter.DriverTransporter):
+    """Streams RBD image into file on compute host.
+
+    Checksums of every `ssh_chunk_size` MB of image are computed on both
+    ends while image is streamed, chunks which checksums don't match are
+    resent.
+    """
+
+    def rbd_endpoints(self, data):
+        return [(self.src_cloud.getIpSsh(), data['path_src'])]
+
     def transfer(self, data):
         ssh_ip_src = self.src_cloud.getIpSsh()
         ssh_ip_dst = self.dst_cloud.getIpSsh()
-        with utils.forward_agent(env.key_filename), utils.up_ssh_tunnel(
-                data['host_dst'], ssh_ip_dst, ssh_ip_src) as port:
-            dd = cmd_cfg.dd_cmd_of
-            ssh_cmd = cmd_cfg.ssh_cmd_port
-            rbd_export = rbd_util.RbdUtil.rbd_export_cmd
+        with utils.forward_agent(env.key_filename), \
+                ssh_tunnel.get_pool().tunnel(data['host_dst'], ssh_ip_dst,
+                                             ssh_ip_src) as port, \
+                bandwidth.transfer(data['path_src'], ssh_ip_src,
+                                   data['host_dst'], bandwidth.FILE,
+                                   config=self.cfg) as share:
+            chunk_mb = self.cfg.migrate.ssh_chunk_size
+            chunk_size = chunk_mb * 1024 * 1024
+            src_manifest = stream_checksum.manifest_path(data['path_src'])
+            dst_manifest = stream_checksum.manifest_path(data['path_dst'])
+            execute = self.src_cloud.ssh_util.execute
+
+            def on_dst(cmd):
+                return cmd_cfg.ssh_cmd_port(port, 'localhost', cmd)
 
-            ssh_dd = ssh_cmd(port, 'localhost', dd)
+            def copy(chunk):
+                read = rbd_util.RbdUtil.rbd_export_cmd(data['path_src'], '-')
+                if chunk is None:
+                    write = cmd_cfg.dd_cmd_of('1M', data['path_dst'])
+                else:
+                    # rbd can't export part of image, so stream is skipped
+                    # up to chunk and only chunk is sent
+                    read = read >> cmd_cfg.dd_skip_cmd(
+                        '1M', chunk * chunk_mb, chunk_mb)
+                    write = cmd_cfg.dd_chunk_of('1M', data['path_dst'],
+                                                chunk * chunk_mb)
+                read = read >> stream_checksum.hash_tee(src_manifest,
+                                                        chunk_size)
+                if share.limited:
+                    read = read >> bandwidth.throttle(share.rate)
+                write = stream_checksum.hash_tee(dst_manifest,
+                                                 chunk_size) >> write
+                execute(read >> on_dst(write))
 
-            process = rbd_export >> ssh_dd
-            process = process(data['path_src'], '-', '1M',
-                              data['path_dst'])
+            def read_manifests():
+                return (stream_checksum.parse_manifest(execute(
+                    stream_checksum.read_manifest_cmd(src_manifest))),
+                    stream_checksum.parse_manifest(execute(on_dst(
+                        stream_checksum.read_manifest_cmd(dst_manifest)))))
 
-            self.src_cloud.ssh_util.execute(process)
+            manifest = stream_checksum.verified_stream_copy(
+                copy, read_manifests, self.cfg.migrate.retry,
+                data['path_src'])
+            share.add(len(manifest) * chunk_size)
+            return len(manifest) * chunk_size
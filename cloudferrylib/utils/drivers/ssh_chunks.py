@@ -13,17 +13,28 @@
 # limitations under the License.
 
 
+import collections
 import os
 import math
 
+from cloudferrylib.scheduler import executor
+from cloudferrylib.utils import bandwidth
+from cloudferrylib.utils import compression
 from cloudferrylib.utils import driver_transporter
 from cloudferrylib.utils import files
+from cloudferrylib.utils import progress_events
 from cloudferrylib.utils import remote_runner
+from cloudferrylib.utils import sparse_file
+from cloudferrylib.utils import stream_checksum
 from cloudferrylib.utils import utils
 
 
 LOG = utils.get_log(__name__)
 
+# chunks are compressed with default gzip level unless compression is
+# chosen adaptively
+GZIP_LEVEL = 6
+
 
 class FileCopyFailure(RuntimeError):
     pass
@@ -50,20 +61,23 @@ def remote_gzip(runner, path):
     return zipped_file_name
 
 
-def remote_scp(runner, dst_user, src_path, dst_host, dst_path):
-    scp_file_to_dest = "scp -o {opts} {file} {user}@{host}:{path}".format(
-        opts='StrictHostKeyChecking=no',
-        file=src_path,
-        user=dst_user,
-        path=dst_path,
-        host=dst_host)
+def remote_scp(runner, dst_user, src_path, dst_host, dst_path, rate=None):
+    """Copies file with scp limited to :rate bytes/s if it is set"""
+    limit = bandwidth.scp_limit(rate)
+    scp_file_to_dest = "scp -o {opts}{limit} {file} {user}@{host}:{path}"\
+        .format(opts='StrictHostKeyChecking=no',
+                limit=' -l {0}'.format(limit) if limit else '',
+                file=src_path,
+                user=dst_user,
+                path=dst_path,
+                host=dst_host)
     runner.run(scp_file_to_dest)
 
 
 def verified_file_copy(src_runner, dst_runner, dst_user, src_path, dst_path,
-                       dst_host, num_retries):
+                       dst_host, num_retries, rate=None):
     """
-    Copies :src_path to :dst_path
+    Copies :src_path to :dst_path, scp is limited to :rate bytes/s if set
 
     Retries :num_retries until MD5 matches or copy ends without errors.
     """
@@ -75,7 +89,8 @@ def verified_file_copy(src_runner, dst_runner, dst_user, src_path, dst_path,
             LOG.info("Copying file '%s' to '%s', attempt '%d'",
                      src_path, dst_host, attempt)
             src_md5 = remote_md5_sum(src_runner, src_path)
-            remote_scp(src_runner, dst_user, src_path, dst_host, dst_path)
+            remote_scp(src_runner, dst_user, src_path, dst_host, dst_path,
+                       rate=rate)
             dst_md5 = remote_md5_sum(dst_runner, dst_path)
 
             if src_md5 == dst_md5:
@@ -87,31 +102,49 @@ def verified_file_copy(src_runner, dst_runner, dst_user, src_path, dst_path,
             dst_runner.run_ignoring_errors(rm_file)
 
     if copy_failed:
-        raise FileCopyFailure("Unable to copy file '%s' to '%s' host",
-                              src_path, dst_host)
+        raise FileCopyFailure("Unable to copy file '%s' to '%s' host" %
+                              (src_path, dst_host))
+
 
+def remote_split_gzip(runner, input, output, start, block_size,
+                      level=GZIP_LEVEL):
+    """Writes chunk of :input file gzipped with :level into :output.
 
-def remote_split_file(runner, input, output, start, block_size):
-    split_file = ('dd if={input} of={output} skip={start} bs={block_size}M '
-                  'count=1').format(input=input,
-                                    output=output,
-                                    block_size=block_size,
-                                    start=start)
-    runner.run(split_file)
+    Chunk is not compressed if :level is `None`.
 
+    Returns md5 of chunk computed while chunk is read.
+    """
+    manifest = output + '.md5'
+    split = ('dd if={input} skip={start} bs={block_size}M count=1 | '
+             '{hash_tee} | {gzip} > {output} && {read}').format(
+        input=input, output=output, start=start, block_size=block_size,
+        gzip='cat' if level is None else 'gzip -{0} -c'.format(level),
+        hash_tee=stream_checksum.hash_tee(manifest,
+                                          block_size * 1024 * 1024),
+        read=stream_checksum.read_manifest_cmd(manifest))
+    return stream_checksum.parse_manifest(runner.run(split))
 
-def remote_unzip(runner, path):
-    unzip = "gzip -f -d {file}".format(file=path)
-    runner.run(unzip)
 
+def remote_unzip_join(runner, dest_file, part, start, block_size,
+                      sparse=False, compressed=True):
+    """Unzips gzipped chunk :part into :dest_file at chunk offset.
 
-def remote_join_file(runner, dest_file, part, start, block_size):
-    join = ("dd if={part} of={dest} seek={start} bs={block_size}M "
-            "count=1").format(part=part,
-                              dest=dest_file,
-                              start=start,
-                              block_size=block_size)
-    runner.run(join)
+    Zero blocks of chunk are not written if :sparse is set, chunk is
+    written as is if it is not :compressed.
+
+    Returns md5 of chunk computed while chunk is written.
+    """
+    manifest = part + '.md5'
+    # chunks may be joined in any order, so dd must not truncate dest file
+    join = ('{gunzip} {part} | {hash_tee} | dd of={dest} bs=1M '
+            'seek={offset} conv={conv} && {read}').format(
+        part=part, dest=dest_file, offset=start * block_size,
+        gunzip='gunzip -c' if compressed else 'cat',
+        conv='notrunc,sparse' if sparse else 'notrunc',
+        hash_tee=stream_checksum.hash_tee(manifest,
+                                          block_size * 1024 * 1024),
+        read=stream_checksum.read_manifest_cmd(manifest))
+    return stream_checksum.parse_manifest(runner.run(join))
 
 
 def remote_rm_file(runner, path):
@@ -119,12 +152,170 @@ def remote_rm_file(runner, path):
     runner.run(rm)
 
 
+def remote_truncate(runner, path, size):
+    truncate = "truncate -s {size} {file}".format(size=size, file=path)
+    runner.run(truncate)
+
+
+def chunks_in_flight(parallelism, temp_space, block_size, memory=0):
+    """Number of chunks processed at once.
+
+    Every chunk in flight takes up to :block_size MB of temp space on both
+    source and destination hosts (gzipped chunk) and :block_size MB of
+    memory on source host (`dd` reads chunk with one block), so
+    :temp_space MB and :memory MB limit parallelism. Zero means no limit.
+    """
+    in_flight = max(1, parallelism)
+    for budget in (temp_space, memory):
+        if budget > 0:
+            in_flight = min(in_flight, max(1, budget // block_size))
+    return in_flight
+
+
+class ChunkCopy(object):
+    """Copies one chunk of file: split and gzip on source, copy, unzip and
+    join into destination file.
+
+    Gzipped chunk is copied by `verified_file_copy`, which retries network
+    copy until md5 of gzipped chunk matches on both hosts. Md5 of chunk
+    data is computed on both hosts while chunk is split and joined, chunk
+    is processed from the beginning again if split or join failed or
+    these checksums don't match, until succeeds or :num_retries reached.
+    Network copy is limited to :rate bytes/s if it is set.
+
+    Returns md5 of chunk and size of gzipped chunk sent over network.
+    """
+
+    def __init__(self, src_runner, dst_runner, dst_user, dst_host, src_path,
+                 dst_path, src_temp_dir, dst_temp_dir, index, block_size,
+                 file_size, num_retries, sparse=False, level=GZIP_LEVEL,
+                 rate=None):
+        self.src_runner = src_runner
+        self.dst_runner = dst_runner
+        self.dst_user = dst_user
+        self.dst_host = dst_host
+        self.src_path = src_path
+        self.dst_path = dst_path
+        self.index = index
+        self.block_size = block_size
+        self.num_retries = num_retries
+        self.sparse = sparse
+        self.level = level
+        self.rate = rate
+        self.size = min(block_size, file_size - index * block_size)
+
+        part = os.path.basename(src_path) + '.part{i}'.format(i=index)
+        self.src_part = os.path.join(src_temp_dir, part)
+        self.dst_part = os.path.join(dst_temp_dir, part)
+
+    def copy(self):
+        src_gzipped = self.src_part + '.gz'
+        dst_gzipped = self.dst_part + '.gz'
+        src_digest = remote_split_gzip(self.src_runner, self.src_path,
+                                       src_gzipped, self.index,
+                                       self.block_size, level=self.level)
+        wire_size = remote_file_size(self.src_runner, src_gzipped)
+        try:
+            verified_file_copy(self.src_runner, self.dst_runner,
+                               self.dst_user, src_gzipped, dst_gzipped,
+                               self.dst_host, self.num_retries,
+                               rate=self.rate)
+        finally:
+            remote_rm_file(self.src_runner, src_gzipped)
+        dst_digest = remote_unzip_join(self.dst_runner, self.dst_path,
+                                       dst_gzipped, self.index,
+                                       self.block_size, sparse=self.sparse,
+                                       compressed=self.level is not None)
+        remote_rm_file(self.dst_runner, dst_gzipped)
+        if not src_digest or src_digest != dst_digest:
+            raise stream_checksum.ChecksumMismatch(
+                "Checksum of chunk {i} of '{path}' doesn't match".format(
+                    i=self.index, path=self.src_path))
+        return src_digest[0], wire_size
+
+    def cleanup(self):
+        for runner, path in ((self.src_runner, self.src_part),
+                             (self.dst_runner, self.dst_part)):
+            runner.run_ignoring_errors(
+                "rm -f {path}.gz {path}.gz.md5".format(path=path))
+
+    def __call__(self):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = self.copy()
+                break
+            except FileCopyFailure:
+                # network copy is already retried by verified_file_copy
+                self.cleanup()
+                raise
+            except (remote_runner.RemoteExecutionError,
+                    stream_checksum.ChecksumMismatch) as e:
+                self.cleanup()
+                if attempt > self.num_retries:
+                    raise
+                LOG.warning("Copying chunk %d of '%s' failed: %s. "
+                            "Retrying, attempt %d", self.index,
+                            self.src_path, e, attempt + 1)
+        progress_events.transferred(self.src_path,
+                                    self.size * 1024 * 1024)
+        return result
+
+
+def run_pipeline(chunks, in_flight, chunk_executor=None):
+    """Runs :chunks callables keeping up to :in_flight of them running.
+
+    Returns results of chunks in order of chunks.
+
+    Chunks started one after another overlap on different steps, e.g.
+    compression of next chunk, network copy of current one and unzip of
+    previous one run at the same time. Chunks run in separate processes
+    by default, fabric used by `RemoteRunner` is not thread-safe.
+    """
+    chunk_executor = chunk_executor or executor.ProcessExecutor()
+    running = collections.deque()
+    results = []
+    try:
+        for chunk in chunks:
+            if len(running) >= in_flight:
+                results.append(running.popleft().join())
+            running.append(chunk_executor.submit(chunk))
+        while running:
+            results.append(running.popleft().join())
+        return results
+    finally:
+        # don't leave chunks writing to files which are going to be removed
+        for handle in running:
+            try:
+                handle.join()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+
 class CopyFilesBetweenComputeHosts(driver_transporter.DriverTransporter):
     """Copies file splitting it into gzipped chunks.
 
-    If one chunk failed to copy, retries until succeeds or retry limit reached
+    Chunks are copied concurrently (`ssh_chunk_parallelism`), number of
+    chunks in flight is limited by temp space on hosts
+    (`ssh_chunk_temp_space`) and by memory of source host
+    (`ssh_chunk_memory`). Md5 of every chunk is computed while chunk
+    is split on source and joined on destination, so file is not read once
+    again to verify copy. If one chunk failed to copy or its checksums don't
+    match, retries it until succeeds or retry limit reached.
+
+    With `file_compression = auto` gzip level of chunks (or no compression)
+    is chosen by compressibility of file, see `compression`.
+
+    With `ssh_sparse_transfer` chunks which are holes of source file are
+    not sent and zero blocks are not written, so destination file is sparse.
+
+    Share of `speed_limit` of file is split between chunks in flight.
+
+    Returns list of md5 of chunks.
     """
 
+    @utils.log_step(LOG)
     def transfer(self, data):
         src_host = data['host_src']
         src_path = data['path_src']
@@ -147,43 +338,67 @@ class CopyFilesBetweenComputeHosts(driver_transporter.DriverTransporter):
                                                 password=dst_password,
                                                 sudo=True)
 
-        file_size = remote_file_size_mb(src_runner, src_path)
+        sparse = self.cfg.migrate.ssh_sparse_transfer
+        if sparse:
+            file_size_bytes, extents = sparse_file.parse_extents(
+                src_runner.run(str(sparse_file.extents_cmd(src_path))))
+        else:
+            file_size_bytes = remote_file_size(src_runner, src_path)
+        file_size = int(math.ceil(file_size_bytes / (1024.0 * 1024.0)))
+        level = GZIP_LEVEL
+        if self.cfg.migrate.file_compression == compression.AUTO:
+            level = compression.select_level(
+                lambda cmd: src_runner.run(str(cmd)), src_path, self.cfg)
+        in_flight = chunks_in_flight(self.cfg.migrate.ssh_chunk_parallelism,
+                                     self.cfg.migrate.ssh_chunk_temp_space,
+                                     block_size,
+                                     self.cfg.migrate.ssh_chunk_memory)
 
         with files.RemoteTempDir(src_runner) as src_temp_dir,\
-                files.RemoteTempDir(dst_runner) as dst_temp_dir:
-            partial_files = []
-
-            src_md5 = remote_md5_sum(src_runner, src_path)
-
+                files.RemoteTempDir(dst_runner) as dst_temp_dir,\
+                bandwidth.transfer(src_path, src_host, dst_host,
+                                   bandwidth.FILE, config=self.cfg) as share:
             num_blocks = int(math.ceil(float(file_size) / block_size))
-
-            for i in xrange(num_blocks):
-                part = os.path.basename(src_path) + '.part{i}'.format(i=i)
-                part_path = os.path.join(src_temp_dir, part)
-                remote_split_file(src_runner, src_path, part_path, i,
-                                  block_size)
-                gzipped_path = remote_gzip(src_runner, part_path)
-                gzipped_filename = os.path.basename(gzipped_path)
-                dst_gzipped_path = os.path.join(dst_temp_dir, gzipped_filename)
-
-                verified_file_copy(src_runner, dst_runner, dst_user,
-                                   gzipped_path, dst_gzipped_path, dst_host,
-                                   num_retries)
-
-                remote_unzip(dst_runner, dst_gzipped_path)
-                partial_files.append(os.path.join(dst_temp_dir, part))
-
-            for i in xrange(num_blocks):
-                remote_join_file(dst_runner, dst_path, partial_files[i], i,
-                                 block_size)
-
-            dst_md5 = remote_md5_sum(dst_runner, dst_path)
-
-            if src_md5 != dst_md5:
-                message = ("Error copying file from '{src_host}:{src_file}' "
-                           "to '{dst_host}:{dst_file}'").format(
-                    src_file=src_path, src_host=src_host, dst_file=dst_path,
-                    dst_host=dst_host)
-                LOG.error(message)
-                remote_rm_file(dst_runner, dst_path)
-                raise FileCopyFailure(message)
+            if sparse:
+                # chunks which are holes of source file are not sent
+                indexes = sparse_file.blocks_with_data(
+                    extents, block_size * 1024 * 1024)
+            else:
+                indexes = range(num_blocks)
+            LOG.debug("Copying '%s', %d of %d chunks, %d chunks at once",
+                      src_path, len(indexes), num_blocks, in_flight)
+
+            # chunks not sent must be zeros, so file is created from scratch
+            remote_truncate(dst_runner, dst_path, 0)
+            remote_truncate(dst_runner, dst_path, file_size_bytes)
+            rate = share.rate / in_flight if share.limited else None
+            chunks = [ChunkCopy(src_runner, dst_runner, dst_user, dst_host,
+                                src_path, dst_path, src_temp_dir,
+                                dst_temp_dir, i, block_size, file_size,
+                                num_retries, sparse=sparse, level=level,
+                                rate=rate)
+                      for i in indexes]
+            try:
+                results = run_pipeline(chunks, in_flight)
+            except (remote_runner.RemoteExecutionError, FileCopyFailure,
+                    stream_checksum.ChecksumMismatch):
+                LOG.error("Error copying file from '%s:%s' to '%s:%s'",
+                          src_host, src_path, dst_host, dst_path)
+                dst_runner.run_ignoring_errors(
+                    "rm -f {file}".format(file=dst_path))
+                raise
+
+            # md5 of every chunk, checked on both hosts during copy, None
+            # for chunks which are not sent
+            manifest = [None] * num_blocks
+            for chunk, (digest, _) in zip(chunks, results):
+                manifest[chunk.index] = digest
+            wire_size = sum(wire for _, wire in results)
+            share.add(wire_size)
+            LOG.info("Copied '%s' to '%s:%s': %d of %d chunks sent, %d "
+                     "bytes on the wire, destination disk usage %d bytes",
+                     src_path, dst_host, dst_path, len(chunks), num_blocks,
+                     wire_size,
+                     sparse_file.parse_disk_usage(dst_runner.run(
+                         str(sparse_file.disk_usage_cmd(dst_path)))))
+            return manifest
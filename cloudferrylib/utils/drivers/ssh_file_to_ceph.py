@@ -28,13 +28,16 @@ LOG = utils.get_log(__name__)
 
 
 class SSHFileToCeph(driver_transporter.DriverTransporter):
+    def rbd_endpoints(self, data):
+        return [(self.dst_cloud.getIpSsh(), data['path_dst'])]
+
     def transfer(self, data):
         ssh_ip_src = self.src_cloud.getIpSsh()
         ssh_ip_dst = self.dst_cloud.getIpSsh()
         action_utils.delete_file_from_rbd(ssh_ip_dst, data['path_dst'])
-        with (settings(host_string=ssh_ip_src,
-                       connection_attempts=env.connection_attempts),
-              utils.forward_agent(env.key_filename)):
+        with settings(host_string=ssh_ip_src,
+                      connection_attempts=env.connection_attempts), \
+                utils.forward_agent(env.key_filename):
             rbd_import = rbd_util.RbdUtil.rbd_import_cmd
             ssh_cmd_dst = cmd_cfg.ssh_cmd
             ssh_dst = ssh_cmd_dst(ssh_ip_dst, rbd_import)
@@ -48,3 +51,6 @@ class SSHFileToCeph(driver_transporter.DriverTransporter):
                               data['path_dst'])
 
             self.src_cloud.ssh_util.execute(process)
+            return int(self.src_cloud.ssh_util.execute(
+                cmd_cfg.file_size_cmd(data['path_src']),
+                internal_host=data['host_src']))
@@ -15,15 +15,129 @@
 
 from fabric.api import settings
 
+from cloudferrylib.utils import bandwidth
 from cloudferrylib.utils import cmd_cfg
+from cloudferrylib.utils import compression
 from cloudferrylib.utils import driver_transporter
+from cloudferrylib.utils import progress_events
+from cloudferrylib.utils import remote_runner
+from cloudferrylib.utils import sparse_file
+from cloudferrylib.utils import ssh_tunnel
+from cloudferrylib.utils import stream_checksum
 from cloudferrylib.utils import utils
 
 
 LOG = utils.get_log(__name__)
 
 
+class FileStream(object):
+    """Pipelines streaming file (or its blocks) between hosts.
+
+    Data is hashed on both ends while it is streamed, see `stream_checksum`.
+
+    :on_src: wraps command to be run on source host
+    :on_dst: wraps command to be run on destination host
+    :execute: runs command, returns its output
+    :compression_level: level of gzip, data is not compressed if `None`
+    :share: `bandwidth.Share` of transfer, every copy is limited to its
+            rate at the moment copy starts
+    """
+
+    def __init__(self, src_path, dst_path, on_src, on_dst, execute,
+                 compression_level=None, share=None):
+        self.src_path = src_path
+        self.dst_path = dst_path
+        self.on_src = on_src
+        self.on_dst = on_dst
+        self.execute = execute
+        self.compression_level = compression_level
+        self.share = share or bandwidth.Share(src_path)
+        self.src_manifest = stream_checksum.manifest_path(src_path)
+        self.dst_manifest = stream_checksum.manifest_path(dst_path)
+
+    def copy(self, block_mb, first=None, count=1, sparse=False):
+        """Streams whole file if :first is `None`, otherwise :count blocks
+        of :block_mb MB starting from block :first.
+
+        With :sparse zero blocks are not written, so it's only for
+        destination file which is empty in place of the blocks.
+        """
+        if first is None:
+            read = cmd_cfg.dd_cmd_if('1M', self.src_path)
+            write = cmd_cfg.dd_cmd_of('1M', self.dst_path)
+        else:
+            read = cmd_cfg.dd_chunk_if('1M', self.src_path,
+                                       first * block_mb, count * block_mb)
+            dd_of = cmd_cfg.dd_chunk_of
+            if sparse:
+                dd_of = cmd_cfg.dd_sparse_of
+            write = dd_of('1M', self.dst_path, first * block_mb)
+        block_size = block_mb * 1024 * 1024
+        read = read >> stream_checksum.hash_tee(self.src_manifest,
+                                                block_size)
+        if self.share.limited:
+            read = read >> bandwidth.throttle(self.share.rate)
+        write = stream_checksum.hash_tee(self.dst_manifest,
+                                         block_size) >> write
+        if self.compression_level is not None:
+            read = read >> cmd_cfg.gzip_stream_cmd(self.compression_level)
+            write = cmd_cfg.gunzip_cmd >> write
+        self.execute(self.on_src(read) >> self.on_dst(write))
+
+    def read_manifests(self):
+        """Returns source and destination manifests of last `copy`"""
+        return tuple(stream_checksum.parse_manifest(self.execute(
+            wrap(stream_checksum.read_manifest_cmd(manifest))))
+            for wrap, manifest in ((self.on_src, self.src_manifest),
+                                   (self.on_dst, self.dst_manifest)))
+
+    def file_manifests(self, block_mb):
+        """Returns manifests of source and destination files as they are"""
+        return tuple(stream_checksum.parse_manifest(self.execute(
+            wrap(stream_checksum.file_manifest(path,
+                                               block_mb * 1024 * 1024))))
+            for wrap, path in ((self.on_src, self.src_path),
+                               (self.on_dst, self.dst_path)))
+
+    def src_size(self):
+        return int(self.execute(self.on_src(
+            cmd_cfg.file_size_cmd(self.src_path))))
+
+    def truncate_dst(self, size):
+        self.execute(self.on_dst(cmd_cfg.truncate_cmd(size, self.dst_path)))
+
+    def recreate_dst(self, size):
+        """Replaces destination file with empty sparse file of :size"""
+        self.execute(self.on_dst(cmd_cfg.truncate_cmd(0, self.dst_path) &
+                                 cmd_cfg.truncate_cmd(size, self.dst_path)))
+
+    def src_extents(self):
+        """Returns size of source file and its data extents"""
+        return sparse_file.parse_extents(self.execute(self.on_src(
+            sparse_file.extents_cmd(self.src_path))))
+
+    def dst_disk_usage(self):
+        return sparse_file.parse_disk_usage(self.execute(self.on_dst(
+            sparse_file.disk_usage_cmd(self.dst_path))))
+
+
 class SSHFileToFile(driver_transporter.DriverTransporter):
+    """Streams file between compute hosts with `dd`, optionally gzipped.
+
+    With `file_compression = auto` gzip level (or no compression) is chosen
+    for every file by its compressibility, see `compression`.
+
+    Checksums of every `ssh_chunk_size` MB of file are computed on both
+    ends while file is streamed, chunks which checksums don't match are
+    resent.
+
+    With `ssh_delta_sync` only blocks of `ssh_delta_block_size` MB which
+    differ from blocks of existing destination file are sent. With
+    `ssh_sparse_transfer` only data extents of file are sent and
+    destination file is sparse.
+    """
+
+    @utils.log_step(LOG)
     def transfer(self, data):
         if self.cfg.migrate.direct_compute_transfer:
             return self.transfer_direct(data)
@@ -32,41 +146,15 @@ class SSHFileToFile(driver_transporter.DriverTransporter):
         ssh_ip_src = self.src_cloud.getIpSsh()
         ssh_ip_dst = self.dst_cloud.getIpSsh()
         with utils.forward_agent(self.cfg.migrate.key_filename), \
-                utils.up_ssh_tunnel(data['host_dst'],
-                                    ssh_ip_dst,
-                                    ssh_ip_src) as port:
-            if self.cfg.migrate.file_compression == "dd":
-                dd_dst = cmd_cfg.dd_cmd_of
-                ssh_cmd_dst = cmd_cfg.ssh_cmd_port
-                ssh_dst = ssh_cmd_dst(port, 'localhost', dd_dst)
-
-                dd_src = cmd_cfg.dd_cmd_if
-                ssh_cmd_src = cmd_cfg.ssh_cmd
-                ssh_src = ssh_cmd_src(data['host_src'], dd_src)
-
-                process = ssh_src >> ssh_dst
-                process = process('1M',
-                                  data['path_src'],
-                                  '1M',
-                                  data['path_dst'])
-
-                self.src_cloud.ssh_util.execute(process)
-
-            elif self.cfg.migrate.file_compression == "gzip":
-                dd = cmd_cfg.dd_cmd_of
-                gunzip_dd = cmd_cfg.gunzip_cmd >> dd
-                ssh_cmd_dst = cmd_cfg.ssh_cmd_port
-                ssh_dst = ssh_cmd_dst(port, 'localhost', gunzip_dd)
-
-                gzip_cmd = cmd_cfg.gzip_cmd
-                ssh_cmd_src = cmd_cfg.ssh_cmd
-                ssh_src = ssh_cmd_src(data['host_src'], gzip_cmd)
-
-                process = ssh_src >> ssh_dst
-                process = process(self.cfg.migrate.level_compression,
-                                  data['path_src'], '1M', data['path_dst'])
-
-                self.src_cloud.ssh_util.execute(process)
+                ssh_tunnel.get_pool().tunnel(data['host_dst'],
+                                             ssh_ip_dst,
+                                             ssh_ip_src) as port, \
+                self.bandwidth_share(data) as share:
+            return self.copy(self.file_stream(
+                data,
+                lambda cmd: cmd_cfg.ssh_cmd(data['host_src'], cmd),
+                lambda cmd: cmd_cfg.ssh_cmd_port(port, 'localhost', cmd),
+                self.src_cloud.ssh_util.execute, share))
 
     def transfer_direct(self, data):
         ssh_attempts = self.cfg.migrate.ssh_connection_attempts
@@ -76,36 +164,152 @@ class SSHFileToFile(driver_transporter.DriverTransporter):
                          "currently not implemented in this driver. Please use"
                          " 'CopyFilesBetweenComputeHosts' driver from "
                          "cloudferrylib/utils/drivers/.")
-        with (settings(host_string=data['host_src'],
-                       connection_attempts=ssh_attempts),
-              utils.forward_agent(self.cfg.migrate.key_filename)):
-            if self.cfg.migrate.file_compression == "dd":
-                dd_dst = cmd_cfg.dd_cmd_of
-                ssh_cmd_dst = cmd_cfg.ssh_cmd
-                ssh_dst = ssh_cmd_dst(data['host_dst'], dd_dst)
-
-                dd_src = cmd_cfg.dd_cmd_if
-
-                process = dd_src >> ssh_dst
-                process = process('1M',
-                                  data['path_src'],
-                                  '1M',
-                                  data['path_dst'])
-
-                self.src_cloud.ssh_util.execute(process,
-                                                host_exec=data['host_src'])
-
-            elif self.cfg.migrate.file_compression == "gzip":
-                dd = cmd_cfg.dd_cmd_of
-                gunzip_dd = cmd_cfg.gunzip_cmd >> dd
-                ssh_cmd_dst = cmd_cfg.ssh_cmd
-                ssh_dst = ssh_cmd_dst(data['host_dst'], gunzip_dd)
-
-                gzip_cmd = cmd_cfg.gzip_cmd
-
-                process = gzip_cmd >> ssh_dst
-                process = process(self.cfg.migrate.level_compression,
-                                  data['path_src'], '1M', data['path_dst'])
-
-                self.src_cloud.ssh_util.execute(process,
-                                                host_exec=data['host_src'])
+        with settings(host_string=data['host_src'],
+                      connection_attempts=ssh_attempts), \
+                utils.forward_agent(self.cfg.migrate.key_filename), \
+                self.bandwidth_share(data) as share:
+            return self.copy(self.file_stream(
+                data,
+                lambda cmd: cmd,
+                lambda cmd: cmd_cfg.ssh_cmd(data['host_dst'], cmd),
+                lambda cmd: self.src_cloud.ssh_util.execute(
+                    cmd, host_exec=data['host_src']), share))
+
+    def bandwidth_share(self, data):
+        return bandwidth.transfer(data['path_src'], data['host_src'],
+                                  data['host_dst'], bandwidth.FILE,
+                                  config=self.cfg)
+
+    def file_stream(self, data, on_src, on_dst, execute, share=None):
+        level = None
+        if self.cfg.migrate.file_compression == "gzip":
+            level = self.cfg.migrate.level_compression
+        elif self.cfg.migrate.file_compression == compression.AUTO:
+            level = compression.select_level(
+                lambda cmd: execute(on_src(cmd)), data['path_src'], self.cfg)
+        return FileStream(data['path_src'], data['path_dst'], on_src,
+                          on_dst, execute, compression_level=level,
+                          share=share)
+
+    def copy(self, stream):
+        if self.cfg.migrate.ssh_delta_sync:
+            return self.delta_copy(stream)
+        if self.cfg.migrate.ssh_sparse_transfer:
+            return self.sparse_copy(stream)
+        return self.verified_copy(stream)
+
+    def verified_copy(self, stream):
+        """Copies whole file verifying checksums of its chunks"""
+        chunk_mb = self.cfg.migrate.ssh_chunk_size
+
+        def copy(chunk):
+            stream.copy(chunk_mb, chunk)
+
+        manifest = stream_checksum.verified_stream_copy(
+            copy, stream.read_manifests, self.cfg.migrate.retry,
+            stream.src_path)
+        # accounted in whole chunks, size of file is not known
+        stream.share.add(len(manifest) * chunk_mb * 1024 * 1024)
+        return manifest
+
+    def delta_copy(self, stream):
+        """Copies blocks of file which differ from destination file.
+
+        Manifests of source and destination files are compared, adjacent
+        changed blocks are sent in ranges of up to `ssh_chunk_size` MB.
+        Range is resent if it failed or its checksums don't match. As only
+        changed blocks are sent, copy interrupted by broken connection is
+        resumed by running it again.
+
+        Returns counters of bytes transferred and skipped.
+        """
+        block_mb = self.cfg.migrate.ssh_delta_block_size
+        block_size = block_mb * 1024 * 1024
+        size = stream.src_size()
+
+        src_manifest, dst_manifest = stream.file_manifests(block_mb)
+        changed = [i for i in stream_checksum.mismatched_chunks(
+            src_manifest, dst_manifest) if i < len(src_manifest)]
+        max_range = max(1, self.cfg.migrate.ssh_chunk_size // block_mb)
+
+        stats = {'transferred': 0, 'skipped': size}
+        for first, count in stream_checksum.chunk_ranges(changed,
+                                                         max_range):
+            self.copy_range(stream, block_mb, first, count,
+                            src_manifest[first:first + count])
+            nbytes = min(size, (first + count) * block_size) - \
+                first * block_size
+            stats['transferred'] += nbytes
+            stats['skipped'] -= nbytes
+            stream.share.add(nbytes)
+            progress_events.transferred(stream.src_path, nbytes)
+        stream.truncate_dst(size)
+
+        LOG.info("Delta copy of '%s': %d bytes transferred, %d bytes "
+                 "skipped", stream.src_path, stats['transferred'],
+                 stats['skipped'])
+        return stats
+
+    def sparse_copy(self, stream):
+        """Copies only data extents of file into sparse destination file.
+
+        Extents are joined into ranges of MB blocks, holes shorter than
+        `ssh_sparse_min_hole` MB are sent along with data. Ranges are sent
+        in parts of up to `ssh_chunk_size` MB, verified and resent like in
+        `delta_copy`.
+
+        Returns counters of bytes transferred and skipped and disk usage of
+        destination file.
+        """
+        size, extents = stream.src_extents()
+        blocks = [block for first, count in sparse_file.data_ranges(
+            extents, size, self.cfg.migrate.ssh_sparse_min_hole * 1024 * 1024)
+            for block in xrange(first, first + count)]
+        max_range = max(1, self.cfg.migrate.ssh_chunk_size)
+
+        stream.recreate_dst(size)
+        stats = {'transferred': 0, 'skipped': size}
+        for first, count in stream_checksum.chunk_ranges(blocks, max_range):
+            self.copy_range(stream, 1, first, count, sparse=True)
+            nbytes = min(size, (first + count) * 1024 * 1024) - \
+                first * 1024 * 1024
+            stats['transferred'] += nbytes
+            stats['skipped'] -= nbytes
+            stream.share.add(nbytes)
+            progress_events.transferred(stream.src_path, nbytes)
+        stats['disk_usage'] = stream.dst_disk_usage()
+
+        LOG.info("Sparse copy of '%s': %d bytes transferred, %d bytes of "
+                 "holes skipped, destination disk usage %d bytes",
+                 stream.src_path, stats['transferred'], stats['skipped'],
+                 stats['disk_usage'])
+        return stats
+
+    def copy_range(self, stream, block_mb, first, count, expected=None,
+                   sparse=False):
+        """Copies :count blocks of :block_mb MB starting from block :first.
+
+        Zero blocks are not written with :sparse (see `FileStream.copy`).
+
+        Range is resent if copy failed or checksums of source and
+        destination blocks don't match (or don't match :expected source
+        checksums).
+        """
+        for attempt in xrange(self.cfg.migrate.retry + 1):
+            try:
+                stream.copy(block_mb, first, count, sparse)
+                src_digests, dst_digests = stream.read_manifests()
+                if src_digests and src_digests == dst_digests and \
+                        expected in (None, src_digests):
+                    return
+                LOG.warning("Checksums of blocks %d-%d of '%s' don't "
+                            "match, attempt %d", first, first + count - 1,
+                            stream.src_path, attempt + 1)
+            except remote_runner.RemoteExecutionError as e:
+                LOG.warning("Copying blocks %d-%d of '%s' failed: %s, "
+                            "attempt %d", first, first + count - 1,
+                            stream.src_path, e, attempt + 1)
+        raise stream_checksum.ChecksumMismatch(
+            "Unable to copy blocks {first}-{last} of '{path}', copy is "
+            "resumed from these blocks when run again".format(
+                first=first, last=first + count - 1, path=stream.src_path))
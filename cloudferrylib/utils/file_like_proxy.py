@@ -14,19 +14,60 @@
 
 
 import progressbar
-import re
-import time
 
+import progress_events
 from utils import get_log
 
 LOG = get_log(__name__)
 
 # Maximum Bytes Per Packet
 CHUNK_SIZE = 512 * 1024  # B
+BUFFER_SIZE = 2 * CHUNK_SIZE
+
+
+class StreamBuffer(object):
+    """Reads :source stream in blocks without copying data.
+
+    Block read from source which is not longer than requested is handed out
+    as is. Longer block (e.g. source read without size) is kept and handed
+    out by memoryview slices, instead of being sliced into new strings. If
+    source has `readinto`, it is read into bytearray of :capacity bytes
+    allocated once, and views of bytearray are handed out. View is valid
+    until next `read`.
+    """
+
+    def __init__(self, source, capacity=BUFFER_SIZE):
+        self.source = source
+        self.readinto = getattr(source, 'readinto', None)
+        self.data = None
+        if self.readinto is not None:
+            self.data = memoryview(bytearray(capacity))
+        self.pending = memoryview(b'')
+
+    def read(self, size):
+        """Returns up to :size bytes as string or memoryview, empty at the
+        end of stream.
+        """
+        if not len(self.pending):
+            if self.readinto is not None:
+                self.pending = self.data[:self.readinto(self.data)]
+            else:
+                block = self.source.read(size)
+                if len(block) <= size:
+                    return block
+                self.pending = memoryview(block)
+        view = self.pending[:size]
+        self.pending = self.pending[size:]
+        return view
 
 
 class FileLikeProxy:
-    def __init__(self, transfer_object, speed_limit='off'):
+    """Reads image data for glance, counting progress.
+
+    :share: `bandwidth.Share` of transfer, reads are limited to its rate
+    """
+
+    def __init__(self, transfer_object, share=None):
         self.resp = transfer_object['resource'].get_ref_image(
             transfer_object['id'])
         self.length = (
@@ -36,10 +77,9 @@ class FileLikeProxy:
         self.percent = self.length / 100
         self.res = 0
         self.delta = 0
-        self.buffer = ''
-        self.prev_send_time = 0
-        self.speed_limit = self._parse_speed_limit(speed_limit)
-        if self.speed_limit != 0:
+        self.buffer = StreamBuffer(self.resp)
+        self.share = share
+        if share is not None and share.limited:
             self.read = self.speed_limited_read
         msg = 'Download file {}({}): '.format(self.name, self.id)
         self.bar = progressbar.ProgressBar(
@@ -52,46 +92,23 @@ class FileLikeProxy:
             ]
         ).start()
 
-    @staticmethod
-    def _parse_speed_limit(speed_limit):
-        if speed_limit == 'off':
-            return 0
-        array = filter(None, re.split(r'(\d+)', speed_limit))
-        try:
-            mult = {
-                'b': 1,
-                'kb': 1024,
-                'mb': 1024 * 1024,
-                'gb': 1024 * 1024 * 1024
-            }[array[1].lower()]
-        except (IndexError, KeyError):
-            LOG.warning("Bad value for 'speed_limit' option of 'migrate' "
-                        "config section: '%s'. Disabling speed limit...",
-                        speed_limit)
-            return 0
-        return int(array[0]) * mult
-
     def read(self, *args, **kwargs):
         res = self.resp.read(*args, **kwargs)
         self._trigger_callback(len(res))
+        if self.share is not None:
+            self.share.add(len(res))
         return res
 
-    def speed_limited_read(self, *args, **kwargs):
-        if len(self.buffer) < CHUNK_SIZE:
-            self.buffer += self.resp.read(*args, **kwargs)
-
-        res = self.buffer[0:CHUNK_SIZE]
-        self.buffer = self.buffer[CHUNK_SIZE::]
+    def speed_limited_read(self, size=None):
+        if size is None or size < 0 or size > CHUNK_SIZE:
+            size = CHUNK_SIZE
+        res = self.buffer.read(size)
+        if isinstance(res, memoryview):
+            # glanceclient formats chunks with '%s', so it gets a string
+            res = res.tobytes()
 
         self._trigger_callback(len(res))
-
-        # avoid division by zero
-        if self.speed_limit > 0:
-            cur_send_time = time.time()
-            sleep_time = float(len(res)) / self.speed_limit
-            sleep_time -= cur_send_time - self.prev_send_time
-            time.sleep(max(0, sleep_time))
-            self.prev_send_time = cur_send_time
+        self.share.consume(len(res))
         return res
 
     def _trigger_callback(self, len_data):
@@ -99,6 +116,7 @@ class FileLikeProxy:
         self.res += len_data
         if (self.delta > self.percent or len_data == 0) and self.length > 0:
             self.bar.update(self.res * 100 / self.length)
+            progress_events.transferred(self.name, self.delta)
             self.delta = 0
         if len_data == 0:
             self.bar.finish()
@@ -0,0 +1,91 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Local state shared by threads and processes of migration.
+
+State is kept in files of a local directory (`resource_limits`,
+`bandwidth`, `ssh_tunnel`): files are named after arbitrary keys, JSON
+files are read and written under `flock`, and entries of processes which
+exited without removing them are recognized by pid.
+"""
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def file_name(key):
+    """Returns file name of :key: readable part of key and its md5, so
+    different keys don't collide once they are made readable
+    """
+    key = str(key)
+    readable = re.sub(r'[^\w.-]', '_', key)[:64]
+    return '%s.%s' % (readable, hashlib.md5(key).hexdigest()[:8])
+
+
+def state_dir(path=None, prefix='cloudferry-'):
+    """Returns :path created if it doesn't exist, new temp directory if
+    :path is not set
+    """
+    if path is None:
+        return tempfile.mkdtemp(prefix=prefix)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+@contextlib.contextmanager
+def locked_json(path, default):
+    """Locks JSON file :path and yields its content, `default()` if file
+    is empty. Content is saved unless block raised an exception.
+    """
+    with open(path, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            content = f.read()
+            state = json.loads(content) if content else default()
+            yield state
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def try_lock(f):
+    """Takes exclusive `flock` of file :f without waiting, returns `False`
+    if file is locked by someone else
+    """
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return False
+    return True
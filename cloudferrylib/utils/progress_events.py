@@ -0,0 +1,364 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Live progress events of running migration.
+
+Events are JSON objects written as single lines to append-only event file
+or sent as datagrams to UNIX socket (target `unix:<path>`). Every event
+holds `event` name, `ts` timestamp and `pid` of emitting process, so
+events of parallel branches and instances processed by `ParallelIter`
+end up in the same stream. Events are:
+ - `task_started`, `task_finished`, `task_failed` - scheduler tasks;
+ - `step_started`, `step_finished` - functions decorated by
+   `utils.log_step`, taken from `utils.stack_call_functions` listeners;
+ - `progress` - `done` of `total` resources (e.g. instances) are
+   processed, optionally with `bytes_done` of `bytes_total`;
+ - `transferred` - `bytes` of data were copied.
+
+Stream is disabled until `configure` is called, emitting is a no-op then.
+`ProgressTracker` aggregates events into tasks done, transferred bytes,
+throughput and ETA, `tail` prints it while migration runs
+(`fab tail_progress`).
+"""
+
+import collections
+import errno
+import json
+import os
+import socket
+import sys
+import time
+
+from cloudferrylib.utils import sizeof_format
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+UNIX_PREFIX = 'unix:'
+# max size of datagram read from UNIX socket
+MAX_EVENT_SIZE = 65536
+# period of time current transfer rate is measured over, in seconds
+RATE_WINDOW = 30
+
+TASK_STARTED = 'task_started'
+TASK_FINISHED = 'task_finished'
+TASK_FAILED = 'task_failed'
+STEP_STARTED = 'step_started'
+STEP_FINISHED = 'step_finished'
+PROGRESS = 'progress'
+TRANSFERRED = 'transferred'
+
+
+class EventStream(object):
+    """Writes events to file or UNIX socket, see module description"""
+
+    def __init__(self, target):
+        self.target = target
+        self.fd = None
+        self.sock = None
+        if target.startswith(UNIX_PREFIX):
+            self.socket_path = target[len(UNIX_PREFIX):]
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            self.socket_path = None
+            # single write to O_APPEND descriptor is not interleaved with
+            # writes of other processes
+            self.fd = os.open(target, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                              0o644)
+
+    def emit(self, event, **fields):
+        fields['event'] = event
+        fields['ts'] = time.time()
+        fields['pid'] = os.getpid()
+        line = json.dumps(fields, default=str)
+        if self.sock is not None:
+            try:
+                self.sock.sendto(line, self.socket_path)
+            except socket.error as e:
+                # nobody listens, events are dropped
+                if e.errno not in (errno.ENOENT, errno.ECONNREFUSED,
+                                   errno.EAGAIN):
+                    raise
+        else:
+            os.write(self.fd, line + '\n')
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class StepListener(object):
+    """Listener of `utils.stack_call_functions` which emits step events"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def emit_step(self, event, stack):
+        call = stack.stack_call_functions[-1]
+        self.stream.emit(event, step=call['func_name'], depth=stack.depth())
+
+    def func_enter(self, stack):
+        self.emit_step(STEP_STARTED, stack)
+
+    def func_exit(self, stack):
+        self.emit_step(STEP_FINISHED, stack)
+
+
+_stream = None
+
+
+def configure(target):
+    """Starts emitting events to `target`, stops if target is empty"""
+    global _stream
+    if _stream is not None:
+        utils.stack_call_functions.listeners = [
+            listener for listener in utils.stack_call_functions.listeners
+            if not (isinstance(listener, StepListener) and
+                    listener.stream is _stream)]
+        _stream.close()
+        _stream = None
+    if target:
+        _stream = EventStream(target)
+        utils.stack_call_functions.addListener(StepListener(_stream))
+
+
+def enabled():
+    return _stream is not None
+
+
+def emit(event, **fields):
+    if _stream is None:
+        return
+    try:
+        _stream.emit(event, **fields)
+    except (IOError, OSError, socket.error) as e:
+        # progress reporting must never break migration
+        LOG.debug("Unable to emit progress event %s: %s", event, e)
+
+
+def task_started(task):
+    emit(TASK_STARTED, task=repr(task))
+
+
+def task_finished(task):
+    emit(TASK_FINISHED, task=repr(task))
+
+
+def task_failed(task, error):
+    emit(TASK_FAILED, task=repr(task), error=repr(error))
+
+
+def progress(resource, done, total, bytes_done=None, bytes_total=None,
+             failed=0):
+    fields = {'resource': resource, 'done': done, 'total': total,
+              'failed': failed}
+    if bytes_total is not None:
+        fields['bytes_done'] = bytes_done
+        fields['bytes_total'] = bytes_total
+    emit(PROGRESS, **fields)
+
+
+def transferred(name, nbytes):
+    if nbytes:
+        emit(TRANSFERRED, name=name, bytes=nbytes)
+
+
+class ProgressTracker(object):
+    """Aggregates events into overall migration progress"""
+
+    def __init__(self, rate_window=RATE_WINDOW):
+        self.rate_window = rate_window
+        self.first_ts = None
+        self.last_ts = None
+        self.tasks_started = 0
+        self.tasks_finished = 0
+        self.tasks_failed = 0
+        self.running = collections.OrderedDict()
+        self.resources = collections.OrderedDict()
+        self.bytes = 0
+        # (timestamp, bytes) of transfers in rate window
+        self.recent = collections.deque()
+
+    def update(self, event):
+        ts = event.get('ts', self.last_ts or time.time())
+        if self.first_ts is None:
+            self.first_ts = ts
+        if self.last_ts is None or ts > self.last_ts:
+            self.last_ts = ts
+        name = event.get('event')
+        key = (event.get('pid'), event.get('task'))
+        if name == TASK_STARTED:
+            self.tasks_started += 1
+            self.running[key] = event['task']
+        elif name in (TASK_FINISHED, TASK_FAILED):
+            self.running.pop(key, None)
+            if name == TASK_FINISHED:
+                self.tasks_finished += 1
+            else:
+                self.tasks_failed += 1
+        elif name == PROGRESS:
+            state = self.resources.setdefault(event['resource'],
+                                              {'start': ts})
+            state.update((k, v) for k, v in event.iteritems()
+                         if k not in ('event', 'pid', 'resource'))
+        elif name == TRANSFERRED:
+            self.bytes += event['bytes']
+            self.recent.append((ts, event['bytes']))
+        while self.recent and self.recent[0][0] < self.last_ts - \
+                self.rate_window:
+            self.recent.popleft()
+
+    def elapsed(self):
+        if self.first_ts is None:
+            return 0
+        return self.last_ts - self.first_ts
+
+    def throughput(self):
+        """Returns average transfer rate since start in bytes per second"""
+        elapsed = self.elapsed()
+        return self.bytes / elapsed if elapsed else 0
+
+    def current_rate(self):
+        """Returns transfer rate over the last `rate_window` seconds"""
+        if not self.recent:
+            return 0
+        period = min(self.rate_window, self.elapsed())
+        return sum(b for _, b in self.recent) / period if period else 0
+
+    @staticmethod
+    def eta(state, now):
+        """Returns seconds left to process resource or None if unknown"""
+        elapsed = now - state['start']
+        if state.get('bytes_total') and state.get('bytes_done'):
+            done, total = state['bytes_done'], state['bytes_total']
+        else:
+            done, total = state['done'], state['total']
+        if not done or not elapsed:
+            return None
+        return max(total - done, 0) * elapsed / float(done)
+
+    def summary(self):
+        lines = ["Elapsed %s, tasks finished %d, failed %d, running %d" % (
+            format_duration(self.elapsed()), self.tasks_finished,
+            self.tasks_failed, len(self.running))]
+        for task in self.running.itervalues():
+            lines.append("  running: %s" % task)
+        for resource, state in self.resources.iteritems():
+            line = "  %s: %d of %d done" % (resource, state['done'],
+                                            state['total'])
+            if state.get('failed'):
+                line += ", %d failed" % state['failed']
+            if state.get('bytes_total'):
+                line += " (%s of %s)" % (
+                    sizeof_format.sizeof_fmt(state['bytes_done']),
+                    sizeof_format.sizeof_fmt(state['bytes_total']))
+            eta = self.eta(state, self.last_ts)
+            if state['done'] < state['total'] and eta is not None:
+                line += ", ETA %s" % format_duration(eta)
+            lines.append(line)
+        lines.append("Transferred %s, throughput %s/s, current rate %s/s" % (
+            sizeof_format.sizeof_fmt(self.bytes),
+            sizeof_format.sizeof_fmt(self.throughput()),
+            sizeof_format.sizeof_fmt(self.current_rate())))
+        return "\n".join(lines)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds / 3600, seconds / 60 % 60, seconds % 60)
+
+
+def parse(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        LOG.debug("Skipping malformed progress event: %r", line)
+        return None
+
+
+def read_file(path, follow=False, interval=1):
+    """Yields events of event file, `None` every `interval` while waiting.
+
+    Waits for new events and for the file to appear if `follow` is set.
+    """
+    while not os.path.exists(path):
+        if not follow:
+            return
+        yield None
+        time.sleep(interval)
+    with open(path) as events_file:
+        partial = ''
+        while True:
+            line = events_file.readline()
+            if line.endswith('\n'):
+                event = parse(partial + line)
+                partial = ''
+                if event is not None:
+                    yield event
+            elif not follow:
+                return
+            else:
+                # line is being written right now
+                partial += line
+                yield None
+                time.sleep(interval)
+
+
+def read_socket(path, interval=1):
+    """Yields events received on UNIX socket, `None` every `interval`"""
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    sock.settimeout(interval)
+    try:
+        while True:
+            try:
+                event = parse(sock.recv(MAX_EVENT_SIZE))
+            except socket.timeout:
+                event = None
+            yield event
+    finally:
+        sock.close()
+        os.unlink(path)
+
+
+def tail(target, follow=True, interval=2, out=None):
+    """Prints progress of migration emitting events to `target`.
+
+    Summary is printed every `interval` seconds while following events and
+    once at the end. Listening to UNIX socket always follows events.
+    """
+    out = out or sys.stdout
+    tracker = ProgressTracker()
+    if target.startswith(UNIX_PREFIX):
+        events = read_socket(target[len(UNIX_PREFIX):], interval)
+    else:
+        events = read_file(target, follow, interval)
+    printed = time.time()
+    try:
+        for event in events:
+            if event is not None:
+                tracker.update(event)
+            if follow and time.time() - printed >= interval:
+                out.write(tracker.summary() + "\n\n")
+                out.flush()
+                printed = time.time()
+    except KeyboardInterrupt:
+        pass
+    out.write(tracker.summary() + "\n")
+    return tracker
@@ -13,14 +13,101 @@
 # limitations under the License.
 
 import json
+import os
+import re
 
 from cloudferrylib.utils import cmd_cfg
-from cloudferrylib.utils import remote_runner
+from cloudferrylib.utils import remote_batch
 from cloudferrylib.utils import ssh_util
 from cloudferrylib.utils import utils
 
 LOG = utils.get_log(__name__)
 
+NBD_HOST = '127.0.0.1'
+# qemu-nbd is checked that many times, every NBD_WAIT_INTERVAL seconds, to
+# be listening before client connects
+NBD_WAIT_ATTEMPTS = 60
+NBD_WAIT_INTERVAL = 0.5
+NBD_SERVE_CMD = "qemu-nbd -r {options}-b {nbd_host} -p {port} {path}"
+NBD_CONVERT_CMD = ("qemu-img convert {options}-f raw -O {fmt} "
+                   "nbd:{nbd_host}:{port} {path}")
+SSH_FORWARD_CMD = ("ssh -oStrictHostKeyChecking=no "
+                   "-oExitOnForwardFailure=yes {options} "
+                   "{forward} {port}:{nbd_host}:{port} {host} '{cmd}'")
+NBD_LISTENING_CMD = "ss -ltn sport = :{port} | grep -q LISTEN"
+NBD_REMOTE_LISTENING_CMD = "ssh -oStrictHostKeyChecking=no {host} '{cmd}'"
+# polling stops early if serving process exits
+NBD_WAIT_CMD = ("for i in $(seq {attempts}); do {listening} && break; "
+                "kill -0 $NBD 2>/dev/null || break; sleep {interval}; done; "
+                "{listening} || {{ echo \"qemu-nbd is not listening on port "
+                "{port}\" >&2; false; }}")
+NBD_STREAM_CMD = ("{serve} & NBD=$!; {wait} && {convert}; RC=$?; "
+                  "kill $NBD 2>/dev/null; wait $NBD; exit $RC")
+
+# prints `<mtime>:<size> <now>` of image and runs `qemu-img info` unless
+# mtime and size are the same as of cached info, JSON output is tried first,
+# cause it's more reliable, old qemu-img without JSON support falls back to
+# human-readable output
+INFO_CMD = ('S=$(stat -L -c %Y:%s {path} 2>/dev/null); '
+            'echo "$S $(date +%s)"; '
+            '[ -n "$S" ] && [ "$S" = "{key}" ] || '
+            'qemu-img info --output=json {path} 2>/dev/null || '
+            'qemu-img info {path}')
+INFO_STAT_RE = re.compile(r'^(?:(\d+):(\d+) )?(\d+)$')
+# files modified less than that many seconds before they were stat'ed may
+# be modified again without change of mtime, their info is not cached
+INFO_RACY_INTERVAL = 1
+MAX_BACKING_CHAIN = 16
+
+
+def nbd_serve_cmd(path, port, fmt=None):
+    """`qemu-nbd` serving image :path of :fmt format (detected if not set)
+    as raw disk on :port of loopback interface, it exits when client
+    disconnects.
+    """
+    return NBD_SERVE_CMD.format(path=path, port=port, nbd_host=NBD_HOST,
+                                options='-f %s ' % fmt if fmt else '')
+
+
+def nbd_convert_cmd(fmt, path, port, create=True):
+    """`qemu-img convert` of disk served on :port into :path of :fmt.
+
+    Without :create existing :path image is written.
+    """
+    return NBD_CONVERT_CMD.format(fmt=fmt, path=path, port=port,
+                                  options='' if create else '-n ',
+                                  nbd_host=NBD_HOST)
+
+
+def ssh_forward_cmd(host, cmd, port, remote=True, options=''):
+    """Runs :cmd on :host via SSH forwarding NBD :port to :host (`remote`)
+    or from :host.
+    """
+    return SSH_FORWARD_CMD.format(host=host, cmd=cmd, port=port,
+                                  forward='-R' if remote else '-L',
+                                  options=options, nbd_host=NBD_HOST)
+
+
+def nbd_wait_cmd(port, host=None, attempts=NBD_WAIT_ATTEMPTS,
+                 interval=NBD_WAIT_INTERVAL):
+    """Waits until qemu-nbd started as `$NBD` process listens on :port of
+    :host (local host if not set), fails if it doesn't after :attempts.
+    """
+    listening = NBD_LISTENING_CMD.format(port=port)
+    if host is not None:
+        listening = NBD_REMOTE_LISTENING_CMD.format(host=host, cmd=listening)
+    return NBD_WAIT_CMD.format(listening=listening, port=port,
+                               attempts=attempts, interval=interval)
+
+
+def nbd_stream_cmd(serve, convert, port, host=None):
+    """Runs :serve (`nbd_serve_cmd`) in background and :convert once it
+    listens on :port of :host (see `nbd_wait_cmd`), so image is converted
+    while it's read, without temp file.
+    """
+    return NBD_STREAM_CMD.format(serve=serve, convert=convert,
+                                 wait=nbd_wait_cmd(port, host))
+
 
 class QemuImgInfoParser(object):
     """Parses `qemu-img info` command human-readable output.
@@ -47,6 +134,138 @@ class QemuImgInfoParser(object):
                     file_end = len(l)
                 return l[l.find(':')+1:file_end].strip()
 
+    def virtual_size(self):
+        """Returns virtual size of image in bytes"""
+        match = re.search(r'virtual size:.*\((\d+) bytes\)',
+                          self.img_info_output)
+        if match:
+            return int(match.group(1))
+
+    def format(self):
+        match = re.search(r'file format:\s*(\S+)', self.img_info_output)
+        if match:
+            return match.group(1)
+
+
+class ImageInfo(object):
+    """Format, virtual size and backing file of image"""
+
+    def __init__(self, fmt=None, virtual_size=None, backing_file=None):
+        self.format = fmt
+        self.virtual_size = virtual_size
+        self.backing_file = backing_file
+
+    @classmethod
+    def parse(cls, output):
+        """Returns `ImageInfo` from JSON or human-readable `qemu-img info`
+        output, `None` if output can't be parsed.
+        """
+        if output.lstrip().startswith('{'):
+            try:
+                info = json.loads(output)
+            except ValueError as e:
+                LOG.warning("Unable to parse qemu-img info output '%s': %s",
+                            output, e)
+                return None
+            return cls(info.get('format'), info.get('virtual-size'),
+                       info.get('backing-filename'))
+        parser = QemuImgInfoParser(output)
+        if parser.format() is None:
+            return None
+        return cls(parser.format(), parser.virtual_size(),
+                   parser.backing_file())
+
+    def __repr__(self):
+        return '<ImageInfo %s, %s bytes, backing file %s>' % (
+            self.format, self.virtual_size, self.backing_file)
+
+
+class ImageInfoCache(object):
+    """Per-host cache of `qemu-img info` of images.
+
+    Info is kept for `(host, path)` along with mtime and size of image file
+    and is used while they don't change, `stat` of image and `qemu-img info`
+    of changed image are run by the same remote command, so lookup costs one
+    remote call for any number of images of host. Images which are not
+    files (e.g. `rbd:pool/image`) are not cached. Methods changing images
+    (`QemuImg.convert`, `diff_commit`, `diff_rebase`) invalidate their info.
+    """
+
+    def __init__(self):
+        self.images = {}
+
+    def command(self, host, path):
+        cached = self.images.get((host, path))
+        return INFO_CMD.format(path=path, key=cached[0] if cached else '-')
+
+    def update(self, host, path, output):
+        """Returns info of :path from output of `command`, caches it"""
+        output = output if isinstance(output, basestring) else ''
+        lines = output.split('\n', 1)
+        match = INFO_STAT_RE.match(lines[0].strip())
+        key = None
+        if match:
+            output = lines[1] if len(lines) > 1 else ''
+            if match.group(1) is not None:
+                key = '%s:%s' % (match.group(1), match.group(2))
+        cached = self.images.pop((host, path), None)
+        if not output.strip():
+            if cached is not None and key == cached[0]:
+                self.images[(host, path)] = cached
+                return cached[1]
+            return None
+        info = ImageInfo.parse(output)
+        if (info is not None and key is not None and
+                int(match.group(3)) - int(match.group(1)) >
+                INFO_RACY_INTERVAL):
+            self.images[(host, path)] = (key, info)
+        return info
+
+    def lookup(self, execute, host, paths):
+        """Returns `{path: ImageInfo}` of :paths of :host, info of image
+        which can't be read is `None`.
+
+        :execute: runs shell command on :host and returns its output
+        """
+        paths = list(paths)
+        commands = [self.command(host, path) for path in paths]
+        if len(commands) == 1:
+            outputs = [execute(commands[0])]
+        else:
+            outputs = remote_batch.run(execute, commands)
+        return {path: self.update(host, path, output)
+                for path, output in zip(paths, outputs)}
+
+    def backing_chain(self, execute, host, path):
+        """Returns list of `(path, ImageInfo)` of image and its backing
+        files
+        """
+        chain = []
+        while path is not None and len(chain) < MAX_BACKING_CHAIN:
+            info = self.lookup(execute, host, [path])[path]
+            if info is None:
+                break
+            chain.append((path, info))
+            path = info.backing_file
+        return chain
+
+    def invalidate(self, host, *paths):
+        """Drops info of :paths and their backing files"""
+        for path in paths:
+            cached = self.images.pop((host, path), None)
+            if cached is not None and cached[1].backing_file:
+                self.images.pop((host, cached[1].backing_file), None)
+
+    def clear(self):
+        self.images.clear()
+
+
+_cache = ImageInfoCache()
+
+
+def get_cache():
+    return _cache
+
 
 class QemuImg(ssh_util.SshUtil):
     commit_cmd = cmd_cfg.qemu_img_cmd("commit %s")
@@ -56,8 +275,38 @@ class QemuImg(ssh_util.SshUtil):
     rebase_cmd = cmd_cfg.qemu_img_cmd("rebase -u -b %s %s")
     convert_cmd = convert_cmd("-O %s %s %s")
 
+    def _info_execute(self, host_compute=None, host_exec=None):
+        def execute(cmd):
+            cmd = str(cmd)
+            if host_compute:
+                # command is passed to compute host in single quotes
+                cmd = cmd.replace("'", "'\\''")
+            return self.execute(cmd, host_compute, host_exec,
+                                ignore_errors=True)
+        return execute
+
+    def images_info(self, paths, host_compute=None, host_exec=None):
+        """Returns `{path: ImageInfo}` of images :paths on :host_compute
+        (reached through controller) or :host_exec, fetched in one call.
+        """
+        host = host_compute or host_exec or self.host
+        return get_cache().lookup(
+            self._info_execute(host_compute, host_exec), host, paths)
+
+    def image_info(self, path, host_compute=None, host_exec=None):
+        return self.images_info([path], host_compute, host_exec)[path]
+
+    def backing_chain(self, path, host_compute=None, host_exec=None):
+        host = host_compute or host_exec or self.host
+        return get_cache().backing_chain(
+            self._info_execute(host_compute, host_exec), host, path)
+
+    def invalidate(self, host_compute, *paths):
+        get_cache().invalidate(host_compute or self.host, *paths)
+
     def diff_commit(self, dest_path, filename="disk", host_compute=None):
         cmd = self.commit_cd_cmd(dest_path, filename)
+        self.invalidate(host_compute, os.path.join(dest_path, filename))
         return self.execute(cmd, host_compute)
 
     def convert_image(self,
@@ -75,37 +324,30 @@ class QemuImg(ssh_util.SshUtil):
         cmd2 = cmd_cfg.move_cmd(path_to_image,
                                 baseimage_tmp,
                                 baseimage)
+        self.invalidate(host_compute, os.path.join(path_to_image, baseimage))
         return \
             self.execute(cmd1, host_compute), self.execute(cmd2, host_compute)
 
     def detect_backing_file(self, dest_disk_ephemeral, host_instance):
-        try:
-            # try to use JSON first, cause it's more reliable
-            cmd = "qemu-img info --output=json {ephemeral}".format(
-                ephemeral=dest_disk_ephemeral)
-            qemu_img_json = self.execute(cmd=cmd,
-                                         host_exec=host_instance,
-                                         ignore_errors=False)
-            try:
-                return json.loads(qemu_img_json)['backing-filename']
-            except (TypeError, ValueError, KeyError) as e:
-                LOG.warning("Unable to read qemu image file for '%s', "
-                            "error: '%s'", dest_disk_ephemeral, e)
-        except remote_runner.RemoteExecutionError:
-            # old qemu version not supporting JSON, fallback to human-readable
-            # qemu-img output parser
-            cmd = "qemu-img info {ephemeral}".format(
-                ephemeral=dest_disk_ephemeral)
-            qemu_img_output = self.execute(cmd=cmd,
-                                           host_exec=host_instance,
-                                           ignore_errors=True)
-            return QemuImgInfoParser(qemu_img_output).backing_file()
+        info = self.image_info(dest_disk_ephemeral, host_exec=host_instance)
+        if info is None:
+            LOG.warning("Unable to read qemu image file for '%s'",
+                        dest_disk_ephemeral)
+            return None
+        return info.backing_file
+
+    def virtual_size(self, path, host_compute=None):
+        info = self.image_info(path, host_compute)
+        if info is not None:
+            return info.virtual_size
 
     def diff_rebase(self, baseimage, disk, host_compute=None):
         cmd = self.rebase_cmd(baseimage, disk)
+        self.invalidate(host_compute, disk)
         return self.execute(cmd, host_compute)
 
     # example source_path = rbd:compute/QWEQWE-QWE231-QWEWQ
     def convert(self, format_to, source_path, dest_path, host_compute=None):
         cmd = self.convert_cmd(format_to, source_path, dest_path)
+        self.invalidate(host_compute, dest_path)
         return self.execute(cmd, host_compute)
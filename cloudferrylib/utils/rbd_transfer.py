@@ -0,0 +1,162 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Concurrent transfer of RBD images.
+
+Single `rbd export | rbd import` stream uses only part of Ceph cluster
+bandwidth, `RbdTransferEngine` runs transfers of several images by RBD
+driver (`SSHCephToCeph`, `SSHCephToFile`, `SSHFileToCeph`) at once:
+
+ - up to `rbd_parallelism` images are copied at once, every image is
+   copied in separate process (fabric is not thread-safe);
+ - up to `rbd_pool_streams` streams read or write the same pool and up to
+   `rbd_host_streams` streams run `rbd` on the same Ceph host, image is
+   started only when slots of all its pools and hosts are free, so images
+   of busy pool don't block images of other pools;
+ - image which failed to copy is retried up to `retry` times (unless
+   driver's `retriable(data)` says copy can't be repeated), no new images
+   are started after image failed for good, error is re-raised when running
+   images are done;
+ - bytes copied (as returned by driver), images copied and retried are
+   counted and logged when transfer is done.
+"""
+
+import time
+
+from cloudferrylib.scheduler import executor as scheduler_executor
+from cloudferrylib.scheduler import resource_limits
+from cloudferrylib.utils import progress_events
+from cloudferrylib.utils import sizeof_format
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+RBD_POOL = 'rbd_pool'
+CEPH_HOST = 'ceph_host'
+DEFAULT_POOL = 'rbd'
+
+
+def pool_of(path):
+    """Returns pool of RBD image :path (`pool/image`)"""
+    return path.split('/', 1)[0] if '/' in path else DEFAULT_POOL
+
+
+class TransferStats(object):
+    def __init__(self):
+        self.images = 0
+        self.retries = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.time()
+
+    def add(self, result):
+        self.images += 1
+        self.retries += result['attempts'] - 1
+        self.bytes += result['bytes'] or 0
+
+    def metrics(self):
+        elapsed = time.time() - self.started
+        return {'images': self.images,
+                'retries': self.retries,
+                'failed': self.failed,
+                'bytes': self.bytes,
+                'elapsed': elapsed,
+                'rate': self.bytes / elapsed if elapsed > 0 else 0}
+
+
+class RbdTransferEngine(object):
+    """Transfers :driver items concurrently.
+
+    :driver must have `rbd_endpoints(data)` method, which returns
+    `(host, path)` of every RBD image the item is read from or written to,
+    and may have `retriable(data)` method, which returns `False` if failed
+    transfer of the item must not be repeated.
+    """
+
+    def __init__(self, driver, cfg, limits=None, executor=None):
+        self.driver = driver
+        self.parallelism = max(cfg.migrate.rbd_parallelism, 1)
+        self.retries = cfg.migrate.retry
+        self.own_limits = limits is None
+        self.limits = limits or resource_limits.ResourceLimits({
+            RBD_POOL: cfg.migrate.rbd_pool_streams,
+            CEPH_HOST: cfg.migrate.rbd_host_streams})
+        self.executor = executor or scheduler_executor.ProcessExecutor()
+        self.stats = TransferStats()
+        self.errors = []
+
+    def resources(self, data):
+        resources = []
+        for host, path in self.driver.rbd_endpoints(data):
+            resources.append((RBD_POOL, '%s/%s' % (host, pool_of(path))))
+            resources.append((CEPH_HOST, host))
+        return resources
+
+    def retriable(self, data):
+        retriable = getattr(self.driver, 'retriable', None)
+        return retriable is None or retriable(data)
+
+    def copy(self, data):
+        """Copies one item retrying it, runs in separate process"""
+        retries = self.retries if self.retriable(data) else 0
+        for attempt in xrange(1, retries + 2):
+            try:
+                return {'bytes': self.driver.transfer(data),
+                        'attempts': attempt}
+            except Exception as e:  # pylint: disable=broad-except
+                if attempt > retries:
+                    raise
+                LOG.warning("Copy of %s failed (attempt %d of %d), "
+                            "retrying: %s", data['path_src'], attempt,
+                            retries + 1, e)
+
+    def submit(self, data):
+        LOG.debug("Copying %s to %s", data['path_src'], data['path_dst'])
+        return self.executor.submit(lambda: self.copy(data))
+
+    def finish(self, data, handle):
+        """Joins finished item, returns `True` if it failed"""
+        try:
+            result = handle.join()
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.error("Unable to copy %s to %s: %s", data['path_src'],
+                      data['path_dst'], e)
+            self.stats.failed += 1
+            self.errors.append(e)
+            return True
+        self.stats.add(result)
+        progress_events.transferred(data['path_src'], result['bytes'])
+        return False
+
+    def run(self, items):
+        """Transfers :items (data of driver), raises first error"""
+        try:
+            scheduler_executor.run_limited(
+                items, self.submit, self.finish, self.resources, self.limits,
+                workers=self.parallelism, stop_on_failure=True)
+        finally:
+            self.report()
+            if self.own_limits:
+                self.limits.cleanup()
+        if self.errors:
+            raise self.errors[0]
+        return self.stats.metrics()
+
+    def report(self):
+        metrics = self.stats.metrics()
+        LOG.info("RBD transfer: %d images, %s in %.1fs (%s/s), %d retries, "
+                 "%d failed", metrics['images'],
+                 sizeof_format.sizeof_fmt(metrics['bytes']),
+                 metrics['elapsed'], sizeof_format.sizeof_fmt(metrics['rate']),
+                 metrics['retries'], metrics['failed'])
@@ -30,6 +30,14 @@ class RbdUtil(ssh_util.SshUtil):
         cmd_cfg.rbd_cmd("export-diff --from-snap %s %s %s")
     rbd_info_cmd = cmd_cfg.rbd_cmd("-p %s info %s --format %s")
     rbd_snap_rm = cmd_cfg.rbd_cmd("snap rm %s@%s")
+    rbd_snap_create = cmd_cfg.rbd_cmd("snap create %s@%s")
+    rbd_snap_purge = cmd_cfg.rbd_cmd("snap purge %s")
+    rbd_diff_cmd = cmd_cfg.rbd_cmd("diff --format json %s")
+    rbd_diff_from_snap_cmd = \
+        cmd_cfg.rbd_cmd("diff --format json --from-snap %s %s")
+    rbd_create_cmd = cmd_cfg.rbd_cmd("create --image-format 2 --size %s %s")
+    rbd_remove_cmd = cmd_cfg.rbd_cmd("rm %s")
+    rbd_rename_cmd = cmd_cfg.rbd_cmd("mv %s %s")
 
     # exmaple pool=compute filename = %s_disk.local % instance_id
     def rm(self, pool, filename, int_host=None):
@@ -0,0 +1,121 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Running many shell commands on a host in a single remote invocation.
+
+Commands are wrapped into one script: every command is run in its own
+subshell with stdin closed, its stdout and stderr are captured to temporary
+files and printed base64-encoded after a header line with a random marker,
+command index and exit status. The script output is parsed back into
+`CommandResult` per command, so output of one command can't be mistaken
+for output of another one.
+
+Module doesn't run anything itself: `execute` function passed to `run`
+executes script on remote host (e.g. `RemoteRunner.run` or fabric `sudo`)
+and returns its output.
+"""
+
+import base64
+import binascii
+import pipes
+import uuid
+
+# max number of commands in one script, keeps script below command line
+# length limits and allows to get results of long batches in portions
+BATCH_SIZE = 100
+
+SCRIPT_HEADER = ('__cf_out=$(mktemp) && __cf_err=$(mktemp) || exit 1\n'
+                 'trap \'rm -f "$__cf_out" "$__cf_err"\' EXIT')
+COMMAND_TEMPLATE = ('( eval {cmd} ) >"$__cf_out" 2>"$__cf_err" </dev/null; '
+                    'echo "{marker} {index} $?"; '
+                    'base64 -w0 "$__cf_out"; echo; '
+                    'base64 -w0 "$__cf_err"; echo')
+
+
+class CommandResult(str):
+    """Stdout of command with `stderr`, `return_code` and status flags.
+
+    Behaves like result of fabric `run`. `return_code` is `None` if result
+    of command was not received.
+    """
+
+    def __new__(cls, command, stdout='', stderr='', return_code=None):
+        result = super(CommandResult, cls).__new__(cls, stdout)
+        result.command = command
+        result.stdout = stdout
+        result.stderr = stderr
+        result.return_code = return_code
+        return result
+
+    @property
+    def succeeded(self):
+        return self.return_code == 0
+
+    @property
+    def failed(self):
+        return not self.succeeded
+
+    def __repr__(self):
+        return '<CommandResult %r: %s>' % (self.command, self.return_code)
+
+
+def make_script(commands, marker):
+    lines = [SCRIPT_HEADER]
+    for index, cmd in enumerate(commands):
+        lines.append(COMMAND_TEMPLATE.format(cmd=pipes.quote(cmd),
+                                             marker=marker, index=index))
+    return '\n'.join(lines)
+
+
+def decode(data):
+    try:
+        return base64.b64decode(data.strip()).rstrip('\n')
+    except (TypeError, binascii.Error):
+        return ''
+
+
+def parse(output, commands, marker):
+    """Returns list of `CommandResult` of commands from script output"""
+    results = {}
+    lines = [line.rstrip('\r') for line in output.splitlines()]
+    for i, line in enumerate(lines):
+        fields = line.split()
+        if len(fields) != 3 or fields[0] != marker:
+            continue
+        index, status = int(fields[1]), int(fields[2])
+        stdout = decode(lines[i + 1]) if i + 1 < len(lines) else ''
+        stderr = decode(lines[i + 2]) if i + 2 < len(lines) else ''
+        results[index] = CommandResult(commands[index], stdout, stderr,
+                                       status)
+    return [results[i] if i in results else
+            CommandResult(cmd, stderr="No result of command received")
+            for i, cmd in enumerate(commands)]
+
+
+def chunks(items, size):
+    for start in xrange(0, len(items), size):
+        yield items[start:start + size]
+
+
+def run(execute, commands, batch_size=BATCH_SIZE):
+    """Yields `CommandResult` of every command in order of commands.
+
+    Commands are executed by `execute(script)` in portions of `batch_size`,
+    results of a portion are yielded before the next portion is executed.
+    """
+    for portion in chunks(list(commands), batch_size):
+        marker = 'CFBATCH-%s' % uuid.uuid4().hex
+        output = execute(make_script(portion, marker))
+        for result in parse(output, portion, marker):
+            yield result
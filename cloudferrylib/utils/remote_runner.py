@@ -12,12 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+
+from fabric.api import env
+from fabric.api import hide
 from fabric.api import sudo as fab_sudo
 from fabric.api import run
 from fabric.api import settings
 
 import cfglib
 from cloudferrylib.utils.utils import forward_agent
+from cloudferrylib.utils import remote_batch
+from cloudferrylib.utils import ssh_pool
 from cloudferrylib.utils import utils
 
 LOG = utils.get_log(__name__)
@@ -49,6 +55,8 @@ class RemoteRunner(object):
 
         ssh_attempts = cfglib.CONF.migrate.ssh_connection_attempts
 
+        idle_timeout = cfglib.CONF.migrate.ssh_pool_idle_timeout
+
         with settings(warn_only=self.ignore_errors,
                       host_string=self.host,
                       user=self.user,
@@ -58,12 +66,19 @@ class RemoteRunner(object):
                       combine_stderr=False,
                       connection_attempts=ssh_attempts):
             with forward_agent(self.key):
-                LOG.debug("running '%s' on '%s' host as user '%s'",
-                          cmd, self.host, self.user)
-                if self.sudo and self.user != 'root':
-                    return fab_sudo(cmd)
-                else:
-                    return run(cmd)
+                if not idle_timeout:
+                    return self._run(cmd)
+                pool = ssh_pool.get_pool(idle_timeout)
+                with pool.connection(self.host, self.user, env.gateway):
+                    return self._run(cmd)
+
+    def _run(self, cmd):
+        LOG.debug("running '%s' on '%s' host as user '%s'",
+                  cmd, self.host, self.user)
+        if self.sudo and self.user != 'root':
+            return fab_sudo(cmd)
+        else:
+            return run(cmd)
 
     def run_ignoring_errors(self, cmd, **kwargs):
         ignore_errors_original = self.ignore_errors
@@ -85,3 +100,46 @@ class RemoteRunner(object):
             except RemoteExecutionError as e:
                 if attempts >= cfglib.CONF.migrate.ssh_connection_attempts:
                     raise e
+
+    def _run_script(self, script, attempts=1):
+        attempt = 0
+        while True:
+            try:
+                attempt += 1
+                with hide('stdout'):
+                    return self.run(script)
+            except RemoteExecutionError:
+                if attempt >= attempts:
+                    raise
+
+    def iter_batch(self, commands, repeat_on_errors=False):
+        """Runs commands in a single remote invocation, yields results.
+
+        Yields `remote_batch.CommandResult` (stdout, `stderr`,
+        `return_code`) of every command in order of commands. Failed
+        command raises `RemoteExecutionError` unless errors are ignored.
+        With `repeat_on_errors` failed command and failed invocation are
+        retried up to `ssh_connection_attempts` times first, as
+        `run_repeat_on_errors` does.
+        """
+        attempts = 1
+        if repeat_on_errors:
+            attempts = cfglib.CONF.migrate.ssh_connection_attempts
+        execute = functools.partial(self._run_script, attempts=attempts)
+        for result in remote_batch.run(execute, commands):
+            attempt = 1
+            while result.failed and not self.ignore_errors:
+                if attempt >= attempts:
+                    raise RemoteExecutionError(
+                        "Command '%s' failed on '%s' host with exit code "
+                        "%s: %s" % (result.command, self.host,
+                                    result.return_code, result.stderr))
+                attempt += 1
+                LOG.debug("Retrying '%s' on '%s' host, attempt %d",
+                          result.command, self.host, attempt)
+                result = next(remote_batch.run(execute, [result.command]))
+            yield result
+
+    def run_batch(self, commands, repeat_on_errors=False):
+        """Returns list of results of commands, see `iter_batch`"""
+        return list(self.iter_batch(commands, repeat_on_errors))
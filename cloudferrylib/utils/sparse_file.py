@@ -0,0 +1,113 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Allocated extents of sparse files.
+
+`extents_cmd` prints size of file and its data extents (`offset length`
+per line). Extents are found with `lseek` SEEK_DATA/SEEK_HOLE, if file
+system doesn't support them, file is read and extents of blocks which are
+not all zeros are printed. Like `stream_checksum` filter, script has no
+quotes and no `%`, so it can be run inside `ssh host '<command>'`.
+
+Extents are joined into ranges aligned to MB, small holes between extents
+are sent as is: destination `dd conv=sparse` doesn't write zero blocks, so
+file is sparse on destination anyway.
+"""
+
+from cloudferrylib.utils.console_cmd import BC
+
+EXTENTS_SCRIPT = """import errno, os, sys
+fd = os.open(sys.argv[1], os.O_RDONLY)
+block = int(sys.argv[2])
+size = os.fstat(fd).st_size
+extents = []
+try:
+    offset = 0
+    while offset < size:
+        start = os.lseek(fd, offset, 3)
+        offset = os.lseek(fd, start, 4)
+        extents.append((start, offset - start))
+except OSError as e:
+    if e.errno != errno.ENXIO:
+        extents = None
+if extents is None:
+    extents = []
+    zero = bytes(bytearray(block))
+    os.lseek(fd, 0, 0)
+    offset = 0
+    while True:
+        data = os.read(fd, block)
+        if not data:
+            break
+        if data != zero[:len(data)]:
+            if extents and sum(extents[-1]) == offset:
+                extents[-1] = (extents[-1][0], extents[-1][1] + len(data))
+            else:
+                extents.append((offset, len(data)))
+        offset += len(data)
+lines = [str(size)] + [str(s) + chr(32) + str(n) for s, n in extents]
+sys.stdout.write(chr(10).join(lines) + chr(10))
+"""
+
+MB = 1024 * 1024
+
+extents_script_cmd = BC('python -c "%s" %s %s')
+disk_usage_cmd = BC('du --block-size=1 %s')
+
+
+def extents_cmd(path, block_size=MB):
+    """Command printing size and data extents of file :path.
+
+    :block_size: size of blocks checked for zeros if file system doesn't
+                 support SEEK_DATA
+    """
+    return extents_script_cmd(EXTENTS_SCRIPT, path, block_size)
+
+
+def parse_extents(output):
+    """Returns file size and list of `(offset, length)` of its extents"""
+    lines = [line.split() for line in str(output).splitlines()
+             if line.strip()]
+    size = int(lines[0][0])
+    return size, [(int(start), int(length)) for start, length in lines[1:]]
+
+
+def data_ranges(extents, size, min_hole):
+    """Joins extents into `(first, count)` ranges of MB blocks.
+
+    Extents separated by less than :min_hole bytes are joined.
+    """
+    ranges = []
+    for start, length in extents:
+        first = start // MB
+        last = (min(start + length, size) + MB - 1) // MB
+        if ranges and first * MB - sum(ranges[-1]) * MB < min_hole:
+            ranges[-1][1] = max(sum(ranges[-1]), last) - ranges[-1][0]
+        else:
+            ranges.append([first, last - first])
+    return [tuple(r) for r in ranges if r[1] > 0]
+
+
+def blocks_with_data(extents, block_size):
+    """Returns sorted indexes of :block_size blocks having data extents"""
+    blocks = set()
+    for start, length in extents:
+        if length > 0:
+            blocks.update(xrange(start // block_size,
+                                 (start + length - 1) // block_size + 1))
+    return sorted(blocks)
+
+
+def parse_disk_usage(output):
+    return int(str(output).split()[0])
@@ -0,0 +1,193 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Pool of persistent SSH connections used by `RemoteRunner`.
+
+Connections are authenticated SSH clients keyed by (host, user, gateway).
+Every command is run in its own channel of pooled connection, so commands
+of concurrent threads are multiplexed over the same session. Connection is
+handed to fabric by putting it into `fabric.state.connections` for the
+duration of the command, so `run` and `sudo` behave exactly as before
+(pty, sudo password prompts, agent forwarding).
+
+Connections unused for `idle_timeout` seconds are closed. Processes forked
+by scheduler do not reuse connections of parent process: SSH transport
+can't be shared between processes, so child process opens its own ones.
+"""
+
+import contextlib
+import os
+import threading
+import time
+
+from fabric import network
+from fabric import state
+from fabric.api import settings
+
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+IDLE_TIMEOUT = 300
+
+
+def fabric_key(host, user):
+    """Key of connection to :host in `fabric.state.connections`"""
+    return network.normalize_to_string('%s@%s' % (user, host))
+
+
+class PooledConnection(object):
+    def __init__(self, client, gateways):
+        self.client = client
+        # gateway clients connection is tunneled through
+        self.gateways = gateways
+        self.last_used = time.time()
+        self.users = 0
+
+    def is_active(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        self.client.close()
+        for gateway in self.gateways.itervalues():
+            gateway.close()
+
+    def forget(self, host, user):
+        """Removes client from fabric cache, so fabric `run` doesn't get
+        closed client. Fabric keeps one client per `user@host:port`, client
+        of other connection to host (e.g. through other gateway) is kept.
+        """
+        key = fabric_key(host, user)
+        if dict.get(state.connections, key) is self.client:
+            state.connections.pop(key)
+
+
+class SshConnectionPool(object):
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets connections without closing them (used after fork)"""
+        self.pid = os.getpid()
+        self.connections = {}
+        self.handshakes = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def metrics(self):
+        """Returns counters of pool, `reused` is number of saved handshakes"""
+        with self.lock:
+            return {'handshakes': self.handshakes,
+                    'reused': self.reused,
+                    'evicted': self.evicted,
+                    'open': len(self.connections)}
+
+    def check_fork(self):
+        if self.pid != os.getpid():
+            for (host, user, _), conn in self.connections.iteritems():
+                conn.forget(host, user)
+            self.reset()
+
+    def evict_idle(self, now=None):
+        """Closes connections which are not used for `idle_timeout`"""
+        now = now or time.time()
+        with self.lock:
+            self.check_fork()
+            idle = [key for key, conn in self.connections.iteritems()
+                    if not conn.users and
+                    (now - conn.last_used > self.idle_timeout or
+                     not conn.is_active())]
+            idle_conns = [self.connections.pop(key) for key in idle]
+            self.evicted += len(idle_conns)
+        for key, conn in zip(idle, idle_conns):
+            LOG.debug("Closing idle SSH connection to %s@%s", key[1],
+                      key[0])
+            conn.forget(key[0], key[1])
+            conn.close()
+
+    @staticmethod
+    def connect(host, user, gateway):
+        """Opens new connection, must be called within fabric settings"""
+        gateways = {}
+        user, host, port = network.normalize('%s@%s' % (user, host))
+        client = network.connect(user, host, port, cache=gateways,
+                                 seek_gateway=bool(gateway))
+        return PooledConnection(client, gateways)
+
+    def acquire(self, host, user, gateway=None):
+        """Returns pooled connection to host, opens it if needed.
+
+        Connection is opened using fabric `env` (password, key files,
+        `connection_attempts`), so it must be called within fabric
+        settings.
+        """
+        self.evict_idle()
+        key = (host, user, gateway)
+        with self.lock:
+            conn = self.connections.get(key)
+            if conn is not None:
+                conn.users += 1
+                self.reused += 1
+                return conn
+        conn = self.connect(host, user, gateway)
+        conn.users += 1
+        with self.lock:
+            existing = self.connections.get(key)
+            self.handshakes += 1
+            if existing is None:
+                self.connections[key] = conn
+                return conn
+            # other thread has connected meanwhile
+            existing.users += 1
+        conn.close()
+        return existing
+
+    def release(self, conn):
+        with self.lock:
+            conn.users -= 1
+            conn.last_used = time.time()
+
+    @contextlib.contextmanager
+    def connection(self, host, user, gateway=None):
+        """Makes fabric `run` and `sudo` use pooled connection to host"""
+        conn = self.acquire(host, user, gateway)
+        try:
+            with settings(host_string=host, user=user):
+                state.connections[fabric_key(host, user)] = conn.client
+                yield conn.client
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        with self.lock:
+            self.check_fork()
+            conns = self.connections
+            self.connections = {}
+        for (host, user, _), conn in conns.iteritems():
+            conn.forget(host, user)
+            conn.close()
+
+
+_pool = None
+
+
+def get_pool(idle_timeout=IDLE_TIMEOUT):
+    global _pool
+    if _pool is None:
+        _pool = SshConnectionPool(idle_timeout)
+    _pool.idle_timeout = idle_timeout
+    return _pool
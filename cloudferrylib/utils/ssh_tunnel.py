@@ -0,0 +1,331 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Pool of long-lived SSH tunnels to destination compute hosts.
+
+Tunnel is `ssh -Nf` process on source controller, which forwards port of
+source controller to SSH port of destination compute host through
+destination controller. Tunnels are keyed by (source controller,
+destination controller, destination compute host) and shared by transfers
+to the same host: transfer takes tunnel (`tunnel` context), tunnel is kept
+running after the last transfer released it, and is stopped when it is not
+used for `idle_timeout` seconds or when pool is closed.
+
+Tunnel taken from pool is checked to be running (at most once in
+`HEALTH_CHECK_INTERVAL` seconds), dead tunnel is started again.
+
+Tunnels, their ports and users are kept in `flock`-ed registry file of
+state directory, so tunnels are shared by threads and by processes forked
+by scheduler, and ports are not taken twice. Users of processes which
+exited without releasing tunnel are dropped.
+"""
+
+import contextlib
+import fcntl
+import os
+import shutil
+import time
+
+from fabric.api import env
+from fabric.api import run
+from fabric.api import settings
+
+from cloudferrylib.utils import local_state
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+DEFAULT_PORTS = '9000-9999'
+IDLE_TIMEOUT = 300
+HEALTH_CHECK_INTERVAL = 10
+# ports tried when tunnel fails to start, e.g. port is taken by other
+# process on source controller
+START_ATTEMPTS = 3
+
+TUNNEL_CMD = ("ssh -oStrictHostKeyChecking=no -oExitOnForwardFailure=yes "
+              "-oServerAliveInterval=30 -L {port}:{compute}:22 "
+              "-R {port}:localhost:{port} {controller} -Nf")
+PGREP_CMD = "pgrep -f '{pattern}'"
+PKILL_CMD = "pkill -f '{pattern}'"
+
+
+class NoFreePort(RuntimeError):
+    pass
+
+
+def parse_ports(ports):
+    """Returns first and last port of `first-last` or single port"""
+    bounds = [int(p) for p in str(ports).split('-')]
+    return bounds[0], bounds[-1]
+
+
+def tunnel_name(host, controller, compute):
+    key = '{host}-{controller}-{compute}'.format(host=host,
+                                                 controller=controller,
+                                                 compute=compute)
+    return local_state.file_name(key)
+
+
+def tunnel_cmd(tunnel):
+    return TUNNEL_CMD.format(**tunnel)
+
+
+def tunnel_pattern(tunnel):
+    """Pattern of tunnel process for `pgrep -f`.
+
+    `[s]sh` doesn't match command line of shell running `pgrep` itself.
+    """
+    return '[s]' + tunnel_cmd(tunnel)[1:]
+
+
+class TunnelPool(object):
+    """Tunnels on ports from :ports range (`first-last`)"""
+
+    def __init__(self, ports=DEFAULT_PORTS, idle_timeout=IDLE_TIMEOUT,
+                 state_dir=None):
+        self.first_port, self.last_port = parse_ports(ports)
+        self.idle_timeout = idle_timeout
+        self.state_dir = local_state.state_dir(
+            state_dir, prefix='cloudferry-tunnels-')
+        self.own_state_dir = state_dir is None
+
+    def path(self, name):
+        """Path of :name file in state directory, which is created if it was
+        removed by `cleanup`.
+        """
+        return os.path.join(local_state.state_dir(self.state_dir), name)
+
+    @staticmethod
+    def run(host, cmd):
+        """Runs :cmd on :host, returns `True` if it succeeded"""
+        with settings(host_string=host,
+                      connection_attempts=env.connection_attempts,
+                      warn_only=True):
+            return not run(cmd).failed
+
+    @contextlib.contextmanager
+    def registry(self):
+        """Locks and yields registry of tunnels, saves it when done"""
+        with local_state.locked_json(self.path('tunnels.json'), lambda: {
+                'tunnels': {}, 'created': 0, 'reused': 0, 'recreated': 0,
+                'evicted': 0}) as registry:
+            for tunnel in registry['tunnels'].itervalues():
+                for pid in tunnel['users'].keys():
+                    if not local_state.pid_alive(int(pid)):
+                        del tunnel['users'][pid]
+            yield registry
+
+    @contextlib.contextmanager
+    def tunnel_lock(self, name, blocking=True):
+        """Serializes start and health check of tunnel.
+
+        Yields `False` if lock is not :blocking and tunnel is locked.
+        """
+        with open(self.path(name + '.lock'), 'a') as f:
+            if blocking:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            elif not local_state.try_lock(f):
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def reserve_port(self, name, tunnel, skip):
+        with self.registry() as registry:
+            used = set(t['port'] for t in registry['tunnels'].itervalues())
+            for port in xrange(self.first_port, self.last_port + 1):
+                if port not in used and port not in skip:
+                    tunnel['port'] = port
+                    registry['tunnels'][name] = tunnel
+                    return port
+        raise NoFreePort("No free ssh port in {first}-{last}".format(
+            first=self.first_port, last=self.last_port))
+
+    def start(self, name, host, controller, compute):
+        """Starts tunnel on free port, returns its registry entry"""
+        skip = set()
+        for _ in xrange(START_ATTEMPTS):
+            tunnel = {'host': host, 'controller': controller,
+                      'compute': compute, 'users': {},
+                      'checked': time.time(), 'last_used': time.time()}
+            port = self.reserve_port(name, tunnel, skip)
+            LOG.debug("Starting SSH tunnel to %s through %s on %s:%d",
+                      compute, controller, host, port)
+            if self.run(host, tunnel_cmd(tunnel)):
+                tunnel['checked'] = time.time()
+                return tunnel
+            LOG.warning("Unable to start SSH tunnel on %s:%d", host, port)
+            skip.add(port)
+            with self.registry() as registry:
+                registry['tunnels'].pop(name, None)
+        raise RuntimeError("Unable to start SSH tunnel to {compute} on "
+                           "{host}".format(compute=compute, host=host))
+
+    def stop(self, tunnel):
+        LOG.debug("Stopping SSH tunnel to %s on %s:%d", tunnel['compute'],
+                  tunnel['host'], tunnel['port'])
+        self.run(tunnel['host'],
+                 PKILL_CMD.format(pattern=tunnel_pattern(tunnel)))
+
+    def is_alive(self, tunnel):
+        return self.run(tunnel['host'],
+                        PGREP_CMD.format(pattern=tunnel_pattern(tunnel)))
+
+    def acquire(self, compute, controller, host):
+        """Returns port of running tunnel to :compute, starts it if needed"""
+        self.evict_idle()
+        name = tunnel_name(host, controller, compute)
+        with self.tunnel_lock(name):
+            with self.registry() as registry:
+                tunnel = registry['tunnels'].get(name)
+            counter = 'reused'
+            if tunnel is not None and \
+                    time.time() - tunnel['checked'] > HEALTH_CHECK_INTERVAL:
+                if self.is_alive(tunnel):
+                    tunnel['checked'] = time.time()
+                else:
+                    LOG.warning("SSH tunnel to %s on %s:%d is dead, "
+                                "restarting it", compute, host,
+                                tunnel['port'])
+                    self.stop(tunnel)
+                    with self.registry() as registry:
+                        registry['tunnels'].pop(name, None)
+                    tunnel = None
+                    counter = 'recreated'
+            if tunnel is None:
+                tunnel = self.start(name, host, controller, compute)
+                if counter != 'recreated':
+                    counter = 'created'
+            with self.registry() as registry:
+                users = registry['tunnels'][name]['users']
+                pid = str(os.getpid())
+                users[pid] = users.get(pid, 0) + 1
+                registry['tunnels'][name]['checked'] = tunnel['checked']
+                registry['tunnels'][name]['last_used'] = time.time()
+                registry[counter] += 1
+            return tunnel['port']
+
+    def release(self, compute, controller, host):
+        name = tunnel_name(host, controller, compute)
+        with self.registry() as registry:
+            tunnel = registry['tunnels'].get(name)
+            if tunnel is not None:
+                pid = str(os.getpid())
+                tunnel['users'][pid] = tunnel['users'].get(pid, 1) - 1
+                if not tunnel['users'][pid]:
+                    del tunnel['users'][pid]
+                tunnel['last_used'] = time.time()
+        if not self.idle_timeout:
+            self.evict_idle()
+
+    @contextlib.contextmanager
+    def tunnel(self, compute, controller, host):
+        """Yields port of :host forwarded to SSH port of :compute host
+        through :controller.
+        """
+        port = self.acquire(compute, controller, host)
+        try:
+            yield port
+        finally:
+            self.release(compute, controller, host)
+
+    @contextlib.contextmanager
+    def reserved_port(self, name):
+        """Yields port of pool range which is not used by tunnels, e.g. for
+        port forwarded by other SSH command.
+        """
+        name = 'port-%s-%d' % (name, os.getpid())
+        port = self.reserve_port(name, {'reserved': True,
+                                        'users': {str(os.getpid()): 1},
+                                        'last_used': time.time()}, ())
+        try:
+            yield port
+        finally:
+            with self.registry() as registry:
+                registry['tunnels'].pop(name, None)
+
+    def evict_idle(self, now=None):
+        """Stops tunnels which are not used for `idle_timeout`"""
+        now = now or time.time()
+        with self.registry() as registry:
+            idle = [name for name, tunnel in registry['tunnels'].iteritems()
+                    if not tunnel['users'] and
+                    now - tunnel['last_used'] >= self.idle_timeout]
+        for name in idle:
+            # tunnel being taken by other transfer is not evicted
+            with self.tunnel_lock(name, blocking=False) as locked:
+                if not locked:
+                    continue
+                with self.registry() as registry:
+                    tunnel = registry['tunnels'].get(name)
+                    if tunnel is None or tunnel['users']:
+                        continue
+                    del registry['tunnels'][name]
+                    if tunnel.get('reserved'):
+                        # port of process which exited without release
+                        continue
+                    registry['evicted'] += 1
+                self.stop(tunnel)
+
+    def metrics(self):
+        """Returns counters of pool: tunnels `created`, `reused` by
+        transfers, `recreated` after they died, `evicted` as idle and
+        `open` now.
+        """
+        with self.registry() as registry:
+            return {'created': registry['created'],
+                    'reused': registry['reused'],
+                    'recreated': registry['recreated'],
+                    'evicted': registry['evicted'],
+                    'open': len([t for t in registry['tunnels'].itervalues()
+                                 if not t.get('reserved')])}
+
+    def close_all(self):
+        with self.registry() as registry:
+            tunnels = [t for t in registry['tunnels'].itervalues()
+                       if not t.get('reserved')]
+            registry['tunnels'] = {}
+        for tunnel in tunnels:
+            try:
+                self.stop(tunnel)
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning("Unable to stop SSH tunnel on %s:%d: %s",
+                            tunnel['host'], tunnel['port'], e)
+
+    def cleanup(self):
+        if self.own_state_dir:
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+
+
+_pool = None
+
+
+def get_pool(ports=None, idle_timeout=None):
+    """Returns pool of tunnels, created on first call.
+
+    Pool must be created before scheduler forks processes, so that they
+    share the same registry.
+    """
+    global _pool
+    if _pool is None:
+        _pool = TunnelPool(ports or DEFAULT_PORTS,
+                           IDLE_TIMEOUT if idle_timeout is None
+                           else idle_timeout)
+    elif ports is not None:
+        _pool.first_port, _pool.last_port = parse_ports(ports)
+    if idle_timeout is not None:
+        _pool.idle_timeout = idle_timeout
+    return _pool
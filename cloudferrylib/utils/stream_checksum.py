@@ -0,0 +1,147 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+"""Checksums of data computed while it is streamed between hosts.
+
+`hash_tee` is a shell filter put into transfer pipeline on both ends: it
+passes data from stdin to stdout unchanged and writes md5 of every
+`chunk_size` bytes into manifest file, one digest per line. Comparing
+manifests of source and destination verifies copy without reading files
+once again, and mismatch points to chunk which has to be resent.
+
+Filter is a python script passed with `python -c "<script>"`. Script has
+no quotes, so filter can be used inside `ssh host '<command>'`, and no `%`,
+so command with it can be formatted as `BC` command.
+"""
+
+import os
+import re
+import uuid
+
+from cloudferrylib.utils.console_cmd import BC
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
+HASH_TEE_SCRIPT = """import hashlib, os, sys
+manifest = os.open(sys.argv[1], os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+size = int(sys.argv[2])
+digest, left = hashlib.md5(), size
+while True:
+    data = os.read(0, min(left, 1048576))
+    if not data:
+        break
+    digest.update(data)
+    left -= len(data)
+    while data:
+        data = data[os.write(1, data):]
+    if not left:
+        os.write(manifest, (digest.hexdigest() + chr(10)).encode())
+        digest, left = hashlib.md5(), size
+if left != size:
+    os.write(manifest, (digest.hexdigest() + chr(10)).encode())
+"""
+
+hash_tee_cmd = BC('python -c "%s" %s %s')
+# manifest is written to stdout, data is dropped
+file_manifest_cmd = BC('dd if=%s bs=1M 2>/dev/null | %s 3>&1 >/dev/null')
+cat_manifest_cmd = BC('cat %s; rm -f %s')
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ChecksumMismatch(RuntimeError):
+    pass
+
+
+def hash_tee(manifest, chunk_size):
+    """Filter writing md5 of every :chunk_size bytes into :manifest"""
+    return hash_tee_cmd(HASH_TEE_SCRIPT, manifest, chunk_size)
+
+
+def file_manifest(path, chunk_size):
+    """Command printing md5 of every :chunk_size bytes of file.
+
+    Prints nothing if file doesn't exist.
+    """
+    return file_manifest_cmd(path, hash_tee('/dev/fd/3', chunk_size))
+
+
+def manifest_path(path):
+    """Unique path of manifest file for data of :path"""
+    return '/tmp/{name}.{id}.md5'.format(name=os.path.basename(path),
+                                         id=uuid.uuid4().hex)
+
+
+def read_manifest_cmd(manifest):
+    """Command printing manifest and removing it"""
+    return cat_manifest_cmd(manifest, manifest)
+
+
+def parse_manifest(output):
+    """Returns list of digests from output of `read_manifest_cmd`"""
+    return [line.strip() for line in str(output).splitlines()
+            if DIGEST_RE.match(line.strip())]
+
+
+def mismatched_chunks(src_manifest, dst_manifest):
+    """Returns indexes of chunks which digests differ or missing"""
+    return [i for i in xrange(max(len(src_manifest), len(dst_manifest)))
+            if i >= len(src_manifest) or i >= len(dst_manifest) or
+            src_manifest[i] != dst_manifest[i]]
+
+
+def chunk_ranges(chunks, max_length):
+    """Joins sorted chunk indexes into `(first, length)` ranges of adjacent
+    chunks no longer than :max_length.
+    """
+    ranges = []
+    for chunk in chunks:
+        if ranges and ranges[-1][0] + ranges[-1][1] == chunk and \
+                ranges[-1][1] < max_length:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([chunk, 1])
+    return [tuple(r) for r in ranges]
+
+
+def verified_stream_copy(copy, read_manifests, num_retries, name):
+    """Streams data, verifies digests and resends mismatched chunks.
+
+    :copy: `copy(chunk)` streams whole data if `chunk` is `None`, otherwise
+           only chunk with given index
+    :read_manifests: returns pair of source and destination manifests of
+                     last `copy` call, removes manifest files
+    :name: name of copied data used in messages
+
+    Returns source manifest.
+    """
+    copy(None)
+    src_manifest, dst_manifest = read_manifests()
+    for chunk in mismatched_chunks(src_manifest, dst_manifest):
+        for attempt in xrange(1, num_retries + 1):
+            LOG.warning("Checksum of chunk %d of '%s' doesn't match, "
+                        "resending, attempt %d", chunk, name, attempt)
+            copy(chunk)
+            src_digests, dst_digests = read_manifests()
+            if src_digests and src_digests == dst_digests:
+                if chunk < len(src_manifest):
+                    src_manifest[chunk] = src_digests[0]
+                break
+        else:
+            raise ChecksumMismatch(
+                "Checksum of chunk {chunk} of '{name}' doesn't match after "
+                "{retries} retries".format(chunk=chunk, name=name,
+                                           retries=num_retries))
+    return src_manifest
@@ -13,7 +13,6 @@
 # limitations under the License.
 
 import logging
-import time
 import timeit
 import random
 import string
@@ -27,9 +26,10 @@ import json
 from jinja2 import Environment, FileSystemLoader
 import os
 import inspect
-from multiprocessing import Lock
 from fabric.api import run, settings, local, env, sudo
 from fabric.context_managers import hide
+from fabric.exceptions import NetworkError
+from cloudferrylib.utils import remote_batch
 import ipaddr
 import yaml
 from logging import config
@@ -101,11 +101,6 @@ OLD_ID = 'old_id'
 
 FILTER_PATH = 'configs/filter.yaml'
 
-up_ssh_tunnel = None
-
-SSH_CMD = \
-    "ssh -oStrictHostKeyChecking=no -L %s:%s:22 -R %s:localhost:%s %s -Nf"
-
 
 class ext_dict(dict):
     def __getattr__(self, name):
@@ -306,8 +301,11 @@ def log_step(log):
             stack_call_functions.append(func.__name__, args, kwargs)
             log.info("%s> Step %s" % ("- - " * stack_call_functions.depth(),
                                       func.__name__))
-            res = func(*args, **kwargs)
-            stack_call_functions.pop(res)
+            res = None
+            try:
+                res = func(*args, **kwargs)
+            finally:
+                stack_call_functions.pop(res)
             return res
         return inner
     return decorator
@@ -319,9 +317,16 @@ class forward_agent(object):
         destination clouds via ssh
     """
 
+    # (agent socket, key files) known to be loaded into agent, saves local
+    # `ssh-add -l` call for every remote command
+    loaded_keys = set()
+
     def __init__(self, key_files):
         self.key_files = key_files
 
+    def _loaded_key(self):
+        return os.environ.get("SSH_AUTH_SOCK"), tuple(self.key_files)
+
     def _agent_already_running(self):
         with settings(hide('warnings', 'running', 'stdout', 'stderr'),
                       warn_only=True,
@@ -342,7 +347,10 @@ class forward_agent(object):
         return False
 
     def __enter__(self):
+        if self._loaded_key() in self.loaded_keys:
+            return
         if self._agent_already_running():
+            self.loaded_keys.add(self._loaded_key())
             return
         key_string = ' '.join(self.key_files)
         start_ssh_agent = ("eval `ssh-agent` && echo $SSH_AUTH_SOCK && "
@@ -352,6 +360,7 @@ class forward_agent(object):
         self.ssh_auth_sock = info_agent[1]
         os.environ["SSH_AGENT_PID"] = self.pid
         os.environ["SSH_AUTH_SOCK"] = self.ssh_auth_sock
+        self.loaded_keys.add(self._loaded_key())
 
     def __exit__(self, type, value, traceback):
         # never kill previously started ssh-agent, so that user only has to
@@ -359,78 +368,6 @@ class forward_agent(object):
         pass
 
 
-class wrapper_singletone_ssh_tunnel:
-
-    def __init__(self, interval_ssh="9000-9999", locker=Lock()):
-        self.interval_ssh = [int(interval_ssh.split('-')[0]),
-                             int(interval_ssh.split('-')[1])]
-        self.busy_port = []
-        self.locker = locker
-
-    def get_free_port(self):
-        with self.locker:
-            beg = self.interval_ssh[0]
-            end = self.interval_ssh[1]
-            while beg <= end:
-                if beg not in self.busy_port:
-                    self.busy_port.append(beg)
-                    return beg
-                beg += 1
-        raise RuntimeError("No free ssh port")
-
-    def free_port(self, port):
-        with self.locker:
-            if port in self.busy_port:
-                self.busy_port.remove(port)
-
-    def __call__(self, address_dest_compute, address_dest_controller, host,
-                 **kwargs):
-        return UpSshTunnelClass(address_dest_compute,
-                                address_dest_controller,
-                                host,
-                                self.get_free_port,
-                                self.free_port)
-
-
-class UpSshTunnelClass:
-
-    """
-        Up ssh tunnel on dest controller node for transferring data
-    """
-
-    def __init__(self, address_dest_compute, address_dest_controller, host,
-                 callback_get, callback_free):
-        self.address_dest_compute = address_dest_compute
-        self.address_dest_controller = address_dest_controller
-        self.get_free_port = callback_get
-        self.remove_port = callback_free
-        self.host = host
-        self.cmd = SSH_CMD
-
-    def __enter__(self):
-        self.port = self.get_free_port()
-        with settings(host_string=self.host,
-                      connection_attempts=env.connection_attempts):
-            run(self.cmd % (self.port,
-                            self.address_dest_compute,
-                            self.port,
-                            self.port,
-                            self.address_dest_controller) + " && sleep 2")
-        return self.port
-
-    def __exit__(self, type, value, traceback):
-        with settings(host_string=self.host,
-                      connection_attempts=env.connection_attempts):
-            run(("pkill -f '" + self.cmd + "'") %
-                (self.port,
-                 self.address_dest_compute,
-                 self.port,
-                 self.port,
-                 self.address_dest_controller))
-        time.sleep(2)
-        self.remove_port(self.port)
-
-
 class ChecksumImageInvalid(Exception):
     def __init__(self, checksum_source, checksum_dest):
         self.checksum_source = checksum_source
@@ -467,6 +404,33 @@ def libvirt_instance_exists(libvirt_name, init_host, compute_host, ssh_user,
         return out.succeeded
 
 
+def get_libvirt_instances_info(libvirt_names, init_host, compute_host,
+                               ssh_user, ssh_sudo_password):
+    """Returns block devices of instances on compute host by libvirt name.
+
+    Instances which don't exist on host are skipped. All instances are
+    checked in a single remote invocation. If host can't be reached or
+    the invocation fails, no instances are found on host.
+    """
+    libvirt_names = list(libvirt_names)
+    commands = ["virsh domblklist %s" % name for name in libvirt_names]
+    try:
+        with settings(host_string=compute_host,
+                      user=ssh_user,
+                      password=ssh_sudo_password,
+                      gateway=init_host,
+                      connection_attempts=env.connection_attempts,
+                      warn_only=True,
+                      quiet=True):
+            results = list(remote_batch.run(sudo, commands))
+    except NetworkError as e:
+        get_log(__name__).warning("Unable to get instances of compute host "
+                                  "%s: %s", compute_host, e)
+        return {}
+    return {name: out.split() for name, out in zip(libvirt_names, results)
+            if out.succeeded}
+
+
 def get_libvirt_block_info(libvirt_name, init_host, compute_host, ssh_user,
                            ssh_sudo_password):
     with settings(host_string=compute_host,
@@ -485,11 +449,6 @@ def find_element_by_in(list_values, word):
             return i
 
 
-def init_singletones(cfg):
-    globals()['up_ssh_tunnel'] = wrapper_singletone_ssh_tunnel(
-        cfg.migrate.ssh_transfer_port)
-
-
 def get_disk_path(instance, blk_list, is_ceph_ephemeral=False, disk=DISK):
     disk_path = None
     if not is_ceph_ephemeral:
@@ -525,8 +484,12 @@ def get_ips(init_host, compute_host, ssh_user):
     return list_ips
 
 
-def get_ext_ip(ext_cidr, init_host, compute_host, ssh_user):
-    list_ips = get_ips(init_host, compute_host, ssh_user)
+def get_ext_ip(ext_cidr, init_host, compute_host, ssh_user, list_ips=None):
+    """Returns IP address of compute host which is in one of :ext_cidr,
+    :list_ips of host are got from host if not passed
+    """
+    if list_ips is None:
+        list_ips = get_ips(init_host, compute_host, ssh_user)
     for ip_str in list_ips:
         ip_addr = ipaddr.IPAddress(ip_str)
         for cidr in ext_cidr:
@@ -18,6 +18,8 @@ import warnings
 import cfglib
 from cloudferrylib.scheduler.namespace import Namespace
 from cloudferrylib.scheduler.scheduler import Scheduler
+from cloudferrylib.utils import progress_events
+from cloudferrylib.utils import ssh_tunnel
 from cloudferrylib.utils import utils
 from cloudferrylib.utils.errorcodes import ERROR_INVALID_CONFIGURATION
 from cloudferrylib.scheduler.scenario import Scenario
@@ -31,6 +33,8 @@ from condensation.action import get_freed_nodes
 from condensation.scripts import nova_collector
 
 import data_storage
+from benchmarks import scenario_loading
+from benchmarks import scheduler_overhead
 from dry_run import chain
 from evacuation import evacuation_chain
 from make_filters import make_filters
@@ -47,9 +51,12 @@ DEFAULT_FILTERS_FILES = 'configs/filters'
 
 
 @task
-def migrate(name_config=None, debug=False):
+def migrate(name_config=None, debug=False, resume=False, plan=False):
     """
         :name_config - name of config yaml-file, example 'config.yaml'
+        :resume - continue migration from `[migrate] checkpoint_file` state
+        :plan - print execution plan of scenario and its critical path
+                instead of migration
     """
     if debug:
         utils.configure_logging("DEBUG")
@@ -58,15 +65,31 @@ def migrate(name_config=None, debug=False):
         env.key_filename = cfglib.CONF.migrate.key_filename
         env.connection_attempts = cfglib.CONF.migrate.ssh_connection_attempts
         cloud = cloud_ferry.CloudFerry(cfglib.CONF)
-        status_error = cloud.migrate(Scenario(
+        scenario = Scenario(
             path_scenario=cfglib.CONF.migrate.scenario,
-            path_tasks=cfglib.CONF.migrate.tasks_mapping))
+            path_tasks=cfglib.CONF.migrate.tasks_mapping,
+            actions_index=cfglib.CONF.migrate.actions_index)
+        if plan:
+            print cloud.plan(scenario)
+            return
+        status_error = cloud.migrate(scenario, resume=resume)
     except oslo.config.cfg.Error:
         traceback.print_exc()
         sys.exit(ERROR_INVALID_CONFIGURATION)
     sys.exit(status_error)
 
 
+@task
+def migrate_resume(name_config=None, debug=False):
+    """
+        Continues failed migration, skipping tasks which were completed
+        before failure. Requires `[migrate] checkpoint_file` to be set.
+
+        :name_config - name of config yaml-file, example 'config.yaml'
+    """
+    migrate(name_config, debug, resume=True)
+
+
 @task
 def get_info(name_config, debug=False):
     if debug:
@@ -81,6 +104,47 @@ def dry_run():
     chain.process_test_chain()
 
 
+@task
+def benchmark_scenario_loading(tasks_file=None, repeat=3):
+    """Measures cold and warm loading of actions used by tasks file"""
+    if tasks_file:
+        scenario_loading.run(tasks_file, int(repeat))
+    else:
+        scenario_loading.run_default(int(repeat))
+
+
+@task
+def benchmark_scheduler(size=2000, repeat=5, output=None, baseline=None):
+    """
+        Measures scheduler overhead on synthetic scenarios of dry run tasks
+
+        :size - number of tasks in scenario
+        :output - save results to JSON file
+        :baseline - compare with results saved by previous run
+    """
+    scheduler_overhead.main(size, repeat, output, baseline)
+
+
+@task
+def tail_progress(events=None, follow=True, interval=2, name_config=None):
+    """
+        Shows progress, throughput and ETA of running migration
+
+        :events - event file or "unix:<path>" socket, `[migrate]
+                  progress_events` of config by default
+        :follow - wait for new events until interrupted
+        :interval - seconds between progress reports
+    """
+    if events is None:
+        load_config(name_config)
+        events = cfglib.CONF.migrate.progress_events
+    if not events:
+        sys.exit("Progress events are disabled: [migrate] progress_events "
+                 "is not set")
+    follow = str(follow).lower() not in ('false', 'no', '0')
+    progress_events.tail(events, follow=follow, interval=float(interval))
+
+
 @task
 def evacuate(name_config=None, debug=False, iteration=False):
     if debug:
@@ -207,7 +271,8 @@ def create_filters(name_config=None, filter_folder=DEFAULT_FILTERS_FILES,
 def load_config(name_config):
     cfglib.collector_configs_plugins()
     cfglib.init_config(name_config)
-    utils.init_singletones(cfglib.CONF)
+    ssh_tunnel.get_pool(cfglib.CONF.migrate.ssh_transfer_port,
+                        cfglib.CONF.migrate.ssh_tunnel_idle_timeout)
     if cfglib.CONF.migrate.hide_ssl_warnings:
         warnings.simplefilter("ignore")
 
@@ -0,0 +1,96 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+
+from cloudferrylib.base.action import parallel_iter
+from cloudferrylib.scheduler import namespace
+from cloudferrylib.scheduler import resource_limits
+from cloudferrylib.scheduler import task
+
+from tests import test
+
+
+class MarkMigrated(task.Task):
+    def run(self, info=None, **kwargs):
+        for obj_id, obj in info['instances'].items():
+            if obj['fail']:
+                raise RuntimeError("Failed %s" % obj_id)
+            obj['migrated'] = True
+        return {'info': info}
+
+
+def make_net():
+    return task.Task() >> MarkMigrated()
+
+
+class ParallelIterTestCase(test.TestCase):
+    def setUp(self):
+        super(ParallelIterTestCase, self).setUp()
+        self.instances = {
+            'inst1': {'host': 'h1', 'fail': False},
+            'inst2': {'host': 'h1', 'fail': True},
+            'inst3': {'host': 'h2', 'fail': False},
+        }
+        self.limits = resource_limits.ResourceLimits({'host': 1})
+        self.addCleanup(self.limits.cleanup)
+
+    def make_action(self, limits):
+        return parallel_iter.ParallelIter(
+            {}, make_net, workers=3, limits=limits,
+            resources=lambda obj: [('host', obj['host'])])
+
+    def test_migrates_all_and_collects_failures(self):
+        action = self.make_action(self.limits)
+
+        res = action.run(info_iter={'instances': self.instances},
+                         info_result={'instances': {}})
+
+        migrated = res['info_result']['instances']
+        self.assertEqual(['inst1', 'inst3'], sorted(migrated))
+        self.assertTrue(all(i['migrated'] for i in migrated.values()))
+        self.assertEqual(['inst2'], res['failed_info']['instances'].keys())
+        self.assertIn('Failed inst2', res['failed_info']['instances']['inst2'])
+        self.assertEqual({}, res['info_iter']['instances'])
+
+    def test_failure_is_raised_after_all_are_processed(self):
+        action = self.make_action(self.limits)
+        ns = namespace.Namespace({'info_iter': {'instances': self.instances},
+                                  'info_result': {'instances': {}}})
+
+        self.assertRaises(parallel_iter.ParallelIterError, action, ns)
+
+        self.assertEqual(['inst1', 'inst3'],
+                         sorted(ns.vars['info_result']['instances']))
+        self.assertEqual(['inst2'],
+                         ns.vars['failed_info']['instances'].keys())
+
+    def test_limits(self):
+        action = self.make_action(self.limits)
+
+        self.assertTrue(action.try_acquire('inst1', self.instances['inst1']))
+
+        self.assertFalse(action.try_acquire('inst2',
+                                            self.instances['inst2']))
+        self.assertTrue(action.try_acquire('inst3', self.instances['inst3']))
+        action.release('inst1')
+        self.assertTrue(action.try_acquire('inst2', self.instances['inst2']))
+
+    def test_zero_cap_is_unlimited(self):
+        limits = resource_limits.ResourceLimits({'host': 0})
+        self.addCleanup(limits.cleanup)
+        action = self.make_action(limits)
+
+        self.assertTrue(action.try_acquire('inst1', self.instances['inst1']))
+
+        self.assertTrue(action.try_acquire('inst2', self.instances['inst2']))
@@ -97,6 +97,7 @@ def _action(fake_src_data, fake_dst_data):
         migrate=utils.ext_dict({
             'ssh_connection_attempts': 3,
             'key_filename': 'key_filename',
+            'speed_limit': 'off',
         }),
         src=utils.ext_dict({'ssh_user': 'src_user',
                             'ssh_sudo_password': 'src_passwd',
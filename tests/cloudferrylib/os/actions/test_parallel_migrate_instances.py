@@ -0,0 +1,70 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import mock
+
+from cloudferrylib.os.actions import parallel_migrate_instances
+from cloudferrylib.scheduler import namespace
+from cloudferrylib.scheduler import task
+
+from tests import test
+
+
+class MarkMigrated(task.Task):
+    def run(self, info=None, **kwargs):
+        for obj in info['instances'].values():
+            obj['migrated'] = True
+        return {'info': info}
+
+
+def instance(host):
+    return {'instance': {'host': host, 'is_ephemeral': False,
+                         'boot_mode': 'boot_volume', 'volumes': []}}
+
+
+class ParallelMigrateInstancesTestCase(test.TestCase):
+    def setUp(self):
+        super(ParallelMigrateInstancesTestCase, self).setUp()
+        self.cfg = mock.Mock()
+        self.scenario = mock.Mock()
+        self.scenario.chain_net.side_effect = lambda name: MarkMigrated()
+        self.ns = namespace.Namespace({
+            'info_iter': {'instances': {'inst1': instance('h1'),
+                                        'inst2': instance('h2')}},
+            'info_result': {'instances': {}}})
+
+    def make_action(self, parallel_instances):
+        self.cfg.migrate.parallel_instances = parallel_instances
+        return parallel_migrate_instances.ParallelMigrateInstances(
+            {'cfg': self.cfg, 'scenario': self.scenario})
+
+    def test_loop_is_used_if_parallel_instances_disabled(self):
+        action = self.make_action(1)
+
+        action(self.ns)
+
+        self.assertEqual(parallel_migrate_instances.LOOP, action.num_element)
+        self.assertEqual({}, self.ns.vars['info_result']['instances'])
+        self.assertFalse(self.scenario.chain_net.called)
+
+    def test_instances_are_migrated_by_scenario_chain(self):
+        action = self.make_action(2)
+
+        action(self.ns)
+
+        self.assertEqual(parallel_migrate_instances.END_OF_LOOP,
+                         action.num_element)
+        migrated = self.ns.vars['info_result']['instances']
+        self.assertEqual(['inst1', 'inst2'], sorted(migrated))
+        self.assertTrue(all(i['migrated'] for i in migrated.values()))
@@ -71,6 +71,21 @@ class NovaComputeTestCase(test.TestCase):
 
         self.fake_tenant_quota_0 = mock.Mock()
 
+    @mock.patch('cloudferrylib.utils.utils.get_ips')
+    def test_compute_ips_are_cached_only_while_info_is_read(self, get_ips):
+        get_ips.return_value = ['10.0.0.5']
+        self.nova_client.config = mock.Mock()
+
+        self.nova_client.get_ext_ip(['10.0.0.0/24'], 'compute')
+        self.nova_client.get_ext_ip(['10.0.0.0/24'], 'compute')
+        self.assertEqual(2, get_ips.call_count)
+
+        self.nova_client.compute_ips = {}
+        self.nova_client.get_ext_ip(['10.0.0.0/24'], 'compute')
+        self.assertEqual('10.0.0.5', self.nova_client.get_ext_ip(
+            ['10.0.0.0/24'], 'compute'))
+        self.assertEqual(3, get_ips.call_count)
+
     def test_get_nova_client(self):
         # To check self.mock_client call only from this test method
         self.mock_client.reset_mock()
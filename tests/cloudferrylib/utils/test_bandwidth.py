@@ -0,0 +1,195 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import os
+import subprocess
+
+import mock
+
+from cloudferrylib.utils import bandwidth
+
+from tests import test
+
+MB = 1024 * 1024
+
+
+class ParseRateTestCase(test.TestCase):
+    def test_units(self):
+        self.assertEqual(0, bandwidth.parse_rate('off'))
+        self.assertEqual(100, bandwidth.parse_rate('100b'))
+        self.assertEqual(10 * MB, bandwidth.parse_rate('10MB'))
+
+    def test_bad_value_disables_limit(self):
+        self.assertEqual(0, bandwidth.parse_rate('10 parsecs'))
+
+
+class FairSharesTestCase(test.TestCase):
+    def test_rate_is_shared_by_weights(self):
+        shares = bandwidth.fair_shares(90, {
+            'a': {'weight': 1, 'minimum': 0},
+            'b': {'weight': 2, 'minimum': 0}})
+
+        self.assertEqual({'a': 30, 'b': 60}, shares)
+
+    def test_every_transfer_gets_its_minimum(self):
+        shares = bandwidth.fair_shares(100, {
+            'a': {'weight': 1, 'minimum': 10},
+            'b': {'weight': 9, 'minimum': 10}})
+
+        self.assertEqual({'a': 18, 'b': 82}, shares)
+
+    def test_minimums_are_scaled_down_to_rate(self):
+        shares = bandwidth.fair_shares(30, {
+            'a': {'weight': 1, 'minimum': 20},
+            'b': {'weight': 1, 'minimum': 40}})
+
+        self.assertEqual({'a': 10, 'b': 20}, shares)
+
+
+class TokenBucketTestCase(test.TestCase):
+    def test_data_over_rate_waits(self):
+        clock = mock.Mock(return_value=0)
+        sleep = mock.Mock()
+        bucket = bandwidth.TokenBucket(100, clock=clock, sleep=sleep)
+
+        self.assertEqual(0.5, bucket.consume(50))
+        clock.return_value = 0.5
+        self.assertEqual(0.5, bucket.consume(50))
+        sleep.assert_called_with(0.5)
+
+    def test_burst_is_limited(self):
+        clock = mock.Mock(return_value=0)
+        bucket = bandwidth.TokenBucket(100, burst=1, clock=clock,
+                                       sleep=mock.Mock())
+        clock.return_value = 10
+
+        self.assertEqual(0, bucket.consume(100))
+        self.assertEqual(0.5, bucket.consume(50))
+
+
+class ThrottleTestCase(test.TestCase):
+    def test_data_is_passed_unchanged(self):
+        data = os.urandom(100000)
+        process = subprocess.Popen(
+            ['bash', '-c', str(bandwidth.throttle(10 * MB))],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        self.assertEqual(data, process.communicate(data)[0])
+
+    def test_script_can_be_quoted(self):
+        for char in '\'"%$':
+            self.assertNotIn(char, bandwidth.THROTTLE_SCRIPT)
+
+    def test_tool_options(self):
+        self.assertEqual('', bandwidth.rsync_bwlimit(0))
+        self.assertEqual(' --bwlimit=2048', bandwidth.rsync_bwlimit(2 * MB))
+        self.assertEqual(8192, bandwidth.scp_limit(MB))
+        self.assertIsNone(bandwidth.scp_limit(0))
+
+
+class BandwidthSchedulerTestCase(test.TestCase):
+    def setUp(self):
+        super(BandwidthSchedulerTestCase, self).setUp()
+        self.scheduler = bandwidth.BandwidthScheduler(
+            90, weights={bandwidth.VOLUME: '2'})
+
+    def tearDown(self):
+        self.scheduler.cleanup()
+        super(BandwidthSchedulerTestCase, self).tearDown()
+
+    def test_link_is_shared_by_running_transfers(self):
+        image = self.scheduler.open('image', 'src-1', 'dst-1',
+                                    bandwidth.IMAGE)
+        self.assertEqual(90, image.rate)
+
+        volume = self.scheduler.open('volume', 'src-2', 'dst-2',
+                                     bandwidth.VOLUME)
+        image._refreshed = None
+
+        self.assertEqual(30, image.rate)
+        self.assertEqual(60, volume.rate)
+
+        self.scheduler.close(volume)
+        image._refreshed = None
+        self.assertEqual(90, image.rate)
+
+    def test_every_host_pair_has_own_link(self):
+        self.scheduler.per_host_pair = True
+        first = self.scheduler.open('a', 'src-1', 'dst-1')
+        second = self.scheduler.open('b', 'src-2', 'dst-1')
+
+        self.assertEqual(90, first.rate)
+        self.assertEqual(90, second.rate)
+
+    def test_transfers_of_dead_processes_are_dropped(self):
+        link = self.scheduler.link('src', 'dst')
+        with link.state() as state:
+            state['transfers']['dead'] = {'weight': 1, 'minimum': 0,
+                                          'pid': 2 ** 22 + 1}
+
+        share = self.scheduler.open('a', 'src', 'dst')
+
+        self.assertEqual(90, share.rate)
+
+    def test_utilisation_is_reported(self):
+        share = self.scheduler.open('a', 'src', 'dst')
+        share.add(90)
+        with mock.patch('time.time',
+                        return_value=share.started + 2):
+            self.scheduler.close(share)
+
+        [link] = self.scheduler.report()
+        self.assertEqual(bandwidth.CLOUDS_LINK, link['link'])
+        self.assertEqual(90, link['bytes'])
+        self.assertEqual(0, link['transfers'])
+        self.assertTrue(0.4 < link['utilisation'] < 0.6)
+
+
+class TransferTestCase(test.TestCase):
+    def tearDown(self):
+        bandwidth.configure(None)
+        super(TransferTestCase, self).tearDown()
+
+    def test_unlimited_if_speed_limit_is_off(self):
+        config = mock.Mock()
+        config.migrate.speed_limit = 'off'
+        bandwidth.configure(config)
+
+        with bandwidth.transfer('a', 'src', 'dst') as share:
+            self.assertFalse(share.limited)
+            self.assertEqual(0, share.rate)
+
+    def test_speed_limit_is_shared(self):
+        config = mock.Mock()
+        config.migrate.speed_limit = '10mb'
+        config.migrate.speed_limit_per_host_pair = False
+        config.migrate.speed_limit_min_share = 'off'
+        config.migrate.speed_limit_weights = {}
+        bandwidth.configure(config)
+
+        with bandwidth.transfer('a', 'src', 'dst') as first, \
+                bandwidth.transfer('b', 'src', 'dst') as second:
+            self.assertEqual(5 * MB, first.rate)
+            self.assertEqual(5 * MB, second.rate)
+
+    def test_speed_limit_of_config_without_shared_budget(self):
+        config = mock.Mock()
+        config.migrate.speed_limit = '10mb'
+
+        with bandwidth.transfer('a', 'src', 'dst', config=config) as share:
+            self.assertTrue(share.limited)
+            self.assertEqual(10 * MB, share.rate)
+            with mock.patch.object(share.bucket, 'sleep') as sleep:
+                share.consume(20 * MB)
+            self.assertTrue(sleep.called)
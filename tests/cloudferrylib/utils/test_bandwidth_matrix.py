@@ -0,0 +1,139 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import mock
+
+from cloudferrylib.scheduler import executor
+from cloudferrylib.utils import bandwidth_matrix
+
+from tests import test
+
+
+class ProbeTestCase(test.TestCase):
+    def test_script_runs_streams_in_parallel(self):
+        script = bandwidth_matrix.probe_script(
+            lambda cmd: "ssh src '%s'" % cmd,
+            lambda cmd: "ssh dst '%s'" % cmd, 100, 2)
+
+        self.assertEqual(2, script.count(
+            "( ssh src 'dd if=/dev/zero bs=1M count=50 2>/dev/null' | "
+            "ssh dst 'cat > /dev/null' ) & "))
+        self.assertIn("ssh dst 'true'", script)
+
+    def test_ssh_round_trip_is_not_counted_as_transfer(self):
+        measurement = bandwidth_matrix.parse_probe(
+            '2000000 1002000000\n', 100, 2)
+
+        self.assertEqual(800, measurement['bandwidth'])
+        self.assertEqual(2, measurement['latency'])
+
+    def test_sampled_pairs_cover_all_hosts(self):
+        pairs = bandwidth_matrix.sample_pairs(['s1', 's2', 's3'],
+                                              ['d1', 'd2'], 4)
+
+        self.assertEqual(4, len(set(pairs)))
+        self.assertEqual({'s1', 's2', 's3'}, {s for s, _ in pairs})
+        self.assertEqual({'d1', 'd2'}, {d for _, d in pairs})
+
+    def test_all_pairs_without_sampling(self):
+        pairs = bandwidth_matrix.sample_pairs(['s1', 's2'], ['d1', 'd2'])
+
+        self.assertEqual(4, len(pairs))
+
+
+class BandwidthMatrixTestCase(test.TestCase):
+    def setUp(self):
+        super(BandwidthMatrixTestCase, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'matrix.json')
+
+    def test_matrix_is_saved_and_loaded(self):
+        matrix = bandwidth_matrix.BandwidthMatrix.load(self.path)
+        matrix.add('s1', 'd1', {'bandwidth': 800, 'latency': 2})
+        matrix.save()
+
+        loaded = bandwidth_matrix.BandwidthMatrix.load(self.path)
+
+        self.assertEqual(800, loaded.bandwidth('s1', 'd1'))
+        self.assertIsNone(loaded.bandwidth('s1', 'd2'))
+
+    def test_duration_is_estimated(self):
+        matrix = bandwidth_matrix.BandwidthMatrix(self.path, {
+            's1': {'d1': {'bandwidth': 800, 'latency': 500}}})
+        size = 1000 * bandwidth_matrix.MB
+
+        self.assertEqual(10.5, matrix.estimate_duration('s1', 'd1', size, 80))
+        self.assertEqual(100, matrix.estimate_duration('s1', 'd2', size, 80))
+
+    def test_fastest_host_is_chosen(self):
+        matrix = bandwidth_matrix.BandwidthMatrix(self.path, {
+            's1': {'d1': {'bandwidth': 100, 'latency': 1},
+                   'd2': {'bandwidth': 800, 'latency': 1}}})
+
+        self.assertEqual('d2', matrix.fastest('s1', ['d1', 'd2', 'd3']))
+
+
+class ProberTestCase(test.TestCase):
+    def setUp(self):
+        super(ProberTestCase, self).setUp()
+        config = mock.Mock()
+        config.initial_check.test_file_size = 100
+        config.initial_check.probe_streams = 2
+        config.initial_check.probe_concurrency = 4
+        self.prober = bandwidth_matrix.Prober(
+            mock.Mock(), mock.Mock(), config,
+            executor=executor.ThreadExecutor())
+        self.matrix = bandwidth_matrix.BandwidthMatrix('matrix.json')
+
+    def test_host_is_probed_by_one_pair_at_once(self):
+        lock = threading.Lock()
+        busy = set()
+        overlaps = []
+
+        def probe(src, dst):
+            with lock:
+                if src in busy or dst in busy:
+                    overlaps.append((src, dst))
+                busy.update([src, dst])
+            time.sleep(0.01)
+            with lock:
+                busy.difference_update([src, dst])
+            return {'bandwidth': 100, 'latency': 1}
+        self.prober.probe = probe
+        pairs = bandwidth_matrix.sample_pairs(['s1', 's2'], ['d1', 'd2'])
+
+        failed = self.prober.run(pairs, self.matrix)
+
+        self.assertEqual(0, failed)
+        self.assertEqual([], overlaps)
+        self.assertEqual(100, self.matrix.bandwidth('s2', 'd1'))
+
+    def test_failed_probes_are_counted(self):
+        def probe(src, dst):
+            if dst == 'd2':
+                raise RuntimeError("ssh: connect to host d2 port 22")
+            return {'bandwidth': 100, 'latency': 1}
+        self.prober.probe = probe
+
+        failed = self.prober.run([('s1', 'd1'), ('s1', 'd2')], self.matrix)
+
+        self.assertEqual(1, failed)
+        self.assertIsNone(self.matrix.bandwidth('s1', 'd2'))
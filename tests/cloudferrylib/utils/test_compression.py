@@ -0,0 +1,83 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import os
+import subprocess
+import tempfile
+
+import mock
+
+from cloudferrylib.utils import compression
+
+from tests import test
+
+MB = 1024 * 1024
+
+
+def sample(level, ratio, speed):
+    return compression.Sample(level, 16 * MB, int(16 * MB / ratio),
+                              16.0 / speed)
+
+
+class ChooseCompressionTestCase(test.TestCase):
+    def test_no_compression_on_fast_link(self):
+        samples = [sample(1, 2.0, 100), sample(9, 3.0, 20)]
+
+        level, reason = compression.choose(samples, 1250)
+
+        self.assertIsNone(level)
+        self.assertIn('link 1250.0 MB/s', reason)
+
+    def test_fast_gzip_on_medium_link(self):
+        samples = [sample(1, 2.0, 100), sample(9, 3.0, 20)]
+
+        self.assertEqual(1, compression.choose(samples, 40)[0])
+
+    def test_high_gzip_on_slow_link(self):
+        samples = [sample(1, 2.0, 100), sample(9, 3.0, 20)]
+
+        self.assertEqual(9, compression.choose(samples, 5)[0])
+
+    def test_incompressible_data_is_not_compressed(self):
+        samples = [sample(1, 1.0, 50), sample(9, 1.01, 10)]
+
+        self.assertIsNone(compression.choose(samples, 5)[0])
+
+
+class SampleTestCase(test.TestCase):
+    def test_sample_script(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'\0' * MB + os.urandom(MB))
+            f.flush()
+            output = subprocess.check_output(
+                "bash -c '{0}'".format(
+                    compression.sample_cmd(f.name, MB, [1, 9])),
+                shell=True)
+
+        samples = compression.parse_samples(output)
+
+        self.assertEqual([1, 9], [s.level for s in samples])
+        self.assertEqual([MB, MB], [s.size for s in samples])
+        self.assertTrue(samples[0].ratio > 100)
+
+    @mock.patch.object(compression, '_bandwidth', {})
+    def test_measured_bandwidth_is_preferred(self):
+        config = mock.Mock()
+        config.initial_check.claimed_bandwidth = 800
+
+        self.assertEqual(100, compression.link_bandwidth(config))
+
+        compression.set_bandwidth('src', 400)
+        compression.set_bandwidth('dst', 200)
+        self.assertEqual(25, compression.link_bandwidth(config))
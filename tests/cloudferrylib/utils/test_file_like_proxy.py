@@ -0,0 +1,90 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import io
+
+import mock
+
+from cloudferrylib.utils import file_like_proxy
+
+from tests import test
+
+
+class Source(object):
+    """Stream without `readinto` returning blocks of its own size"""
+
+    def __init__(self, blocks):
+        self.blocks = list(blocks)
+
+    def read(self, size=-1):
+        return self.blocks.pop(0) if self.blocks else b''
+
+
+class StreamBufferTestCase(test.TestCase):
+    def test_block_of_requested_size_is_not_copied(self):
+        block = b'a' * 10
+        buf = file_like_proxy.StreamBuffer(Source([block]))
+
+        self.assertIs(block, buf.read(10))
+        self.assertEqual(b'', buf.read(10))
+
+    def test_longer_block_is_handed_out_by_views(self):
+        buf = file_like_proxy.StreamBuffer(Source([b'abcdefg', b'hi']))
+
+        chunks = [buf.read(3) for _ in xrange(5)]
+
+        self.assertIsInstance(chunks[0], memoryview)
+        self.assertEqual([b'abc', b'def', b'g', b'hi', b''],
+                         [c if isinstance(c, str) else c.tobytes()
+                          for c in chunks])
+
+    def test_source_is_read_into_buffer(self):
+        buf = file_like_proxy.StreamBuffer(io.BytesIO(b'x' * 10), capacity=4)
+
+        chunks = []
+        while True:
+            chunk = buf.read(3)
+            if not len(chunk):
+                break
+            chunks.append(chunk.tobytes())
+
+        self.assertEqual([b'xxx', b'x'] * 2 + [b'xx'], chunks)
+
+
+class FileLikeProxyTestCase(test.TestCase):
+    def make_proxy(self, data, share):
+        resp = io.BytesIO(data)
+        resp.length = len(data)
+        image = {'id': 'image-id', 'name': 'image', 'size': len(data),
+                 'resource': mock.Mock()}
+        image['resource'].get_ref_image.return_value = resp
+        return file_like_proxy.FileLikeProxy(image, share)
+
+    @mock.patch('cloudferrylib.utils.file_like_proxy.progressbar')
+    @mock.patch('cloudferrylib.utils.file_like_proxy.progress_events')
+    def test_limited_read_returns_strings(self, *_):
+        data = b'y' * (file_like_proxy.CHUNK_SIZE + 100)
+        share = mock.Mock(limited=True)
+        proxy = self.make_proxy(data, share)
+
+        chunks = []
+        chunk = proxy.read(65536)
+        while chunk:
+            self.assertIsInstance(chunk, str)
+            chunks.append(chunk)
+            chunk = proxy.read(65536)
+
+        self.assertEqual(data, b''.join(chunks))
+        consumed = [c[0][0] for c in share.consume.call_args_list]
+        self.assertEqual(len(data), sum(consumed))
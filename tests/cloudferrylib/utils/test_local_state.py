@@ -0,0 +1,67 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from cloudferrylib.utils import local_state
+
+from tests import test
+
+
+class LocalStateTestCase(test.TestCase):
+    def setUp(self):
+        super(LocalStateTestCase, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        self.path = os.path.join(self.dir, 'state.json')
+
+    def test_pid_alive(self):
+        proc = subprocess.Popen(['true'])
+        proc.wait()
+        self.assertTrue(local_state.pid_alive(os.getpid()))
+        self.assertFalse(local_state.pid_alive(proc.pid))
+
+    def test_file_name_keeps_different_keys_apart(self):
+        self.assertTrue(local_state.file_name('a/b').startswith('a_b.'))
+        self.assertNotEqual(local_state.file_name('a/b'),
+                            local_state.file_name('a_b'))
+
+    def test_state_dir_is_created(self):
+        path = os.path.join(self.dir, 'sub')
+        self.assertEqual(path, local_state.state_dir(path))
+        self.assertTrue(os.path.isdir(path))
+
+    def test_locked_json_saves_state(self):
+        with local_state.locked_json(self.path, lambda: {'n': 0}) as state:
+            state['n'] += 1
+        with local_state.locked_json(self.path, dict) as state:
+            self.assertEqual({'n': 1}, state)
+
+    def test_locked_json_not_saved_on_error(self):
+        def update():
+            with local_state.locked_json(self.path, dict) as state:
+                state['n'] = 1
+                raise RuntimeError()
+
+        self.assertRaises(RuntimeError, update)
+        with local_state.locked_json(self.path, dict) as state:
+            self.assertEqual({}, state)
+
+    def test_try_lock(self):
+        with open(self.path, 'a') as first, open(self.path, 'a') as second:
+            self.assertTrue(local_state.try_lock(first))
+            self.assertFalse(local_state.try_lock(second))
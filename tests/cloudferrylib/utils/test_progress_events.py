@@ -0,0 +1,151 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import os
+import shutil
+import socket
+import StringIO
+import tempfile
+
+from cloudferrylib.scheduler import cursor
+from cloudferrylib.scheduler import scheduler
+from cloudferrylib.scheduler import task
+from cloudferrylib.utils import progress_events
+from cloudferrylib.utils import utils
+
+from tests import test
+
+
+class Noop(task.Task):
+    def run(self, **kwargs):
+        pass
+
+
+class Fail(task.Task):
+    def run(self, **kwargs):
+        raise ValueError("failed")
+
+
+@utils.log_step(utils.get_log(__name__))
+def copy_step():
+    progress_events.transferred('disk', 1024)
+
+
+class ProgressEventsTestCase(test.TestCase):
+    def setUp(self):
+        super(ProgressEventsTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'events.jsonl')
+        progress_events.configure(self.path)
+
+    def tearDown(self):
+        progress_events.configure(None)
+        shutil.rmtree(self.tmp_dir)
+        super(ProgressEventsTestCase, self).tearDown()
+
+    def events(self):
+        return list(progress_events.read_file(self.path))
+
+    def test_scheduler_tasks(self):
+        noop = Noop()
+        s = scheduler.Scheduler(migration=cursor.Cursor(noop >> Fail()))
+        s.start()
+
+        self.assertEqual(
+            [progress_events.TASK_STARTED, progress_events.TASK_FINISHED,
+             progress_events.TASK_STARTED, progress_events.TASK_FAILED],
+            [e['event'] for e in self.events()])
+        self.assertEqual(repr(noop), self.events()[0]['task'])
+
+    def test_log_step_listener(self):
+        copy_step()
+
+        events = self.events()
+        self.assertEqual(
+            [progress_events.STEP_STARTED, progress_events.TRANSFERRED,
+             progress_events.STEP_FINISHED],
+            [e['event'] for e in events])
+        self.assertEqual('copy_step', events[0]['step'])
+        self.assertEqual(1024, events[1]['bytes'])
+
+    def test_configure_none_disables_events(self):
+        listeners = len(utils.stack_call_functions.listeners)
+        progress_events.configure(None)
+        copy_step()
+
+        self.assertFalse(progress_events.enabled())
+        self.assertEqual(listeners - 1,
+                         len(utils.stack_call_functions.listeners))
+        self.assertEqual([], self.events())
+
+    def test_socket(self):
+        socket_path = os.path.join(self.tmp_dir, 'events.sock')
+        # nobody listens yet
+        progress_events.configure(progress_events.UNIX_PREFIX + socket_path)
+        progress_events.transferred('disk', 1)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        server.bind(socket_path)
+        try:
+            progress_events.progress('instances', 1, 2)
+            event = progress_events.parse(server.recv(4096))
+        finally:
+            server.close()
+
+        self.assertEqual('instances', event['resource'])
+        self.assertEqual((1, 2), (event['done'], event['total']))
+
+
+class ProgressTrackerTestCase(test.TestCase):
+    def test_summary(self):
+        tracker = progress_events.ProgressTracker(rate_window=10)
+        events = [
+            {'event': 'task_started', 'task': 'A', 'pid': 1, 'ts': 0},
+            {'event': 'progress', 'resource': 'instances', 'done': 0,
+             'total': 4, 'failed': 0, 'ts': 0},
+            {'event': 'transferred', 'bytes': 1000, 'ts': 5},
+            {'event': 'transferred', 'bytes': 3000, 'ts': 18},
+            {'event': 'progress', 'resource': 'instances', 'done': 1,
+             'total': 4, 'failed': 1, 'ts': 20},
+            {'event': 'task_started', 'task': 'B', 'pid': 2, 'ts': 20},
+            {'event': 'task_finished', 'task': 'A', 'pid': 1, 'ts': 20},
+            {'event': 'malformed'},
+        ]
+        for event in events:
+            tracker.update(event)
+
+        self.assertEqual(20, tracker.elapsed())
+        self.assertEqual(4000, tracker.bytes)
+        self.assertEqual(200, tracker.throughput())
+        self.assertEqual(300, tracker.current_rate())
+        self.assertEqual(['B'], tracker.running.values())
+        summary = tracker.summary()
+        self.assertIn("tasks finished 1, failed 0, running 1", summary)
+        self.assertIn("instances: 1 of 4 done, 1 failed, ETA 0:01:00",
+                      summary)
+
+    def test_tail_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'events.jsonl')
+            with open(path, 'w') as events_file:
+                events_file.write('{"event": "transferred", "bytes": 10, '
+                                  '"ts": 1}\n{"event": "transf')
+            out = StringIO.StringIO()
+
+            tracker = progress_events.tail(path, follow=False, out=out)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(10, tracker.bytes)
+        self.assertIn("Transferred 10.0B", out.getvalue())
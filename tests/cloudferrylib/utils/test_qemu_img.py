@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+
 import mock
 from mock import patch
 
@@ -135,3 +137,134 @@ class QemuImgCommandsTestCase(test.TestCase):
         actual_backing = qi.detect_backing_file(ephemeral, host)
 
         self.assertEqual(expected_backing, actual_backing)
+
+    def test_virtual_size_gets_parsed(self):
+        qemu_img_output = """
+        image: disk
+        file format: qcow2
+        virtual size: 39M (41126400 bytes)
+        disk size: 712K
+        """
+
+        actual = qemu_img.QemuImgInfoParser(qemu_img_output).virtual_size()
+
+        self.assertEqual(41126400, actual)
+
+
+class NbdStreamTestCase(test.TestCase):
+    def test_disk_is_converted_while_served(self):
+        serve = qemu_img.nbd_serve_cmd('rbd:compute/disk', 9000, fmt='raw')
+        convert = qemu_img.ssh_forward_cmd(
+            'localhost', qemu_img.nbd_convert_cmd('qcow2', '/disk', 9000),
+            9000, options='-p 9990')
+
+        cmd = qemu_img.nbd_stream_cmd(serve, convert, 9000)
+
+        self.assertEqual(
+            "qemu-nbd -r -f raw -b 127.0.0.1 -p 9000 rbd:compute/disk & "
+            "NBD=$!; " + qemu_img.nbd_wait_cmd(9000) + " && "
+            "ssh -oStrictHostKeyChecking=no "
+            "-oExitOnForwardFailure=yes -p 9990 -R 9000:127.0.0.1:9000 "
+            "localhost 'qemu-img convert -f raw -O qcow2 "
+            "nbd:127.0.0.1:9000 /disk'; RC=$?; kill $NBD 2>/dev/null; "
+            "wait $NBD; exit $RC", cmd)
+
+    def test_wait_polls_until_listening(self):
+        self.assertEqual(
+            "for i in $(seq 3); do ss -ltn sport = :9000 | grep -q LISTEN "
+            "&& break; kill -0 $NBD 2>/dev/null || break; sleep 0.5; done; "
+            "ss -ltn sport = :9000 | grep -q LISTEN || "
+            "{ echo \"qemu-nbd is not listening on port 9000\" >&2; false; }",
+            qemu_img.nbd_wait_cmd(9000, attempts=3))
+
+    def test_wait_checks_remote_host(self):
+        self.assertIn(
+            "ssh -oStrictHostKeyChecking=no compute1 "
+            "'ss -ltn sport = :9000 | grep -q LISTEN' && break",
+            qemu_img.nbd_wait_cmd(9000, host='compute1'))
+
+    def test_existing_image_is_written_without_create(self):
+        self.assertEqual(
+            "qemu-img convert -n -f raw -O raw nbd:127.0.0.1:9000 rbd:c/d",
+            qemu_img.nbd_convert_cmd('raw', 'rbd:c/d', 9000, create=False))
+
+
+def qemu_img_json(backing_file=None):
+    info = {"virtual-size": 1073741824, "filename": "disk",
+            "format": "qcow2"}
+    if backing_file:
+        info["backing-filename"] = backing_file
+    return json.dumps(info)
+
+
+class ImageInfoCacheTestCase(test.TestCase):
+    def setUp(self):
+        super(ImageInfoCacheTestCase, self).setUp()
+        self.cache = qemu_img.ImageInfoCache()
+        self.execute = mock.Mock()
+
+    def lookup(self, *outputs):
+        self.execute.side_effect = outputs
+        return [self.cache.lookup(self.execute, 'host', ['disk'])['disk']
+                for _ in outputs]
+
+    def test_info_is_reused_while_image_is_not_changed(self):
+        first, second = self.lookup('100:512 200\n' + qemu_img_json('base'),
+                                    '100:512 200\n')
+
+        self.assertEqual('base', first.backing_file)
+        self.assertIs(first, second)
+        self.assertIn('"$S" = "100:512"', self.execute.call_args[0][0])
+
+    def test_info_of_changed_image_is_read_again(self):
+        first, second = self.lookup('100:512 200\n' + qemu_img_json('base'),
+                                    '300:512 400\n' + qemu_img_json())
+
+        self.assertEqual('base', first.backing_file)
+        self.assertIsNone(second.backing_file)
+
+    def test_recently_modified_image_is_not_cached(self):
+        self.lookup('100:512 101\n' + qemu_img_json(), '100:512 101\n')
+
+        self.assertIn('"$S" = "-"', self.execute.call_args[0][0])
+
+    def test_info_of_not_files_is_not_cached(self):
+        first, second = self.lookup(' 200\n' + qemu_img_json(), ' 200\n')
+
+        self.assertEqual(1073741824, first.virtual_size)
+        self.assertIsNone(second)
+
+    def test_human_readable_output_is_parsed(self):
+        [info] = self.lookup('100:512 200\nimage: disk\nfile format: raw\n'
+                             'virtual size: 39M (41126400 bytes)\n')
+
+        self.assertEqual('raw', info.format)
+        self.assertEqual(41126400, info.virtual_size)
+
+    def test_invalidate_drops_image_and_backing_file(self):
+        self.execute.side_effect = ['100:512 200\n' + qemu_img_json('base'),
+                                    '100:512 200\n' + qemu_img_json()]
+        self.cache.lookup(self.execute, 'host', ['disk'])
+        self.cache.lookup(self.execute, 'host', ['base'])
+
+        self.cache.invalidate('host', 'disk')
+
+        self.assertEqual({}, self.cache.images)
+
+    @mock.patch('cloudferrylib.utils.remote_batch.run')
+    def test_many_images_are_read_in_one_call(self, batch_run):
+        batch_run.return_value = ['100:512 200\n' + qemu_img_json(),
+                                  '100:512 200\n' + qemu_img_json('disk1')]
+
+        infos = self.cache.lookup(self.execute, 'host', ['disk1', 'disk2'])
+
+        self.assertEqual(1, batch_run.call_count)
+        self.assertEqual('disk1', infos['disk2'].backing_file)
+
+    def test_backing_chain(self):
+        self.execute.side_effect = ['100:512 200\n' + qemu_img_json('base'),
+                                    '100:512 200\n' + qemu_img_json()]
+
+        chain = self.cache.backing_chain(self.execute, 'host', 'disk')
+
+        self.assertEqual(['disk', 'base'], [path for path, _ in chain])
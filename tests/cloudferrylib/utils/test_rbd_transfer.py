@@ -0,0 +1,115 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import threading
+import time
+
+import mock
+
+from cloudferrylib.scheduler import executor
+from cloudferrylib.utils import rbd_transfer
+
+from tests import test
+
+
+class FakeDriver(object):
+    """Copies images in threads, tracks streams running per pool"""
+
+    def __init__(self, failures=None, delays=None):
+        self.failures = dict(failures or {})
+        self.delays = dict(delays or {})
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+        self.copied = []
+
+    def rbd_endpoints(self, data):
+        return [('ceph', data['path_src'])]
+
+    def transfer(self, data):
+        pool = rbd_transfer.pool_of(data['path_src'])
+        with self.lock:
+            if self.failures.get(data['path_src']):
+                self.failures[data['path_src']] -= 1
+                raise RuntimeError("rbd: import-diff failed")
+            self.running[pool] = self.running.get(pool, 0) + 1
+            self.max_running[pool] = max(self.max_running.get(pool, 0),
+                                         self.running[pool])
+        time.sleep(self.delays.get(data['path_src'], 0.01))
+        with self.lock:
+            self.running[pool] -= 1
+            self.copied.append(data['path_src'])
+        return 100
+
+
+class RbdTransferEngineTestCase(test.TestCase):
+    def setUp(self):
+        super(RbdTransferEngineTestCase, self).setUp()
+        self.cfg = mock.Mock()
+        self.cfg.migrate.rbd_parallelism = 4
+        self.cfg.migrate.rbd_pool_streams = 2
+        self.cfg.migrate.rbd_host_streams = 0
+        self.cfg.migrate.retry = 1
+
+    def run_engine(self, driver, paths):
+        engine = rbd_transfer.RbdTransferEngine(
+            driver, self.cfg, executor=executor.ThreadExecutor())
+        return engine.run([{'path_src': p, 'path_dst': p} for p in paths])
+
+    def test_streams_per_pool_are_limited(self):
+        driver = FakeDriver()
+        paths = ['volumes/v%d' % i for i in xrange(6)] + ['compute/e1']
+
+        metrics = self.run_engine(driver, paths)
+
+        self.assertEqual(sorted(paths), sorted(driver.copied))
+        self.assertEqual(2, driver.max_running['volumes'])
+        self.assertEqual(7, metrics['images'])
+        self.assertEqual(700, metrics['bytes'])
+
+    def test_failed_image_is_retried(self):
+        driver = FakeDriver(failures={'volumes/v1': 1})
+
+        metrics = self.run_engine(driver, ['volumes/v1', 'volumes/v2'])
+
+        self.assertEqual(1, metrics['retries'])
+        self.assertEqual(2, metrics['images'])
+
+    def test_error_is_raised_after_retries(self):
+        driver = FakeDriver(failures={'volumes/v1': 2})
+
+        self.assertRaises(RuntimeError, self.run_engine, driver,
+                          ['volumes/v1', 'volumes/v2'])
+
+    def test_slow_image_does_not_block_others(self):
+        self.cfg.migrate.rbd_parallelism = 2
+        self.cfg.migrate.rbd_pool_streams = 0
+        driver = FakeDriver(delays={'volumes/slow': 0.5})
+
+        self.run_engine(driver, ['volumes/slow', 'volumes/v1', 'volumes/v2',
+                                 'volumes/v3'])
+
+        self.assertEqual('volumes/slow', driver.copied[-1])
+
+    def test_image_is_not_retried_if_driver_forbids(self):
+        driver = FakeDriver(failures={'volumes/v1': 1})
+        driver.retriable = lambda data: False
+
+        self.assertRaises(RuntimeError, self.run_engine, driver,
+                          ['volumes/v1'])
+        self.assertEqual(0, driver.failures['volumes/v1'])
+
+    def test_pool_of_path(self):
+        self.assertEqual('volumes', rbd_transfer.pool_of('volumes/v1'))
+        self.assertEqual('rbd', rbd_transfer.pool_of('v1'))
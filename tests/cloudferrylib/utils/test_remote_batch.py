@@ -0,0 +1,90 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import subprocess
+
+import mock
+
+from cloudferrylib.utils import remote_batch
+from cloudferrylib.utils import remote_runner
+
+from tests import test
+
+
+def local_bash(script):
+    return subprocess.check_output(['bash', '-c', script])
+
+
+class RemoteBatchTestCase(test.TestCase):
+    def test_results_of_commands(self):
+        commands = ['echo one; echo two', 'echo error >&2; exit 3',
+                    "echo '$HOME \"quoted\"'", 'true']
+
+        results = list(remote_batch.run(local_bash, commands))
+
+        self.assertEqual(['one\ntwo', '', '$HOME "quoted"', ''], results)
+        self.assertEqual([0, 3, 0, 0], [r.return_code for r in results])
+        self.assertEqual('error', results[1].stderr)
+        self.assertTrue(results[1].failed)
+        self.assertEqual(commands, [r.command for r in results])
+
+    def test_commands_are_run_in_portions(self):
+        execute = mock.Mock(side_effect=local_bash)
+
+        results = remote_batch.run(execute, ['echo %d' % i for i in xrange(5)],
+                                   batch_size=2)
+
+        self.assertEqual('0', next(results))
+        self.assertEqual(1, execute.call_count)
+        self.assertEqual(['1', '2', '3', '4'], list(results))
+        self.assertEqual(3, execute.call_count)
+
+    def test_missing_result(self):
+        results = list(remote_batch.run(lambda script: '', ['true']))
+
+        self.assertIsNone(results[0].return_code)
+        self.assertTrue(results[0].failed)
+
+
+@mock.patch('cloudferrylib.utils.remote_runner.cfglib')
+@mock.patch.object(remote_runner.RemoteRunner, 'run')
+class RemoteRunnerBatchTestCase(test.TestCase):
+    def test_run_batch(self, run, cfg):
+        run.side_effect = local_bash
+        rr = remote_runner.RemoteRunner('host', 'user', key='key')
+
+        self.assertEqual(['a', 'b'], rr.run_batch(['echo a', 'echo b']))
+        self.assertEqual(1, run.call_count)
+
+    def test_failed_command_raises_error(self, run, cfg):
+        run.side_effect = local_bash
+        rr = remote_runner.RemoteRunner('host', 'user', key='key')
+
+        self.assertRaises(remote_runner.RemoteExecutionError, rr.run_batch,
+                          ['true', 'false'])
+
+        rr.ignore_errors = True
+        self.assertEqual([True, False],
+                         [r.succeeded for r in rr.run_batch(['true',
+                                                             'false'])])
+
+    def test_repeat_on_errors(self, run, cfg):
+        cfg.CONF.migrate.ssh_connection_attempts = 3
+        run.side_effect = local_bash
+        rr = remote_runner.RemoteRunner('host', 'user', key='key')
+
+        self.assertRaises(remote_runner.RemoteExecutionError, rr.run_batch,
+                          ['true', 'false'], repeat_on_errors=True)
+        # batch and two retries of failed command
+        self.assertEqual(3, run.call_count)
@@ -0,0 +1,56 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import os
+import subprocess
+import tempfile
+
+from cloudferrylib.utils import sparse_file
+
+from tests import test
+
+MB = sparse_file.MB
+
+
+class ExtentsTestCase(test.TestCase):
+    def test_holes_are_not_in_extents(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(os.urandom(100))
+            f.seek(5 * MB)
+            f.write(os.urandom(100))
+            f.truncate(10 * MB)
+            f.flush()
+
+            output = subprocess.check_output(
+                "bash -c '{0}'".format(sparse_file.extents_cmd(f.name)),
+                shell=True)
+
+        size, extents = sparse_file.parse_extents(output)
+        self.assertEqual(10 * MB, size)
+        self.assertEqual([0, 5], sparse_file.blocks_with_data(extents, MB))
+
+    def test_data_ranges(self):
+        extents = [(0, 100), (MB + 10, 10), (5 * MB, 3 * MB + 1)]
+
+        self.assertEqual([(0, 2), (5, 4)],
+                         sparse_file.data_ranges(extents, 10 * MB, MB))
+        self.assertEqual([(0, 9)],
+                         sparse_file.data_ranges(extents, 10 * MB, 4 * MB))
+        # last extent is cut by file size
+        self.assertEqual([(0, 2), (5, 3)],
+                         sparse_file.data_ranges(extents, 8 * MB, MB))
+
+    def test_blocks_with_data(self):
+        self.assertEqual([0, 2, 3], sparse_file.blocks_with_data(
+            [(0, 1), (2 * MB, MB + 1), (5 * MB, 0)], MB))
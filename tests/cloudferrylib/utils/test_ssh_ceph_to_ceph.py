@@ -0,0 +1,184 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import json
+
+import mock
+
+from cloudferrylib.utils.drivers import ssh_ceph_to_ceph
+
+from tests import test
+
+MB = 1024 * 1024
+
+
+class FakeRbd(object):
+    """Answers `rbd diff` with diffs of given sizes, records commands"""
+
+    def __init__(self, diff_sizes):
+        self.diff_sizes = list(diff_sizes)
+        self.commands = []
+
+    def __call__(self, cmd, ignore_errors=False):
+        cmd = str(cmd)
+        self.commands.append(cmd)
+        if 'rbd diff' in cmd:
+            return json.dumps([{'offset': 0, 'exists': 'true',
+                                'length': self.diff_sizes.pop(0)}])
+        return ''
+
+    def find(self, part):
+        return [c for c in self.commands if part in c]
+
+
+class PreCopyTestCase(test.TestCase):
+    def setUp(self):
+        super(PreCopyTestCase, self).setUp()
+        cfg = mock.Mock()
+        cfg.migrate.ceph_precopy_max_rounds = 5
+        cfg.migrate.ceph_precopy_cutover_size = 64
+        self.src_cloud = mock.Mock()
+        self.driver = ssh_ceph_to_ceph.SSHCephToCeph(self.src_cloud,
+                                                     mock.Mock(), cfg)
+        self.data = {'path_src': 'compute/id_disk.local',
+                     'host_src': 'src-ceph',
+                     'path_dst': 'compute/new_disk.local',
+                     'host_dst': 'dst-ceph'}
+        patcher = mock.patch('cloudferrylib.utils.utils.forward_agent')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def precopy(self, diff_sizes):
+        self.rbd = FakeRbd(diff_sizes)
+        self.src_cloud.ssh_util.execute.side_effect = self.rbd
+        return self.driver.precopy(self.data, 'compute/id_disk.local.precopy')
+
+    def test_rounds_stop_when_diff_is_small(self):
+        state = self.precopy([1024 * MB, 200 * MB, 10 * MB])
+
+        self.assertEqual([1024 * MB, 200 * MB, 10 * MB], state['rounds'])
+        self.assertEqual('cloudferry-precopy-2', state['snapshot'])
+        self.assertEqual('compute/id_disk.local.precopy', state['path'])
+        [first, second, _] = self.rbd.find('export-diff')
+        self.assertNotIn('--from-snap', first)
+        self.assertIn('--from-snap cloudferry-precopy-0 '
+                      '--snap cloudferry-precopy-1', second)
+        self.assertIn('import-diff - compute/id_disk.local.precopy', second)
+        # only the last snapshot is kept on both sides
+        self.assertEqual(4, len(self.rbd.find('snap rm')))
+
+    def test_rounds_stop_when_diff_does_not_shrink(self):
+        state = self.precopy([1024 * MB, 200 * MB, 300 * MB, 1 * MB])
+
+        self.assertEqual(3, len(state['rounds']))
+
+    def test_rounds_are_limited(self):
+        state = self.precopy([1024 * MB, 500 * MB, 400 * MB, 300 * MB,
+                              200 * MB, 100 * MB])
+
+        self.assertEqual(5, len(state['rounds']))
+
+    def test_snapshots_are_removed_if_copy_fails(self):
+        rbd = FakeRbd([1024 * MB])
+
+        def execute(cmd, ignore_errors=False):
+            if 'export-diff' in str(cmd):
+                raise RuntimeError("broken pipe")
+            return rbd(cmd, ignore_errors)
+        self.src_cloud.ssh_util.execute.side_effect = execute
+
+        self.assertRaises(RuntimeError, self.driver.precopy, self.data,
+                          'compute/id_disk.local.precopy')
+        self.assertEqual(2, len(rbd.find('snap rm')))
+        self.assertEqual(2, len(rbd.find('rbd rm compute/id_disk.local.'
+                                         'precopy')))
+
+    def test_transfer_ships_rest_and_replaces_destination(self):
+        self.data[ssh_ceph_to_ceph.PRECOPY] = {
+            'snapshot': 'cloudferry-precopy-1',
+            'path': 'compute/id_disk.local.precopy',
+            'rounds': [1024 * MB, 10 * MB]}
+        self.rbd = FakeRbd([MB])
+        self.src_cloud.ssh_util.execute.side_effect = self.rbd
+
+        self.driver.transfer(self.data)
+
+        [export] = self.rbd.find('export-diff')
+        self.assertIn('export-diff --from-snap cloudferry-precopy-1 '
+                      'compute/id_disk.local -', export)
+        self.assertIn('import-diff - compute/id_disk.local.precopy', export)
+        self.assertEqual(
+            "ssh -oStrictHostKeyChecking=no dst-ceph 'rbd mv "
+            "compute/id_disk.local.precopy compute/new_disk.local'",
+            self.rbd.commands[-1])
+        self.assertIn('rbd rm compute/new_disk.local',
+                      self.rbd.commands[-2])
+
+    def test_cutover_is_not_retriable(self):
+        self.assertTrue(self.driver.retriable(self.data))
+        self.data[ssh_ceph_to_ceph.PRECOPY] = {
+            'snapshot': 'cloudferry-precopy-1',
+            'path': 'compute/id_disk.local.precopy',
+            'rounds': [1024 * MB]}
+        self.assertFalse(self.driver.retriable(self.data))
+
+    def test_cleanup_removes_snapshots_and_staging_image(self):
+        self.rbd = FakeRbd([])
+        self.src_cloud.ssh_util.execute.side_effect = self.rbd
+
+        self.driver.cleanup(self.data, {
+            'snapshot': 'cloudferry-precopy-1',
+            'path': 'compute/id_disk.local.precopy',
+            'rounds': [1024 * MB]})
+
+        self.assertEqual(1, len(self.rbd.find(
+            'snap rm compute/id_disk.local@cloudferry-precopy-1')))
+        self.assertEqual(1, len(self.rbd.find(
+            'snap rm compute/id_disk.local.precopy@cloudferry-precopy-1')))
+        self.assertEqual(1, len(self.rbd.find(
+            'rbd rm compute/id_disk.local.precopy')))
+
+    def test_cleanup_keeps_image_copied_without_staging(self):
+        self.rbd = FakeRbd([])
+        self.src_cloud.ssh_util.execute.side_effect = self.rbd
+
+        self.driver.cleanup(self.data, {
+            'snapshot': 'cloudferry-precopy-1',
+            'path': 'compute/new_disk.local',
+            'rounds': [1024 * MB]})
+
+        self.assertEqual([], self.rbd.find('rbd rm'))
+
+    def test_destination_host_defaults_to_destination_cloud(self):
+        del self.data['host_dst']
+        self.driver.dst_cloud.getIpSsh.return_value = 'dst-cloud'
+        self.data[ssh_ceph_to_ceph.PRECOPY] = {
+            'snapshot': 'cloudferry-precopy-1',
+            'path': 'compute/id_disk.local.precopy',
+            'rounds': [1024 * MB]}
+        self.rbd = FakeRbd([MB])
+        self.src_cloud.ssh_util.execute.side_effect = self.rbd
+
+        self.driver.transfer(self.data)
+        self.driver.cleanup(self.data, self.data[ssh_ceph_to_ceph.PRECOPY])
+
+        for cmd in self.rbd.find('ssh '):
+            self.assertIn('dst-cloud', cmd)
+        self.assertIn('dst-cloud', self.rbd.commands[-1])
+
+    def test_diff_size_counts_existing_extents(self):
+        self.assertEqual(30, ssh_ceph_to_ceph.diff_size(json.dumps([
+            {'offset': 0, 'length': 10, 'exists': 'true'},
+            {'offset': 10, 'length': 5, 'exists': 'false'},
+            {'offset': 20, 'length': 20, 'exists': 'true'}])))
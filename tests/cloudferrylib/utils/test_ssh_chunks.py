@@ -0,0 +1,148 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import threading
+import time
+
+import mock
+
+from cloudferrylib.scheduler import executor
+from cloudferrylib.utils import remote_runner
+from cloudferrylib.utils.drivers import ssh_chunks
+
+from tests import test
+
+
+class ChunksInFlightTestCase(test.TestCase):
+    def test_limited_by_parallelism(self):
+        self.assertEqual(3, ssh_chunks.chunks_in_flight(3, 0, 100))
+        self.assertEqual(1, ssh_chunks.chunks_in_flight(0, 0, 100))
+
+    def test_limited_by_temp_space(self):
+        self.assertEqual(2, ssh_chunks.chunks_in_flight(4, 250, 100))
+        self.assertEqual(1, ssh_chunks.chunks_in_flight(4, 50, 100))
+
+    def test_limited_by_memory(self):
+        self.assertEqual(2, ssh_chunks.chunks_in_flight(4, 0, 100, 200))
+        self.assertEqual(1, ssh_chunks.chunks_in_flight(4, 1000, 100, 150))
+
+
+def make_chunk(index=0, num_retries=2):
+    return ssh_chunks.ChunkCopy(mock.Mock(), mock.Mock(), 'user', 'dst',
+                                '/src/disk', '/dst/disk', '/src/tmp',
+                                '/dst/tmp', index, 100, 250, num_retries)
+
+
+@mock.patch('cloudferrylib.utils.drivers.ssh_chunks.remote_unzip_join')
+@mock.patch('cloudferrylib.utils.drivers.ssh_chunks.verified_file_copy')
+@mock.patch('cloudferrylib.utils.drivers.ssh_chunks.remote_split_gzip')
+class ChunkCopyTestCase(test.TestCase):
+    def test_chunk_is_joined_at_its_offset(self, split, copy, join):
+        split.return_value = join.return_value = ['a' * 32]
+        chunk = make_chunk(index=2)
+        chunk.src_runner.run.return_value = '10'
+
+        self.assertEqual(('a' * 32, 10), chunk())
+
+        self.assertEqual(50, chunk.size)
+        split.assert_called_once_with(chunk.src_runner, '/src/disk',
+                                      '/src/tmp/disk.part2.gz', 2, 100,
+                                      level=ssh_chunks.GZIP_LEVEL)
+        copy.assert_called_once_with(chunk.src_runner, chunk.dst_runner,
+                                     'user', '/src/tmp/disk.part2.gz',
+                                     '/dst/tmp/disk.part2.gz', 'dst', 2,
+                                     rate=None)
+        join.assert_called_once_with(chunk.dst_runner, '/dst/disk',
+                                     '/dst/tmp/disk.part2.gz', 2, 100,
+                                     sparse=False, compressed=True)
+
+    def test_failed_chunk_is_retried(self, split, copy, join):
+        split.return_value = ['a' * 32]
+        join.side_effect = [remote_runner.RemoteExecutionError, ['a' * 32]]
+        chunk = make_chunk()
+        chunk.src_runner.run.return_value = '10'
+
+        chunk()
+
+        self.assertEqual(2, copy.call_count)
+        self.assertEqual(2, join.call_count)
+        self.assertTrue(chunk.dst_runner.run_ignoring_errors.called)
+
+    def test_failed_network_copy_is_not_retried_again(self, split, copy,
+                                                      join):
+        split.return_value = ['a' * 32]
+        copy.side_effect = ssh_chunks.FileCopyFailure
+        chunk = make_chunk()
+        chunk.src_runner.run.return_value = '10'
+
+        self.assertRaises(ssh_chunks.FileCopyFailure, chunk)
+        self.assertEqual(1, copy.call_count)
+        self.assertFalse(join.called)
+
+    def test_chunk_with_mismatched_checksum_is_resent(self, split, copy,
+                                                      join):
+        split.return_value = ['a' * 32]
+        join.side_effect = [['b' * 32], ['a' * 32]]
+        chunk = make_chunk()
+        chunk.src_runner.run.return_value = '10'
+
+        self.assertEqual(('a' * 32, 10), chunk())
+        self.assertEqual(2, copy.call_count)
+
+    def test_retry_limit(self, split, copy, join):
+        split.side_effect = remote_runner.RemoteExecutionError
+        chunk = make_chunk(num_retries=1)
+
+        self.assertRaises(remote_runner.RemoteExecutionError, chunk)
+        self.assertEqual(2, chunk.src_runner.run_ignoring_errors.call_count)
+        self.assertFalse(copy.called)
+
+
+class RunPipelineTestCase(test.TestCase):
+    def test_number_of_chunks_in_flight_is_limited(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'max': 0}
+        done = []
+
+        def chunk(i):
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+                done.append(i)
+
+        results = ssh_chunks.run_pipeline(
+            [lambda i=i: chunk(i) or i for i in xrange(6)], 2,
+            executor.ThreadExecutor())
+
+        self.assertEqual(range(6), results)
+        self.assertEqual(range(6), sorted(done))
+        self.assertEqual(2, state['max'])
+
+    def test_error_is_raised_after_running_chunks_finished(self):
+        done = []
+
+        def fail():
+            raise ssh_chunks.FileCopyFailure()
+
+        def chunk():
+            time.sleep(0.01)
+            done.append(True)
+
+        self.assertRaises(ssh_chunks.FileCopyFailure,
+                          ssh_chunks.run_pipeline, [fail, chunk, chunk], 2,
+                          executor.ThreadExecutor())
+        self.assertEqual([True], done)
@@ -0,0 +1,190 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+import mock
+
+from cloudferrylib.utils import remote_runner
+from cloudferrylib.utils import stream_checksum
+from cloudferrylib.utils.drivers import ssh_file_to_file
+
+from tests import test
+
+MB = 1024 * 1024
+
+
+def local_execute(cmd):
+    """Runs command locally, stands in for both ssh hosts"""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['bash', '-c', str(cmd)],
+                                           stderr=devnull)
+    except subprocess.CalledProcessError as e:
+        raise remote_runner.RemoteExecutionError(str(e))
+
+
+class DeltaCopyTestCase(test.TestCase):
+    def setUp(self):
+        super(DeltaCopyTestCase, self).setUp()
+        self.src_dir = tempfile.mkdtemp()
+        self.dst_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.src_dir, 'disk')
+        self.dst = os.path.join(self.dst_dir, 'disk')
+        self.data = os.urandom(3 * MB + 1000)
+        with open(self.src, 'wb') as f:
+            f.write(self.data)
+
+        cfg = mock.Mock()
+        cfg.migrate.ssh_delta_sync = True
+        cfg.migrate.ssh_delta_block_size = 1
+        cfg.migrate.ssh_chunk_size = 2
+        cfg.migrate.retry = 1
+        cfg.migrate.file_compression = 'gzip'
+        cfg.migrate.level_compression = 1
+        self.driver = ssh_file_to_file.SSHFileToFile(mock.Mock(),
+                                                     mock.Mock(), cfg)
+        self.execute = mock.Mock(side_effect=local_execute)
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+        shutil.rmtree(self.dst_dir)
+        super(DeltaCopyTestCase, self).tearDown()
+
+    def copy(self):
+        stream = self.driver.file_stream(
+            {'path_src': self.src, 'path_dst': self.dst},
+            lambda cmd: cmd, lambda cmd: cmd, self.execute)
+        return self.driver.copy(stream)
+
+    def assertCopied(self):
+        with open(self.dst, 'rb') as f:
+            self.assertEqual(self.data, f.read())
+
+    def test_whole_file_is_sent_to_empty_destination(self):
+        stats = self.copy()
+
+        self.assertCopied()
+        self.assertEqual({'transferred': len(self.data), 'skipped': 0},
+                         stats)
+
+    def test_only_changed_blocks_are_sent(self):
+        dst_data = bytearray(self.data)
+        dst_data[MB + 10] ^= 0xff
+        with open(self.dst, 'wb') as f:
+            f.write(dst_data + b'tail')
+
+        stats = self.copy()
+
+        self.assertCopied()
+        # second block and last one, which has extra data on destination
+        self.assertEqual({'transferred': MB + 1000,
+                          'skipped': 2 * MB}, stats)
+
+    def test_zeroed_block_is_written_with_sparse_transfer(self):
+        self.driver.cfg.migrate.ssh_sparse_transfer = True
+        with open(self.dst, 'wb') as f:
+            f.write(self.data)
+        self.data = self.data[:MB] + b'\0' * MB + self.data[2 * MB:]
+        with open(self.src, 'wb') as f:
+            f.write(self.data)
+
+        stats = self.copy()
+
+        self.assertCopied()
+        self.assertEqual(MB, stats['transferred'])
+
+    def test_failed_range_is_resent(self):
+        failures = []
+
+        def execute(cmd):
+            if 'gunzip' in str(cmd) and not failures:
+                failures.append(cmd)
+                raise remote_runner.RemoteExecutionError("connection lost")
+            return local_execute(cmd)
+
+        self.execute.side_effect = execute
+
+        self.copy()
+
+        self.assertCopied()
+        self.assertEqual(1, len(failures))
+
+    def test_interrupted_copy_is_resumed(self):
+        copies = []
+
+        def execute(cmd):
+            if 'gunzip' in str(cmd):
+                copies.append(cmd)
+                if len(copies) > 1:
+                    raise remote_runner.RemoteExecutionError("broken pipe")
+            return local_execute(cmd)
+
+        self.execute.side_effect = execute
+        self.assertRaises(stream_checksum.ChecksumMismatch, self.copy)
+
+        self.execute.side_effect = local_execute
+        stats = self.copy()
+
+        self.assertCopied()
+        # first range of 2 blocks was copied before copy was interrupted
+        self.assertEqual(2 * MB, stats['skipped'])
+
+
+class SparseCopyTestCase(test.TestCase):
+    def setUp(self):
+        super(SparseCopyTestCase, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.temp_dir, 'src')
+        self.dst = os.path.join(self.temp_dir, 'dst')
+        self.first = os.urandom(MB)
+        self.second = os.urandom(1000)
+        with open(self.src, 'wb') as f:
+            f.write(self.first)
+            f.seek(6 * MB)
+            f.write(self.second)
+            f.truncate(8 * MB)
+
+        cfg = mock.Mock()
+        cfg.migrate.ssh_delta_sync = False
+        cfg.migrate.ssh_sparse_transfer = True
+        cfg.migrate.ssh_sparse_min_hole = 1
+        cfg.migrate.ssh_chunk_size = 2
+        cfg.migrate.retry = 1
+        cfg.migrate.file_compression = 'dd'
+        self.driver = ssh_file_to_file.SSHFileToFile(mock.Mock(),
+                                                     mock.Mock(), cfg)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super(SparseCopyTestCase, self).tearDown()
+
+    def test_only_data_is_sent(self):
+        with open(self.dst, 'wb') as f:
+            f.write(os.urandom(9 * MB))
+        stream = self.driver.file_stream(
+            {'path_src': self.src, 'path_dst': self.dst},
+            lambda cmd: cmd, lambda cmd: cmd, local_execute)
+
+        stats = self.driver.copy(stream)
+
+        with open(self.dst, 'rb') as f:
+            self.assertEqual(self.first + b'\0' * 5 * MB + self.second +
+                             b'\0' * (2 * MB - 1000), f.read())
+        self.assertEqual(2 * MB, stats['transferred'])
+        self.assertEqual(6 * MB, stats['skipped'])
+        self.assertTrue(stats['disk_usage'] < 8 * MB)
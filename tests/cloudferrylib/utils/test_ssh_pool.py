@@ -0,0 +1,114 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import mock
+
+from fabric import state
+
+from cloudferrylib.utils import ssh_pool
+
+from tests import test
+
+
+@mock.patch('cloudferrylib.utils.ssh_pool.network.connect')
+class SshConnectionPoolTestCase(test.TestCase):
+    def setUp(self):
+        super(SshConnectionPoolTestCase, self).setUp()
+        self.pool = ssh_pool.SshConnectionPool(idle_timeout=60)
+
+    def tearDown(self):
+        self.pool.close_all()
+        super(SshConnectionPoolTestCase, self).tearDown()
+
+    def test_connection_is_reused(self, connect):
+        for _ in xrange(3):
+            with self.pool.connection('host1', 'user') as client:
+                self.assertIs(client, state.connections['user@host1'])
+
+        self.assertEqual(1, connect.call_count)
+        self.assertEqual({'handshakes': 1, 'reused': 2, 'evicted': 0,
+                          'open': 1}, self.pool.metrics())
+
+    def test_connections_are_keyed_by_host_user_and_gateway(self, connect):
+        connect.side_effect = lambda *args, **kwargs: mock.Mock()
+        clients = set()
+        for key in (('host1', 'user', None), ('host1', 'root', None),
+                    ('host1', 'user', 'gw'), ('host2', 'user', None)):
+            with self.pool.connection(*key) as client:
+                clients.add(client)
+
+        self.assertEqual(4, len(clients))
+        self.assertTrue(connect.call_args[1]['seek_gateway'] is False)
+
+    def test_idle_connections_are_evicted(self, connect):
+        with self.pool.connection('host1', 'user') as client:
+            # connection in use is never evicted
+            self.pool.evict_idle(now=self.pool.connections.values()[0]
+                                 .last_used + 120)
+            self.assertEqual(1, len(self.pool.connections))
+        self.pool.evict_idle(now=self.pool.connections.values()[0]
+                             .last_used + 120)
+
+        self.assertEqual(0, len(self.pool.connections))
+        self.assertEqual(1, self.pool.metrics()['evicted'])
+        client.close.assert_called_once_with()
+
+    def test_evicted_client_is_removed_from_fabric_cache(self, connect):
+        connect.side_effect = lambda *args, **kwargs: mock.Mock()
+        with self.pool.connection('host1', 'user', 'gw'):
+            pass
+        with self.pool.connection('host1', 'user') as client:
+            pass
+        with self.pool.connection('host2', 'user'):
+            pass
+        now = max(c.last_used for c in self.pool.connections.values())
+
+        self.pool.evict_idle(now=now + 120)
+
+        # connection through gateway was replaced in fabric cache by the
+        # direct one, both are removed
+        self.assertNotIn('user@host1', state.connections)
+        self.assertNotIn('user@host2', state.connections)
+        self.assertTrue(client.close.called)
+
+    def test_client_of_other_connection_is_kept(self, connect):
+        connect.side_effect = lambda *args, **kwargs: mock.Mock()
+        with self.pool.connection('host1', 'user', 'gw'):
+            pass
+        with self.pool.connection('host1', 'user') as client:
+            pass
+        self.pool.connections[('host1', 'user', None)].users += 1
+
+        self.pool.evict_idle(now=2 ** 31)
+
+        self.assertIs(client, state.connections['user@host1'])
+
+    def test_dead_connection_is_replaced(self, connect):
+        with self.pool.connection('host1', 'user') as client:
+            client.get_transport.return_value.is_active.return_value = False
+        with self.pool.connection('host1', 'user'):
+            pass
+
+        self.assertEqual(2, connect.call_count)
+
+    def test_connections_are_not_shared_with_forked_process(self, connect):
+        with self.pool.connection('host1', 'user') as client:
+            pass
+        self.pool.pid = -1
+
+        with self.pool.connection('host1', 'user'):
+            pass
+
+        self.assertEqual(2, connect.call_count)
+        self.assertFalse(client.close.called)
@@ -0,0 +1,120 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import time
+
+import mock
+
+from cloudferrylib.utils import ssh_tunnel
+
+from tests import test
+
+
+class TunnelPoolTestCase(test.TestCase):
+    def setUp(self):
+        super(TunnelPoolTestCase, self).setUp()
+        self.pool = ssh_tunnel.TunnelPool('9000-9001', idle_timeout=300)
+        patcher = mock.patch.object(ssh_tunnel.TunnelPool, 'run',
+                                    return_value=True)
+        self.run = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.pool.cleanup()
+        super(TunnelPoolTestCase, self).tearDown()
+
+    def commands(self):
+        return [c[0][1].split()[0] for c in self.run.call_args_list]
+
+    def test_tunnel_is_reused(self):
+        with self.pool.tunnel('compute', 'dst', 'src') as first:
+            pass
+        with self.pool.tunnel('compute', 'dst', 'src') as second:
+            pass
+
+        self.assertEqual(9000, first)
+        self.assertEqual(first, second)
+        self.assertEqual(['ssh'], self.commands())
+        self.assertEqual({'created': 1, 'reused': 1, 'recreated': 0,
+                          'evicted': 0, 'open': 1}, self.pool.metrics())
+
+    def test_tunnels_to_other_hosts_have_other_ports(self):
+        with self.pool.tunnel('compute-1', 'dst', 'src') as first, \
+                self.pool.tunnel('compute-2', 'dst', 'src') as second:
+            self.assertNotEqual(first, second)
+            self.assertRaises(ssh_tunnel.NoFreePort, self.pool.acquire,
+                              'compute-3', 'dst', 'src')
+
+    def test_dead_tunnel_is_restarted(self):
+        with self.pool.tunnel('compute', 'dst', 'src'):
+            pass
+        self.run.side_effect = lambda host, cmd: not cmd.startswith('pgrep')
+
+        later = time.time() + ssh_tunnel.HEALTH_CHECK_INTERVAL + 1
+        with mock.patch('time.time', return_value=later):
+            with self.pool.tunnel('compute', 'dst', 'src') as port:
+                pass
+
+        self.assertEqual(9000, port)
+        self.assertEqual(['ssh', 'pgrep', 'pkill', 'ssh'], self.commands())
+        self.assertEqual(1, self.pool.metrics()['recreated'])
+
+    def test_tunnel_in_use_is_not_evicted(self):
+        with self.pool.tunnel('busy', 'dst', 'src'):
+            with self.pool.tunnel('idle', 'dst', 'src'):
+                pass
+
+            self.pool.evict_idle(now=2 ** 31)
+
+            metrics = self.pool.metrics()
+            self.assertEqual(1, metrics['evicted'])
+            self.assertEqual(1, metrics['open'])
+        self.assertIn('idle', self.run.call_args[0][1])
+
+    def test_tunnel_is_stopped_after_transfer_without_idle_timeout(self):
+        self.pool.idle_timeout = 0
+
+        with self.pool.tunnel('compute', 'dst', 'src'):
+            pass
+
+        self.assertEqual(['ssh', 'pkill'], self.commands())
+        self.assertEqual(0, self.pool.metrics()['open'])
+
+    def test_users_of_dead_processes_are_dropped(self):
+        port = self.pool.acquire('compute', 'dst', 'src')
+        with self.pool.registry() as registry:
+            [tunnel] = registry['tunnels'].values()
+            tunnel['users'] = {str(2 ** 22 + 1): 1}
+
+        self.pool.evict_idle(now=2 ** 31)
+
+        self.assertEqual(9000, port)
+        self.assertEqual(0, self.pool.metrics()['open'])
+
+    def test_pattern_does_not_match_itself(self):
+        tunnel = {'port': 9000, 'compute': 'compute', 'controller': 'dst'}
+
+        pattern = ssh_tunnel.tunnel_pattern(tunnel)
+
+        self.assertTrue(pattern.startswith('[s]sh '))
+        self.assertNotIn("'", pattern)
+
+    def test_reserved_port_is_not_taken_by_tunnel(self):
+        with self.pool.reserved_port('nbd') as port:
+            with self.pool.tunnel('compute', 'dst', 'src') as tunnel_port:
+                self.assertNotEqual(port, tunnel_port)
+            self.assertEqual(1, self.pool.metrics()['open'])
+
+        with self.pool.reserved_port('nbd') as port:
+            self.assertEqual(9000, port)
@@ -0,0 +1,82 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import hashlib
+import os
+import subprocess
+import tempfile
+
+import mock
+
+from cloudferrylib.utils import stream_checksum
+
+from tests import test
+
+
+class HashTeeTestCase(test.TestCase):
+    def test_data_is_passed_and_chunks_are_hashed(self):
+        data = os.urandom(2500)
+        manifest = tempfile.mktemp()
+        # run inside single quotes as it is run inside ssh command
+        cmd = "bash -c '{0}'".format(stream_checksum.hash_tee(manifest,
+                                                              1000))
+        process = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE)
+        out, _ = process.communicate(data)
+
+        output = subprocess.check_output(
+            str(stream_checksum.read_manifest_cmd(manifest)), shell=True)
+
+        self.assertEqual(data, out)
+        self.assertEqual([hashlib.md5(data[i:i + 1000]).hexdigest()
+                          for i in (0, 1000, 2000)],
+                         stream_checksum.parse_manifest(output))
+        self.assertFalse(os.path.exists(manifest))
+
+
+class MismatchedChunksTestCase(test.TestCase):
+    def test_mismatched_and_missing_chunks(self):
+        self.assertEqual([1, 3], stream_checksum.mismatched_chunks(
+            ['a', 'b', 'c', 'd'], ['a', 'x', 'c']))
+        self.assertEqual([], stream_checksum.mismatched_chunks(['a'], ['a']))
+
+
+class ChunkRangesTestCase(test.TestCase):
+    def test_adjacent_chunks_are_joined(self):
+        self.assertEqual([(0, 2), (2, 1), (5, 2)],
+                         stream_checksum.chunk_ranges([0, 1, 2, 5, 6], 2))
+
+
+class VerifiedStreamCopyTestCase(test.TestCase):
+    def test_only_mismatched_chunk_is_resent(self):
+        copy = mock.Mock()
+        read_manifests = mock.Mock(side_effect=[
+            (['a', 'b', 'c'], ['a', 'x', 'c']),
+            (['b2'], ['y']),
+            (['b2'], ['b2'])])
+
+        manifest = stream_checksum.verified_stream_copy(
+            copy, read_manifests, 3, 'disk')
+
+        self.assertEqual([mock.call(None), mock.call(1), mock.call(1)],
+                         copy.call_args_list)
+        self.assertEqual(['a', 'b2', 'c'], manifest)
+
+    def test_error_after_retries(self):
+        read_manifests = mock.Mock(side_effect=[(['a'], ['x'])] +
+                                   [(['a'], ['y'])] * 2)
+
+        self.assertRaises(stream_checksum.ChecksumMismatch,
+                          stream_checksum.verified_stream_copy,
+                          mock.Mock(), read_manifests, 2, 'disk')
@@ -16,6 +16,7 @@ import mock
 
 from cloudferrylib.utils import utils
 from fabric.api import local
+from fabric import exceptions
 from tests import test
 
 
@@ -51,3 +52,31 @@ class forward_agentTestCase(test.TestCase):
         fa = utils.forward_agent(['test_key_1', 'test_key_2'])
 
         self.assertFalse(fa._agent_already_running())
+
+
+class GetLibvirtInstancesInfoTestCase(test.TestCase):
+    def get_info(self):
+        return utils.get_libvirt_instances_info(
+            ['instance-1', 'instance-2'], 'init', 'compute', 'user', 'pass')
+
+    @mock.patch('cloudferrylib.utils.utils.sudo')
+    def test_unreachable_host_has_no_instances(self, sudo):
+        sudo.side_effect = exceptions.NetworkError("Timed out")
+
+        self.assertEqual({}, self.get_info())
+
+    @mock.patch('cloudferrylib.utils.utils.sudo')
+    def test_failed_batch_has_no_instances(self, sudo):
+        sudo.return_value = 'sudo: no tty present'
+
+        self.assertEqual({}, self.get_info())
+
+
+class GetExtIpTestCase(test.TestCase):
+    @mock.patch('cloudferrylib.utils.utils.get_ips')
+    def test_passed_ips_are_used(self, get_ips):
+        ip = utils.get_ext_ip(['10.0.0.0/24'], 'init', 'compute', 'user',
+                              list_ips=['192.168.0.1', '10.0.0.5'])
+
+        self.assertEqual('10.0.0.5', ip)
+        self.assertFalse(get_ips.called)
@@ -0,0 +1,116 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+
+import mock
+
+from cloudferrylib.scheduler import action_registry
+
+from tests import test
+
+PACKAGE = 'fake_actions_package'
+
+ACTION_MODULE = """
+from cloudferrylib.base.action import action
+
+
+class %s(action.Action):
+    pass
+"""
+
+
+class ActionRegistryTestCase(test.TestCase):
+    def setUp(self):
+        super(ActionRegistryTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.package_dir = os.path.join(self.tmp_dir, PACKAGE)
+        os.mkdir(self.package_dir)
+        open(os.path.join(self.package_dir, '__init__.py'), 'w').close()
+        self.write_module('first', 'FirstAction')
+        self.write_module('second', 'SecondAction')
+        self.index_path = os.path.join(self.tmp_dir, 'index.json')
+        sys.path.insert(0, self.tmp_dir)
+        self.addCleanup(sys.path.remove, self.tmp_dir)
+        self.addCleanup(self.unload_modules)
+
+    def write_module(self, name, action_name):
+        with open(os.path.join(self.package_dir, name + '.py'), 'w') as f:
+            f.write(ACTION_MODULE % action_name)
+
+    @staticmethod
+    def unload_modules():
+        for name in list(sys.modules):
+            if name.startswith(PACKAGE):
+                del sys.modules[name]
+
+    def build_registry(self):
+        registry = action_registry.ActionRegistry(self.index_path)
+        registry.add_package(PACKAGE)
+        registry.save()
+        return registry
+
+    def test_cold_index_imports_all_modules(self):
+        registry = self.build_registry()
+
+        self.assertTrue(os.path.exists(self.index_path))
+        self.assertIn(PACKAGE + '.first', sys.modules)
+        self.assertIn(PACKAGE + '.second', sys.modules)
+        self.assertEqual('FirstAction', registry.get('FirstAction').__name__)
+
+    def test_index_directory_is_created(self):
+        self.index_path = os.path.join(self.tmp_dir, 'cache', 'index.json')
+
+        self.build_registry()
+
+        self.assertTrue(os.path.exists(self.index_path))
+
+    def test_home_is_expanded_in_index_path(self):
+        with mock.patch.dict(os.environ, {'HOME': self.tmp_dir}):
+            registry = action_registry.ActionRegistry('~/index.json')
+
+        self.assertEqual(os.path.join(self.tmp_dir, 'index.json'),
+                         registry.index_path)
+
+    def test_warm_index_imports_only_referenced_modules(self):
+        self.build_registry()
+        self.unload_modules()
+
+        registry = self.build_registry()
+        registry.get('SecondAction')
+
+        self.assertNotIn(PACKAGE + '.first', sys.modules)
+        self.assertIn(PACKAGE + '.second', sys.modules)
+
+    def test_modified_module_is_reindexed(self):
+        self.build_registry()
+        self.unload_modules()
+        self.write_module('first', 'RenamedAction')
+        module_path = os.path.join(self.package_dir, 'first.py')
+        mtime = os.path.getmtime(module_path) + 10
+        os.utime(module_path, (mtime, mtime))
+        if os.path.exists(module_path + 'c'):
+            os.remove(module_path + 'c')
+
+        registry = self.build_registry()
+
+        self.assertEqual('RenamedAction',
+                         registry.get('RenamedAction').__name__)
+        self.assertRaises(action_registry.ActionNotFound, registry.get,
+                          'FirstAction')
+        self.assertNotIn(PACKAGE + '.second', sys.modules)
@@ -0,0 +1,149 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+
+from cloudferrylib.scheduler import checkpoint
+from cloudferrylib.scheduler import cursor
+from cloudferrylib.scheduler import namespace
+from cloudferrylib.scheduler import scheduler
+from cloudferrylib.scheduler import task
+from cloudferrylib.scheduler import thread_tasks
+
+from tests import test
+
+
+class CountTask(task.Task):
+    def __init__(self, name, fail=False):
+        super(CountTask, self).__init__()
+        self.name = name
+        self.fail = fail
+        self.calls = 0
+
+    def run(self, **kwargs):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError('fail')
+        return {self.name: self.calls}
+
+    def __repr__(self):
+        return "CountTask|%s" % self.name
+
+
+class ChooseBranch(task.Task):
+    def run(self, **kwargs):
+        self.num_element = 2
+
+
+class CheckpointTestCase(test.TestCase):
+    def setUp(self):
+        super(CheckpointTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'migration.state')
+
+    def run_scheduler(self, migration, resume=False, rollback=None):
+        s = scheduler.Scheduler(
+            namespace=namespace.Namespace({'__init_task__': {}}),
+            migration=migration,
+            rollback=rollback,
+            checkpoint=checkpoint.Checkpoint(self.path, resume=resume))
+        s.start()
+        return s
+
+    def test_resume_skips_completed_tasks(self):
+        tasks = [CountTask('a'), CountTask('b', fail=True), CountTask('c')]
+        s = self.run_scheduler(tasks)
+        self.assertEqual(scheduler.ERROR_MIGRATION_FAILED, s.status_error)
+        self.assertTrue(os.path.exists(self.path))
+
+        tasks[1].fail = False
+        s = self.run_scheduler(tasks, resume=True)
+
+        self.assertEqual(scheduler.NO_ERROR, s.status_error)
+        self.assertEqual([1, 2, 1], [t.calls for t in tasks])
+        self.assertEqual(1, s.namespace.vars['a'])
+        self.assertEqual(2, s.namespace.vars['b'])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_resume_follows_same_branch(self):
+        choose = ChooseBranch()
+        skipped = CountTask('skipped')
+        chosen = CountTask('chosen')
+        last = CountTask('last', fail=True)
+        net = (choose | (skipped - last) | (chosen - last)) >> last
+        self.run_scheduler(cursor.Cursor(net))
+        self.assertEqual(1, chosen.calls)
+
+        # branch chosen before must be restored without running the task
+        choose.num_element = cursor.DEFAULT
+        choose.run = None
+        last.fail = False
+        self.run_scheduler(cursor.Cursor(net), resume=True)
+
+        self.assertEqual(0, skipped.calls)
+        self.assertEqual(1, chosen.calls)
+        self.assertEqual(2, last.calls)
+
+    def test_unpicklable_values_are_not_stored(self):
+        state = checkpoint.Checkpoint(self.path)
+        ns = namespace.Namespace({'lock': threading.Lock(), 'value': 1})
+        state.task_completed(scheduler.STEP_MIGRATION, CountTask('a'), ns)
+
+        restored = checkpoint.Checkpoint(self.path, resume=True)
+
+        self.assertEqual({'value': 1}, restored.namespace)
+
+    def test_mismatched_scenario_raises(self):
+        state = checkpoint.Checkpoint(self.path)
+        ns = namespace.Namespace({})
+        state.task_completed(scheduler.STEP_MIGRATION, CountTask('a'), ns)
+
+        self.assertRaises(checkpoint.CheckpointError,
+                          checkpoint.Checkpoint.skip, CountTask('b'),
+                          state.completed_steps(scheduler.STEP_MIGRATION)[0])
+
+    def test_resume_without_state_file_raises(self):
+        self.assertRaises(checkpoint.CheckpointError,
+                          checkpoint.Checkpoint, self.path, resume=True)
+
+    def test_state_is_removed_after_rollback(self):
+        self.run_scheduler([CountTask('a', fail=True)],
+                           rollback=[CountTask('r')])
+
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_branch_is_saved_when_joined(self):
+        state = checkpoint.Checkpoint(self.path)
+        ns = namespace.Namespace({})
+        branch = thread_tasks.WrapThreadTask()
+        state.task_completed(scheduler.STEP_MIGRATION, CountTask('a'), ns)
+        state.task_completed(scheduler.STEP_MIGRATION, branch, ns)
+        state.task_completed(scheduler.STEP_MIGRATION, CountTask('b'), ns)
+
+        # branch which is not joined is run again when resumed
+        restored = checkpoint.Checkpoint(self.path, resume=True)
+        self.assertEqual(['CountTask|a'], [
+            step['task'] for step in
+            restored.completed_steps(scheduler.STEP_MIGRATION)])
+
+        state.task_completed(scheduler.STEP_MIGRATION,
+                             thread_tasks.WaitThreadTask(branch), ns)
+
+        restored = checkpoint.Checkpoint(self.path, resume=True)
+        self.assertEqual(4, len(restored.completed_steps(
+            scheduler.STEP_MIGRATION)))
@@ -0,0 +1,170 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import time
+
+from cloudferrylib.scheduler import cursor
+from cloudferrylib.scheduler import executor
+from cloudferrylib.scheduler import namespace
+from cloudferrylib.scheduler import resource_limits
+from cloudferrylib.scheduler import scheduler
+from cloudferrylib.scheduler import task
+from cloudferrylib.scheduler import thread_tasks
+
+from tests import test
+
+
+class SetVar(task.Task):
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+        super(SetVar, self).__init__()
+
+    def run(self, **kwargs):
+        return {self.name: self.value}
+
+
+class DeleteVar(task.Task):
+    def __init__(self, name):
+        self.name = name
+        super(DeleteVar, self).__init__()
+
+    def __call__(self, namespace=None):
+        del namespace.vars[self.name]
+
+
+class Fail(task.Task):
+    def run(self, **kwargs):
+        raise ValueError("branch failed")
+
+
+def run_branches(executor_name, *branches):
+    wait_all = thread_tasks.WaitThreadAllTask()
+    net = task.Task()
+    for branch in branches:
+        net = net & thread_tasks.WrapThreadTask(branch)
+    ns = namespace.Namespace({'shared': 'parent', 'old': 1})
+    s = scheduler.Scheduler(namespace=ns,
+                            migration=cursor.Cursor(net >> wait_all),
+                            executor=executor.get_executor(executor_name))
+    s.start()
+    return s
+
+
+class ExecutorTestCase(test.TestCase):
+    def test_get_executor(self):
+        self.assertIsInstance(executor.get_executor(None),
+                              executor.ProcessExecutor)
+        self.assertIsInstance(executor.get_executor('thread'),
+                              executor.ThreadExecutor)
+        thread_executor = executor.get_executor({'type': 'thread',
+                                                 'workers': 2})
+        self.assertEqual(2, thread_executor.workers)
+        self.assertRaises(ValueError, executor.get_executor, 'fiber')
+
+    def test_handle_returns_result(self):
+        for name in (executor.PROCESS, executor.THREAD):
+            handle = executor.get_executor(name).submit(lambda: ({'a': 1},
+                                                                 set()))
+            self.assertEqual(({'a': 1}, set()), handle.join())
+
+    def test_handle_reraises_exception(self):
+        def fail():
+            raise ValueError("fail")
+
+        for name in (executor.PROCESS, executor.THREAD):
+            handle = executor.get_executor(name).submit(fail)
+            self.assertRaises(ValueError, handle.join)
+
+    def test_wait_any_returns_finished_handle(self):
+        for name in (executor.PROCESS, executor.THREAD):
+            submit = executor.get_executor(name).submit
+            handles = [submit(lambda: time.sleep(1)), submit(lambda: None)]
+            self.assertEqual(1, executor.wait_any(handles))
+            self.assertFalse(handles[0].done())
+            handles[0].join()
+            self.assertTrue(handles[0].done())
+
+    def test_unpicklable_result_of_process(self):
+        handle = executor.ProcessExecutor().submit(lambda: lambda: None)
+        self.assertRaises(executor.BranchError, handle.join)
+
+
+class RunLimitedTestCase(test.TestCase):
+    def setUp(self):
+        super(RunLimitedTestCase, self).setUp()
+        self.limits = resource_limits.ResourceLimits({'pool': 1})
+        self.addCleanup(self.limits.cleanup)
+        self.finished = []
+
+    def run_items(self, items, **kwargs):
+        def work(item):
+            time.sleep(item[1])
+            if item[0] == 'bad':
+                raise ValueError(item)
+
+        def finish(item, handle):
+            self.finished.append(item[0])
+            try:
+                handle.join()
+            except ValueError:
+                return True
+            return False
+
+        return executor.run_limited(
+            items, lambda item: executor.ThreadExecutor().submit(
+                lambda: work(item)),
+            finish, lambda item: [('pool', item[2])], self.limits, **kwargs)
+
+    def test_items_finish_in_completion_order(self):
+        failed = self.run_items([('slow', 0.5, 'a'), ('b1', 0, 'b'),
+                                 ('b2', 0, 'b'), ('b3', 0, 'b')], workers=2)
+
+        self.assertEqual(0, failed)
+        self.assertEqual(['b1', 'b2', 'b3', 'slow'], self.finished)
+
+    def test_no_items_are_started_after_failure(self):
+        failed = self.run_items([('bad', 0, 'a'), ('next', 0, 'a')],
+                                stop_on_failure=True)
+
+        self.assertEqual(1, failed)
+        self.assertEqual(['bad'], self.finished)
+
+
+class ParallelBranchesTestCase(test.TestCase):
+    def check_merged(self, executor_name):
+        s = run_branches(executor_name,
+                         SetVar('first', 1) >> DeleteVar('old'),
+                         SetVar('second', 2))
+
+        self.assertEqual(scheduler.NO_ERROR, s.status_error)
+        self.assertEqual(1, s.namespace.vars['first'])
+        self.assertEqual(2, s.namespace.vars['second'])
+        self.assertEqual('parent', s.namespace.vars['shared'])
+        self.assertNotIn('old', s.namespace.vars)
+        self.assertEqual({}, s.namespace.vars[namespace.CHILDREN])
+
+    def test_process_branches_are_merged(self):
+        self.check_merged(executor.PROCESS)
+
+    def test_thread_branches_are_merged(self):
+        self.check_merged(executor.THREAD)
+
+    def test_branch_failure_fails_parent(self):
+        for name in (executor.PROCESS, executor.THREAD):
+            s = run_branches(name, Fail(), SetVar('second', 2))
+
+            self.assertEqual(scheduler.ERROR_MIGRATION_FAILED,
+                             s.status_error)
+            self.assertIsInstance(s.exception, ValueError)
@@ -0,0 +1,103 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+
+from cloudferrylib.scheduler import namespace
+
+from tests import test
+
+
+class NamespaceTestCase(test.TestCase):
+    def setUp(self):
+        super(NamespaceTestCase, self).setUp()
+        self.info = {'instances': {'id1': {'name': 'vm1'}}}
+        self.parent = namespace.Namespace({'info': self.info, 'a': 1})
+
+    def test_fork_shares_values(self):
+        forked = self.parent.fork()
+
+        self.assertIs(self.info, forked.vars['info'])
+        self.assertEqual(self.parent.vars[namespace.CHILDREN],
+                         forked.vars[namespace.CHILDREN])
+        self.assertEqual(sorted(self.parent.vars), sorted(forked.vars))
+
+    def test_fork_stores_only_changed_keys(self):
+        forked = self.parent.fork()
+
+        forked.vars.update({'a': 2, 'b': 3})
+        del forked.vars['info']
+
+        self.assertEqual({'a': 2, 'b': 3, namespace.CHILDREN: {}},
+                         forked.vars.data)
+        self.assertEqual(({'a': 2, 'b': 3}, {'info'}),
+                         forked.changes())
+        self.assertNotIn('info', forked.vars)
+        self.assertEqual(1, self.parent.vars['a'])
+        self.assertIn('info', self.parent.vars)
+        self.assertNotIn('b', self.parent.vars)
+
+    def test_fork_keeps_state_as_of_fork_time(self):
+        forked = self.parent.fork()
+        nested = forked.fork()
+
+        self.parent.vars['a'] = 10
+        self.parent.vars['new'] = 1
+        del self.parent.vars['info']
+
+        for ns in (forked, nested):
+            self.assertEqual(1, ns.vars['a'])
+            self.assertNotIn('new', ns.vars)
+            self.assertIs(self.info, ns.vars['info'])
+        self.assertEqual((({}, set())), forked.changes())
+
+    def test_deep_fork_copies_values(self):
+        forked = self.parent.fork(is_deep_copy=True)
+
+        forked.vars['info']['instances']['id1']['name'] = 'changed'
+
+        self.assertEqual('vm1', self.info['instances']['id1']['name'])
+        self.assertEqual(({}, set()), forked.changes())
+
+    def test_deep_fork_does_not_see_parent_changes_in_place(self):
+        forked = self.parent.fork(is_deep_copy=True)
+
+        self.parent.vars['info']['instances']['id1']['name'] = 'changed'
+        self.parent.vars['a'] = 2
+
+        self.assertEqual('vm1',
+                         forked.vars['info']['instances']['id1']['name'])
+        self.assertEqual(1, forked.vars['a'])
+
+    def test_merge(self):
+        forked = self.parent.fork()
+        forked.vars['a'] = 2
+        forked.vars['b'] = 3
+        del forked.vars['info']
+        forked.vars[namespace.CHILDREN] = {'child': None}
+
+        self.parent.merge(forked)
+
+        self.assertEqual(2, self.parent.vars['a'])
+        self.assertEqual(3, self.parent.vars['b'])
+        self.assertNotIn('info', self.parent.vars)
+        self.assertEqual({}, self.parent.vars[namespace.CHILDREN])
+
+    def test_run_task_with_forked_namespace(self):
+        forked = self.parent.fork()
+
+        def run(a=None, **kwargs):
+            return a, sorted(kwargs)
+
+        self.assertEqual((1, [namespace.CHILDREN, 'info']),
+                         run(**forked.vars))
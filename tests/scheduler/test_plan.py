@@ -0,0 +1,196 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import threading
+
+from cloudferrylib.scheduler import cursor
+from cloudferrylib.scheduler import namespace
+from cloudferrylib.scheduler import plan
+from cloudferrylib.scheduler import scheduler
+from cloudferrylib.scheduler import task
+
+from tests import test
+
+
+class ReadA(task.Task):
+    thread_safe = True
+
+    def run(self, a=None, **kwargs):
+        return {'b': a, 'c': kwargs.get('c')}
+
+
+class WriteD(task.Task):
+    thread_safe = True
+
+    def run(self, **kwargs):
+        return {'d': kwargs['x']}
+
+
+class ReadB(task.Task):
+    thread_safe = True
+
+    def run(self, b=None, **kwargs):
+        return {'e': b}
+
+
+class PassKwargs(task.Task):
+    thread_safe = True
+
+    def run(self, **kwargs):
+        return dict(kwargs)
+
+
+class Unsafe(task.Task):
+    def run(self, **kwargs):
+        return {'f': 1}
+
+
+class Rendezvous(task.Task):
+    """Thread safe task which passes only when run concurrently"""
+    thread_safe = True
+
+    def __init__(self, barrier):
+        self.barrier = barrier
+        super(Rendezvous, self).__init__()
+
+    def run(self, **kwargs):
+        self.barrier.wait()
+
+
+class Switch(task.Task):
+    def run(self, **kwargs):
+        self.num_element = 1
+
+
+class Fail(task.Task):
+    thread_safe = True
+
+    def run(self, **kwargs):
+        raise ValueError("failed")
+
+
+class AccessTestCase(test.TestCase):
+    def test_reads_and_writes(self):
+        self.assertEqual(({'a', 'c'}, {'b', 'c'}), plan.get_access(ReadA()))
+        self.assertEqual(({'x'}, {'d'}), plan.get_access(WriteD()))
+
+    def test_unknown_access(self):
+        self.assertEqual((plan.ANY, plan.ANY),
+                         plan.get_access(PassKwargs()))
+        self.assertEqual((plan.ANY, plan.ANY),
+                         plan.get_access(object()))
+
+
+class PlanTestCase(test.TestCase):
+    def test_dependencies(self):
+        net = ReadA() >> WriteD() >> ReadB() >> Unsafe() >> WriteD()
+
+        compiled = plan.build_plan(net)
+
+        self.assertEqual([set(), set(), {0}, {0, 1, 2}, {3}],
+                         [node.deps for node in compiled])
+        self.assertEqual([False, False, False, True, False],
+                         [node.barrier for node in compiled])
+
+    def test_critical_path(self):
+        net = ReadA() >> WriteD() >> ReadB()
+
+        total, path = plan.build_plan(net).critical_path(
+            {'ReadA': 2, 'WriteD': 5})
+
+        self.assertEqual(5, total)
+        self.assertEqual(['WriteD'],
+                         [n.task.__class__.__name__ for n in path])
+        self.assertIn("Critical path (2 of 3 tasks, 2 steps)",
+                      plan.dump(plan.build_plan(net)))
+
+    def test_segments_follow_condition(self):
+        switch = Switch()
+        skipped = WriteD()
+        chosen = ReadB()
+        switch | chosen
+        net = ReadA() >> switch >> skipped
+        chosen - skipped
+
+        self.assertEqual(3, len(plan.build_plan(net)))
+        processed = []
+        for segment in plan.segments(net):
+            for node in segment:
+                run_task(node.task)
+                processed.append(node.task)
+        self.assertEqual(4, len(processed))
+        self.assertIs(chosen, processed[2])
+        self.assertIs(skipped, processed[3])
+
+
+class PlanRunnerTestCase(test.TestCase):
+    def test_independent_tasks_run_concurrently(self):
+        barrier = Barrier(2)
+        compiled = plan.build_plan(Rendezvous(barrier) >> Rendezvous(barrier))
+
+        self.assertEqual([set(), set()], [node.deps for node in compiled])
+        self.assertIsNone(plan.PlanRunner(2).run(compiled, run_task))
+
+    def test_failure_stops_plan(self):
+        after = Unsafe()
+        after.run = lambda **kwargs: self.fail("must not be run")
+        compiled = plan.build_plan(Fail() >> after)
+
+        failed_task, error = plan.PlanRunner(2).run(compiled, run_task)
+
+        self.assertIsInstance(failed_task, Fail)
+        self.assertIsInstance(error, ValueError)
+
+
+class SchedulerPlanTestCase(test.TestCase):
+    def test_scheduler_runs_plan(self):
+        ns = namespace.Namespace({'a': 1, 'x': 2})
+        net = ReadA() >> WriteD() >> ReadB() >> Unsafe()
+        s = scheduler.Scheduler(namespace=ns, migration=cursor.Cursor(net),
+                                plan_workers=4)
+        s.start()
+
+        self.assertEqual(scheduler.NO_ERROR, s.status_error)
+        self.assertEqual({'b': 1, 'd': 2, 'e': 1, 'f': 1},
+                         {k: ns.vars[k] for k in 'bdef'})
+
+    def test_scheduler_failure(self):
+        rollback = Unsafe()
+        s = scheduler.Scheduler(migration=cursor.Cursor(ReadA() >> Fail()),
+                                rollback=[rollback], plan_workers=4)
+        s.start()
+
+        self.assertEqual(scheduler.ERROR_MIGRATION_FAILED, s.status_error)
+        self.assertIsInstance(s.exception, ValueError)
+        self.assertEqual(1, s.namespace.vars['f'])
+
+
+class Barrier(object):
+    def __init__(self, parties):
+        self.parties = parties
+        self.arrived = 0
+        self.condition = threading.Condition()
+
+    def wait(self):
+        with self.condition:
+            self.arrived += 1
+            self.condition.notify_all()
+            while self.arrived < self.parties:
+                if not self.condition.wait(5) and \
+                        self.arrived < self.parties:
+                    raise RuntimeError("tasks were not run concurrently")
+
+
+def run_task(t):
+    t(namespace=namespace.Namespace({'x': 1}))
@@ -0,0 +1,144 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import multiprocessing
+import os
+import threading
+import time
+
+from cloudferrylib.scheduler import cursor
+from cloudferrylib.scheduler import executor
+from cloudferrylib.scheduler import namespace
+from cloudferrylib.scheduler import resource_limits
+from cloudferrylib.scheduler import scheduler
+from cloudferrylib.scheduler import task
+from cloudferrylib.scheduler import thread_tasks
+
+from tests import test
+
+HOST = (resource_limits.COMPUTE_HOST, 'host1')
+
+
+class UseHost(task.Task):
+    """Records how many tasks use host at once"""
+
+    def __init__(self, usage):
+        self.usage = usage
+        super(UseHost, self).__init__()
+
+    def occupied_resources(self, **kwargs):
+        return [HOST]
+
+    def run(self, **kwargs):
+        with self.usage.get_lock():
+            self.usage[0] += 1
+            self.usage[1] = max(self.usage[0], self.usage[1])
+        time.sleep(0.2)
+        with self.usage.get_lock():
+            self.usage[0] -= 1
+
+
+class ResourceLimitsTestCase(test.TestCase):
+    def setUp(self):
+        super(ResourceLimitsTestCase, self).setUp()
+        self.limits = resource_limits.ResourceLimits(
+            {resource_limits.COMPUTE_HOST: 2, resource_limits.STORAGE: 0})
+        self.addCleanup(self.limits.cleanup)
+
+    def test_cap(self):
+        first = self.limits.try_acquire([HOST])
+        second = self.limits.try_acquire([HOST])
+
+        self.assertIsNotNone(second)
+        self.assertIsNone(self.limits.try_acquire([HOST]))
+        self.assertIsNotNone(self.limits.try_acquire(
+            [(resource_limits.COMPUTE_HOST, 'host2')]))
+        first.release()
+        self.assertIsNotNone(self.limits.try_acquire([HOST]))
+
+    def test_unlimited_resources(self):
+        for _ in range(5):
+            self.assertIsNotNone(self.limits.try_acquire(
+                [(resource_limits.STORAGE, 'ceph'), ('unknown', 'key')]))
+
+    def test_all_or_nothing(self):
+        holds = [self.limits.try_acquire([HOST]) for _ in range(2)]
+
+        self.assertIsNone(self.limits.try_acquire(
+            [(resource_limits.COMPUTE_HOST, 'host2'), HOST]))
+        self.assertIsNotNone(self.limits.try_acquire(
+            [(resource_limits.COMPUTE_HOST, 'host2')] * 2))
+        for hold in holds:
+            hold.release()
+
+    def test_limits_are_shared_with_processes(self):
+        hold = self.limits.try_acquire([HOST])
+        result = multiprocessing.Queue()
+
+        def child():
+            second = self.limits.try_acquire([HOST])
+            result.put(second is not None and
+                       self.limits.try_acquire([HOST]) is None)
+
+        p = multiprocessing.Process(target=child)
+        p.start()
+        p.join()
+        self.assertTrue(result.get())
+        hold.release()
+
+    def test_cleanup(self):
+        self.limits.try_acquire([HOST]).release()
+        self.limits.cleanup()
+        self.assertFalse(os.path.exists(self.limits.lock_dir))
+
+
+class SchedulerLimitsTestCase(test.TestCase):
+    def check_branches(self, executor_name):
+        limits = resource_limits.ResourceLimits(
+            {resource_limits.COMPUTE_HOST: 1})
+        self.addCleanup(limits.cleanup)
+        usage = multiprocessing.Array('i', 2)
+        net = task.Task()
+        for _ in range(3):
+            net = net & thread_tasks.WrapThreadTask(UseHost(usage))
+        s = scheduler.Scheduler(
+            namespace=namespace.Namespace({}),
+            migration=cursor.Cursor(net >> thread_tasks.WaitThreadAllTask()),
+            executor=executor.get_executor(executor_name), limits=limits)
+
+        s.start()
+
+        self.assertEqual(scheduler.NO_ERROR, s.status_error)
+        self.assertEqual([0, 1], list(usage))
+
+    def test_thread_branches(self):
+        self.check_branches(executor.THREAD)
+
+    def test_process_branches(self):
+        self.check_branches(executor.PROCESS)
+
+    def test_task_waits_for_resource(self):
+        limits = resource_limits.ResourceLimits(
+            {resource_limits.COMPUTE_HOST: 1})
+        self.addCleanup(limits.cleanup)
+        hold = limits.try_acquire([HOST])
+        threading.Timer(0.3, hold.release).start()
+        usage = multiprocessing.Array('i', 2)
+        s = scheduler.Scheduler(migration=[UseHost(usage)], limits=limits)
+
+        start = time.time()
+        s.start()
+
+        self.assertGreaterEqual(time.time() - start, 0.3)
+        self.assertEqual(scheduler.NO_ERROR, s.status_error)
@@ -0,0 +1,71 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import mock
+
+from cloudferrylib.scheduler import cursor
+from cloudferrylib.scheduler import scenario
+from cloudferrylib.scheduler import task
+
+from tests import test
+
+PROCESS = [
+    {'first': True},
+    {'loop': [
+        {'second': True},
+        {'inner': [
+            {'third': True},
+            {'fourth': True},
+        ]},
+    ]},
+]
+
+
+class NamedTask(task.Task):
+    def __init__(self, name):
+        super(NamedTask, self).__init__()
+        self.name = name
+
+
+def make_tasks(init):
+    return {name: NamedTask(name)
+            for name in ('first', 'second', 'third', 'fourth')}
+
+
+class ScenarioTestCase(test.TestCase):
+    def setUp(self):
+        super(ScenarioTestCase, self).setUp()
+        self.scenario = scenario.Scenario(None, 'scenario.yaml')
+        mock.patch.object(self.scenario, 'make_tasks',
+                          side_effect=make_tasks).start()
+        self.scenario.init_tasks({})
+        self.scenario.migration = PROCESS
+
+    def test_find_chain(self):
+        self.assertEqual(PROCESS[1]['loop'][1]['inner'],
+                         scenario.find_chain(PROCESS, 'inner'))
+        self.assertIsNone(scenario.find_chain(PROCESS, 'first'))
+
+    def test_chain_net_is_built_of_new_tasks(self):
+        net = self.scenario.construct_net(PROCESS, self.scenario.tasks)
+
+        chain = self.scenario.chain_net('loop')
+
+        self.assertEqual(['second', 'third', 'fourth'],
+                         [t.name for t in cursor.Cursor(chain)])
+        self.assertEqual(['first', 'second', 'third', 'fourth'],
+                         [t.name for t in cursor.Cursor(net)])
+
+    def test_missing_chain(self):
+        self.assertRaises(ValueError, self.scenario.chain_net, 'missing')
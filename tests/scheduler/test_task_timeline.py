@@ -0,0 +1,90 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+from cloudferrylib.scheduler import namespace
+from cloudferrylib.scheduler import scheduler
+from cloudferrylib.scheduler import task
+from cloudferrylib.scheduler import task_timeline
+
+from tests import test
+
+
+class AddKey(task.Task):
+    def run(self, **kwargs):
+        return {'key': 'value'}
+
+
+class FailingTask(task.Task):
+    def run(self, **kwargs):
+        raise RuntimeError('fail')
+
+
+class TaskTimelineTestCase(test.TestCase):
+    def setUp(self):
+        super(TaskTimelineTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'timeline.jsonl')
+        self.timeline = task_timeline.TaskTimeline(self.path)
+
+    def test_records_every_task(self):
+        s = scheduler.Scheduler(namespace=namespace.Namespace({}),
+                                migration=[AddKey(), task.Task()],
+                                timeline=self.timeline)
+        s.start()
+
+        records = self.timeline.read()
+        self.assertEqual(['AddKey', 'Task'], [r['task'] for r in records])
+        self.assertEqual(1, records[0]['namespace_delta'])
+        for record in records:
+            self.assertIsNone(record['exception'])
+            self.assertEqual(os.getpid(), record['pid'])
+            self.assertGreaterEqual(record['duration'], 0)
+            self.assertEqual(record['end'] - record['start'],
+                             record['duration'])
+
+    def test_records_exception(self):
+        s = scheduler.Scheduler(migration=[FailingTask()],
+                                timeline=self.timeline)
+        s.start()
+
+        self.assertEqual(scheduler.ERROR_MIGRATION_FAILED, s.status_error)
+        records = self.timeline.read()
+        self.assertEqual(1, len(records))
+        self.assertIn('fail', records[0]['exception'])
+
+    def test_summary_sorted_by_cumulative_time(self):
+        for name, duration in [('A', 1.0), ('B', 5.0), ('A', 2.0)]:
+            self.timeline.write({'task': name, 'duration': duration,
+                                 'cpu_time': 0.1, 'rss_delta': 0,
+                                 'exception': None})
+
+        summary = self.timeline.summary()
+
+        self.assertEqual(['B', 'A'], [s['task'] for s in summary])
+        self.assertEqual(2, summary[1]['calls'])
+        self.assertEqual(3.0, summary[1]['cumulative'])
+        self.assertEqual(2.0, summary[1]['max'])
+
+    def test_report_is_written_when_scenario_ends(self):
+        s = scheduler.Scheduler(migration=[AddKey()], timeline=self.timeline)
+        s.start()
+
+        with open(self.path + task_timeline.SUMMARY_SUFFIX) as summary:
+            self.assertEqual('AddKey', json.load(summary)[0]['task'])